@@ -0,0 +1,24 @@
+import numpy as np
+import h5py
+import pytest
+
+
+def write_nexus(fname,img,label='sample',temperature=20.0,SDD=400.0,wavelength=6.0,x0=64.0,y0=60.0,monitor=1e8,transmission=0.8,thickness=0.1):
+    '''Minimal Nexus file with the fields read by the catalog, reduction and consolidation'''
+    with h5py.File(fname,'w') as h5:
+        h5['entry/sample/description'] = [label.encode()]
+        h5['entry/collection_time'] = [60.0]
+        h5['entry/DAS_logs/detectorPosition/softPosition'] = [SDD]
+        h5['entry/DAS_logs/wavelength/wavelength'] = [wavelength]
+        h5['entry/DAS_logs/temp/primaryNode/value'] = np.linspace(0,1,5)+temperature
+        h5['entry/instrument/detector/beam_center_x'] = [x0]
+        h5['entry/instrument/detector/beam_center_y'] = [y0]
+        h5['entry/control/monitor_counts'] = [monitor]
+        h5['entry/sample/transmission'] = [transmission]
+        h5['entry/sample/thickness'] = [thickness]
+        h5['entry/data/y'] = img.T
+
+
+@pytest.fixture
+def nexus_writer():
+    return write_nexus
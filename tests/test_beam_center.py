@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from typySANS.BeamCenter import fit_beam_centers,header_roi,beam_roi,read_image,moment_seed,NoBeamError
+
+X0,Y0 = 70.3,55.8 #true beam position [pixel indices]
+
+
+def direct_beam(shape=(128,128),x0=X0,y0=Y0,sigma=2.5):
+    y,x = np.indices(shape)
+    rng = np.random.default_rng(0)
+    beam = 5000.0*np.exp(-0.5*((x-x0)**2+(y-y0)**2)/sigma**2)+2.0
+    return rng.poisson(beam).astype(np.int32)
+
+
+@pytest.fixture
+def beam_file(tmp_path,nexus_writer):
+    fname = tmp_path/'trans.nxs.ngb'
+    # nominal header beam center a few pixels off the true one
+    nexus_writer(fname,direct_beam(),x0=67.0,y0=58.0)
+    return fname
+
+
+def test_no_beam():
+    with pytest.raises(NoBeamError):
+        moment_seed(np.ones((16,16)))
+    with pytest.raises(NoBeamError):
+        moment_seed(direct_beam(),mask=np.ones((128,128),dtype=bool))
+
+
+def test_header_roi(beam_file,tmp_path):
+    assert header_roi(beam_file)==beam_roi(67.0,58.0)
+    assert header_roi(beam_file,half_width=8)==beam_roi(67.0,58.0,8)
+    (tmp_path/'junk.nxs.ngb').write_bytes(b'not a data file')
+    assert header_roi(tmp_path/'junk.nxs.ngb') is None
+
+
+def test_default_roi_from_header(beam_file):
+    roi = header_roi(beam_file)
+    np.testing.assert_array_equal(read_image(beam_file,roi),direct_beam()[42:75,51:84])
+
+    full = fit_beam_centers([beam_file],max_workers=1,roi=False)
+    default = fit_beam_centers([beam_file],max_workers=1)
+    assert default.success.all() and full.success.all()
+    for name in ('x0','y0'):
+        assert default[name].iloc[0]==pytest.approx(full[name].iloc[0],abs=1e-3)
+    assert default.x0.iloc[0]==pytest.approx(X0,abs=0.05)
+    assert default.y0.iloc[0]==pytest.approx(Y0,abs=0.05)
+
+
+def test_catalog_is_keyed_by_fit_settings(beam_file,tmp_path,monkeypatch):
+    from typySANS import BeamCenter
+    from typySANS.Catalog import FileCatalog
+    fitted = []
+    fit_file = BeamCenter._fit_file
+    def counting_fit_file(args):
+        fitted.append(args[0])
+        return fit_file(args)
+    monkeypatch.setattr(BeamCenter,'_fit_file',counting_fit_file)
+
+    catalog = FileCatalog(tmp_path/'catalog.sqlite',cache_dir=tmp_path/'cache')
+    first = fit_beam_centers([beam_file],catalog=catalog,max_workers=1)
+    again = fit_beam_centers([beam_file],catalog=catalog,max_workers=1)
+    assert len(fitted)==1
+    assert again.x0.iloc[0]==pytest.approx(first.x0.iloc[0])
+
+    fit_beam_centers([beam_file],catalog=catalog,max_workers=1,roi=False)
+    fit_beam_centers([beam_file],catalog=catalog,max_workers=1,threshold=0.3)
+    mask = np.zeros((128,128),dtype=bool)
+    mask[0,0] = True
+    fit_beam_centers([beam_file],catalog=catalog,max_workers=1,mask=mask)
+    fit_beam_centers([beam_file],catalog=catalog,max_workers=1,mask=mask)
+    assert len(fitted)==4
+    catalog.close()
+
+
+def test_failed_fits_are_not_cataloged(tmp_path,nexus_writer):
+    from typySANS.Catalog import FileCatalog
+    fname = tmp_path/'blank.nxs.ngb'
+    nexus_writer(fname,np.ones((128,128),dtype=np.int32))
+    catalog = FileCatalog(tmp_path/'catalog.sqlite',cache_dir=tmp_path/'cache')
+    df = fit_beam_centers([fname],catalog=catalog,max_workers=1)
+    assert not df.success.iloc[0]
+    assert catalog.connection.execute('SELECT COUNT(*) FROM beam_centers').fetchone()[0]==0
+    catalog.close()
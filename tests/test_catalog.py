@@ -0,0 +1,99 @@
+import os
+import stat
+
+import numpy as np
+import pytest
+
+from typySANS.Catalog import FileCatalog
+
+
+def write_files(path,nexus_writer,n=3):
+    path.mkdir()
+    rng = np.random.default_rng(0)
+    files = []
+    for i in range(n):
+        fname = path/f'run{i}.nxs.ngb'
+        nexus_writer(fname,rng.poisson(10,(16,16)),f'sample {i}',SDD=100.0*(i+1))
+        files.append(fname)
+    return files
+
+
+def test_scan_nexus_prunes_deleted_files(tmp_path,nexus_writer):
+    files = write_files(tmp_path/'data',nexus_writer)
+    catalog = FileCatalog(tmp_path/'data',cache_dir=tmp_path/'cache')
+    assert catalog.path==tmp_path/'data'/'.typySANS_catalog.sqlite'
+
+    df = catalog.scan_nexus(tmp_path/'data',max_workers=1)
+    assert list(df.filename)==[f.name for f in files]
+    np.testing.assert_allclose(df.detectorDistance,[100.0,200.0,300.0])
+
+    files[1].unlink()
+    df = catalog.scan_nexus(tmp_path/'data',max_workers=1)
+    assert list(df.filename)==['run0.nxs.ngb','run2.nxs.ngb']
+    paths = [row[0] for row in catalog.connection.execute('SELECT path FROM nexus_metadata')]
+    assert len(paths)==2 and str(files[1].resolve()) not in paths
+    catalog.close()
+
+
+def test_scan_nexus_only_touches_its_directory(tmp_path,nexus_writer):
+    # '_' is a LIKE wildcard matching the 'A' of the sibling directory
+    catalog = FileCatalog(tmp_path/'catalog.sqlite',cache_dir=tmp_path/'cache')
+    data = write_files(tmp_path/'run_1',nexus_writer,n=1)
+    sibling = write_files(tmp_path/'runA1',nexus_writer,n=2)
+    sub = write_files(tmp_path/'run_1'/'sub',nexus_writer,n=2)
+    for path in ('run_1','runA1','run_1/sub'):
+        catalog.scan_nexus(tmp_path/path,max_workers=1)
+    sibling[0].unlink()
+    sub[0].unlink()
+
+    df = catalog.scan_nexus(tmp_path/'run_1',max_workers=1)
+    assert list(df.filename)==[f.name for f in data]
+    paths = {row[0] for row in catalog.connection.execute('SELECT path FROM nexus_metadata')}
+    assert paths=={str(f.resolve()) for f in data+sibling+sub}
+    catalog.close()
+
+
+def test_prune(tmp_path,nexus_writer):
+    files = write_files(tmp_path/'data',nexus_writer,n=2)
+    catalog = FileCatalog(tmp_path/'data',cache_dir=tmp_path/'cache')
+    catalog.scan_nexus(tmp_path/'data',max_workers=1)
+    files[0].unlink()
+    assert catalog.prune()==1
+    assert catalog.prune()==0
+    catalog.close()
+
+
+def test_unwritable_location_falls_back_to_cache(tmp_path):
+    # the parent directory of the catalog doesn't exist (and can't be written)
+    catalog = FileCatalog(tmp_path/'missing'/'catalog.sqlite',cache_dir=tmp_path/'cache')
+    assert catalog.path.parent==tmp_path/'cache'
+    assert catalog.path.exists()
+    catalog.close()
+
+    # the same location maps to the same fallback catalog
+    catalog = FileCatalog(tmp_path/'missing'/'catalog.sqlite',cache_dir=tmp_path/'cache')
+    assert list((tmp_path/'cache').iterdir())==[catalog.path]
+    catalog.close()
+
+
+def test_no_writable_location_falls_back_to_memory(tmp_path):
+    blocker = tmp_path/'file'
+    blocker.write_text('')
+    # the cache dir can't be created below a regular file
+    catalog = FileCatalog(tmp_path/'missing'/'catalog.sqlite',cache_dir=blocker/'cache')
+    assert catalog.path==':memory:'
+    catalog.close()
+
+
+@pytest.mark.skipif(hasattr(os,'geteuid') and os.geteuid()==0,reason='root ignores permissions')
+def test_read_only_data_directory(tmp_path,nexus_writer):
+    files = write_files(tmp_path/'data',nexus_writer,n=2)
+    os.chmod(tmp_path/'data',stat.S_IRUSR|stat.S_IXUSR)
+    try:
+        catalog = FileCatalog(tmp_path/'data',cache_dir=tmp_path/'cache')
+        assert catalog.path.parent==tmp_path/'cache'
+        df = catalog.scan_nexus(tmp_path/'data',max_workers=1)
+        assert list(df.filename)==[f.name for f in files]
+        catalog.close()
+    finally:
+        os.chmod(tmp_path/'data',stat.S_IRWXU)
@@ -0,0 +1,51 @@
+import contextlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from typySANS.Consolidate import consolidate,ConsolidatedStack,is_stack
+
+
+def string_inference(enabled):
+    '''pandas>=2.1 can infer the str dtype (the default from pandas 3)'''
+    if not enabled:
+        return contextlib.nullcontext()
+    try:
+        pd.get_option('future.infer_string')
+    except (KeyError,pd.errors.OptionError):
+        pytest.skip('pandas without future.infer_string')
+    return pd.option_context('future.infer_string',True)
+
+
+@pytest.mark.parametrize('infer_string',[False,True])
+def test_consolidate_round_trip(tmp_path,infer_string,nexus_writer):
+    rng = np.random.default_rng(0)
+    imgs = [rng.poisson(100,(128,128)).astype(np.int32) for i in range(3)]
+    files = []
+    for i,img in enumerate(imgs):
+        fname = tmp_path/f'run{i}.nxs.ngb'
+        nexus_writer(fname,img,f'sample {i}',20.0+i)
+        files.append(fname)
+
+    out = tmp_path/'stack.h5'
+    with string_inference(infer_string):
+        consolidate(files,out,max_workers=1)
+    assert is_stack(out)
+    assert not is_stack(files[0])
+
+    with ConsolidatedStack(out) as stack:
+        assert stack.shape==(3,128,128)
+        metadata = stack.metadata
+        assert list(metadata['filename'])==[f.name for f in files]
+        assert list(metadata['label'])==['sample 0','sample 1','sample 2']
+        np.testing.assert_allclose(metadata['DAS_logs/temp/primaryNode/value'],[20.0,21.0,22.0])
+        np.testing.assert_allclose(metadata['monitor'],1e8)
+
+        np.testing.assert_array_equal(stack.frame(1),imgs[1])
+        np.testing.assert_array_equal(stack.frame('run2.nxs.ngb'),imgs[2])
+        np.testing.assert_array_equal(stack.frames([2,0,2]),np.stack([imgs[2],imgs[0],imgs[2]]))
+
+        frame = stack.read_frame('run0.nxs.ngb')
+        assert frame['geometry']=={'SDD':400.0,'wavelength':6.0,'x0':64.0,'y0':60.0,'pixel_size':0.00508}
+        assert frame['thickness']==pytest.approx(0.1)
@@ -0,0 +1,70 @@
+import numpy as np
+import h5py
+import pytest
+
+from typySANS.DASLogs import read_das_logs,extract_das_logs,summarize_das_logs,DAS_LOG_COLUMNS
+
+
+def write_logs(fname,nexus_writer,temperature=20.0):
+    nexus_writer(fname,np.zeros((8,8),dtype=np.int32),temperature=temperature)
+    with h5py.File(fname,'a') as h5:
+        logs = h5['entry/DAS_logs']
+        logs['temp/primaryNode/time'] = np.arange(5,dtype=float)*10.0
+        logs['magnet/field'] = [1.0,2.0,3.0]
+        logs['magnet/time'] = [0.0,1.0,2.0,3.0] #doesn't match field
+        logs['magnet/name'] = np.bytes_('coil')  #not numeric
+
+
+def test_time_axes(tmp_path,nexus_writer):
+    fname = tmp_path/'run0.nxs.ngb'
+    write_logs(fname,nexus_writer)
+    df = read_das_logs(fname)
+    assert list(df.columns)==DAS_LOG_COLUMNS
+    assert set(df.channel)=={
+        'temp/primaryNode/value',
+        'magnet/field',
+        'detectorPosition/softPosition',
+        'wavelength/wavelength',
+    }
+
+    temp = df[df.channel=='temp/primaryNode/value']
+    np.testing.assert_allclose(temp['time'],[0.0,10.0,20.0,30.0,40.0])
+    np.testing.assert_allclose(temp['value'],np.linspace(0,1,5)+20.0)
+    assert list(temp['index'])==[0,1,2,3,4]
+
+    field = df[df.channel=='magnet/field']
+    assert field['time'].isna().all()
+    np.testing.assert_allclose(field['value'],[1.0,2.0,3.0])
+
+    assert (df['path']==str(fname)).all()
+    assert (df['filename']=='run0.nxs.ngb').all()
+
+
+def test_extract_skips_unreadable_files(tmp_path,nexus_writer):
+    good = tmp_path/'run0.nxs.ngb'
+    write_logs(good,nexus_writer)
+    bad = tmp_path/'run1.nxs.ngb'
+    bad.write_bytes(b'not hdf5')
+    df = extract_das_logs([good,bad,tmp_path/'missing.nxs.ngb'],max_workers=1)
+    assert set(df['path'])=={str(good)}
+
+    assert extract_das_logs([bad],max_workers=1).shape[0]==0
+
+
+def test_summary_per_path(tmp_path,nexus_writer):
+    files = []
+    for i,directory in enumerate(['a','b']):
+        (tmp_path/directory).mkdir()
+        fname = tmp_path/directory/'run0.nxs.ngb'
+        write_logs(fname,nexus_writer,temperature=20.0+10*i)
+        files.append(fname)
+
+    df = extract_das_logs(files,groups=['temp','magnet'],max_workers=2,chunksize=1)
+    assert set(df.channel)=={'temp/primaryNode/value','magnet/field'}
+    summary = summarize_das_logs(df)
+    # same file name in two directories stays two rows
+    assert list(summary.index)==[str(f) for f in files]
+    np.testing.assert_allclose(summary['temp/primaryNode/value'],[20.5,30.5])
+    np.testing.assert_allclose(summary['magnet/field'],[2.0,2.0])
+    last = summarize_das_logs(df,agg='last')
+    np.testing.assert_allclose(last['temp/primaryNode/value'],[21.0,31.0])
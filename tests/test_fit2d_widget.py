@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('ipywidgets')
+pytest.importorskip('plotly')
+from typySANS.Fit2DWidget import Fit2DWidget_DataModel
+from typySANS.FitUtil import init_gaussian2D_jacobian_lmfit
+
+
+def test_blank_image_does_not_fail():
+    model,params = init_gaussian2D_jacobian_lmfit()
+    data_model = Fit2DWidget_DataModel(np.ones((128,128)),model,params)
+    assert data_model.fit_result is not None
+
+
+def test_windowed_fit():
+    y,x = np.indices((64,64))
+    img = 100.0*np.exp(-0.5*((x-30.4)**2+(y-25.7)**2)/2.0**2)+1.0
+    model,params = init_gaussian2D_jacobian_lmfit()
+    data_model = Fit2DWidget_DataModel(img,model,params)
+    assert data_model.fit_result.params['x0'].value==pytest.approx(30.4,abs=1e-3)
+    assert data_model.fit_result.params['y0'].value==pytest.approx(25.7,abs=1e-3)
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from typySANS.FitUtil import find_peaks_1D,auto_seed_1D,fit_peaks_1D
+
+CENTERS = [0.1076,0.2152,0.3228] #AgBeh orders 1-3
+
+
+def sans_curve(peaks=True,sigma=0.004):
+    '''Steep power law background with gaussian peaks of 30% of the local background'''
+    q = np.linspace(0.02,0.4,300)
+    background = 0.5/q**1.5
+    I = background.copy()
+    if peaks:
+        for center in CENTERS:
+            I += 0.3*0.5/center**1.5*np.exp(-0.5*((q-center)/sigma)**2)
+    return q,I
+
+
+def test_peaks_on_steep_background_are_found():
+    q,I = sans_curve()
+    seeds = find_peaks_1D(q,I)
+    assert len(seeds)==3
+    dq = q[1]-q[0]
+    for seed,center in zip(seeds,CENTERS):
+        assert abs(seed['center']-center)<=dq
+        assert seed['sigma']==pytest.approx(0.004,rel=0.2)
+        assert seed['height']==pytest.approx(0.3*0.5/center**1.5,rel=0.1)
+
+
+def test_fit_of_detected_peaks():
+    q,I = sans_curve()
+    result = fit_peaks_1D(q,I,degree=4)
+    centers = sorted(result.params[f'p{i}_center'].value for i in range(3))
+    np.testing.assert_allclose(centers,CENTERS,atol=1e-3)
+
+
+def test_no_peaks_falls_back_to_default_model():
+    q,I = sans_curve(peaks=False)
+    assert find_peaks_1D(q,I)==[]
+    model,params,keep = auto_seed_1D(q,I)
+    assert 'center' in params and 'intercept' in params
+    assert keep.all()
+
+
+def test_widget_data_model_without_peaks():
+    pytest.importorskip('ipywidgets')
+    pytest.importorskip('plotly')
+    from typySANS.Fit1DWidget import Fit1DWidget_DataModel
+
+    q,I = sans_curve()
+    data_model = Fit1DWidget_DataModel(q,I)
+    assert len(data_model.fit_result.params)>3
+
+    q,I = sans_curve(peaks=False)
+    data_model.update_data(q,I)
+    assert data_model.fit_result is not None
@@ -0,0 +1,112 @@
+import ftplib
+import socket
+import threading
+
+import pytest
+
+pytest.importorskip('pyftpdlib')
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.servers import ThreadedFTPServer
+
+from typySANS.FTP import FTP
+
+
+class Server:
+    '''Local anonymous FTP server counting logins and RETR commands'''
+    def __init__(self,root):
+        self.root = root
+        self.logins = 0
+        self.retrs = 0
+        self.lock = threading.Lock()
+
+        authorizer = DummyAuthorizer()
+        authorizer.add_anonymous(str(root))
+        server = self
+        class Handler(FTPHandler):
+            def on_login(self,username):
+                with server.lock:
+                    server.logins += 1
+            def ftp_RETR(self,file):
+                with server.lock:
+                    server.retrs += 1
+                return super().ftp_RETR(file)
+        Handler.authorizer = authorizer
+
+        self.server = ThreadedFTPServer(('127.0.0.1',0),Handler)
+        self.port = self.server.address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever,kwargs={'timeout':0.05},daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.close_all()
+        self.thread.join(5)
+
+
+@pytest.fixture
+def server(tmp_path):
+    root = tmp_path/'remote'
+    (root/'data').mkdir(parents=True)
+    for i in range(6):
+        (root/'data'/f'run{i}.nxs.ngb').write_bytes(bytes([i])*(1000+i))
+    (root/'data'/'notes.txt').write_text('skip me')
+    server = Server(root)
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def client(server):
+    ftp = FTP('127.0.0.1',max_workers=2,port=server.port,retries=2,timeout=5)
+    yield ftp
+    ftp.stop()
+
+
+def test_connections_are_reused(server,client,tmp_path):
+    dest = tmp_path/'local'
+    dest.mkdir()
+    # pyftpdlib lists bare names where the NCNR server lists full paths
+    listing = client.get_file_list('data')
+    client.download_filelist(['data/'+name for name in listing],dest)
+    client.download_filelist([f'data/run{i}.nxs.ngb' for i in (0,1)],dest)
+
+    names = sorted(p.name for p in dest.iterdir())
+    assert names==[f'run{i}.nxs.ngb' for i in range(6)]
+    for i in range(6):
+        assert (dest/f'run{i}.nxs.ngb').read_bytes()==bytes([i])*(1000+i)
+    assert server.retrs==8
+    # one login per worker thread, not per file
+    assert 1<=server.logins<=client.max_workers
+
+
+def test_dropped_connection_is_reopened(server,tmp_path):
+    client = FTP('127.0.0.1',max_workers=1,port=server.port,retries=2,timeout=5)
+    try:
+        dest = tmp_path/'local'
+        dest.mkdir()
+        client.download_filelist(['data/run0.nxs.ngb'],dest)
+        assert server.logins==1
+
+        # break the connection under the client's feet
+        for ftp in list(client.connections):
+            ftp.sock.shutdown(socket.SHUT_RDWR)
+
+        client.download_filelist(['data/run1.nxs.ngb'],dest)
+        assert (dest/'run1.nxs.ngb').read_bytes()==bytes([1])*1001
+        assert server.logins==2
+        assert len(client.connections)==1
+    finally:
+        client.stop()
+
+
+def test_permanent_errors_are_not_retried(server,client,tmp_path):
+    dest = tmp_path/'local'
+    dest.mkdir()
+    with pytest.raises(ftplib.error_perm):
+        client.download_filelist(['data/missing.nxs.ngb'],dest)
+    assert server.retrs==1
+
+    # the connection survives the error
+    logins = server.logins
+    client.download_filelist(['data/run2.nxs.ngb'],dest)
+    assert server.logins==logins
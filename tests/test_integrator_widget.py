@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('ipywidgets')
+pytest.importorskip('plotly')
+from typySANS.IntegratorWidget import IntegratorWidget_DataModel
+from typySANS.SparseIntegrator import CircularAverager,SectorAverager
+from typySANS.misc import LRUCache
+
+
+@pytest.fixture
+def image():
+    rng = np.random.default_rng(0)
+    return rng.poisson(100,(128,128)).astype(float)
+
+
+def test_explicit_bin_edges(image):
+    edges = np.linspace(0.005,0.05,31)
+    data_model = IntegratorWidget_DataModel(image,binning=edges)
+    assert data_model.binning==tuple(edges)
+    assert isinstance(data_model.averager,CircularAverager)
+    data_model.integrate()
+    assert data_model.y.shape==(30,)
+    np.testing.assert_allclose(data_model.x,0.5*(edges[1:]+edges[:-1]))
+
+
+def test_binning_reaches_sector_mode(image):
+    data_model = IntegratorWidget_DataModel(image,npt=40)
+    data_model.set_mode('sector',phi=30.0,dphi=20.0)
+    assert isinstance(data_model.averager,SectorAverager)
+    linear = data_model.averager.edges
+
+    data_model.set_binning('log')
+    edges = data_model.averager.edges
+    assert len(edges)==41
+    np.testing.assert_allclose(edges[1:]/edges[:-1],edges[1]/edges[0])
+    assert not np.allclose(edges,linear)
+
+    data_model.set_binning('linear')
+    np.testing.assert_allclose(data_model.averager.edges,linear)
+
+
+def test_back_to_linear_circular_uses_pyFAI(image):
+    data_model = IntegratorWidget_DataModel(image,binning='log')
+    assert data_model.averager is not None
+    data_model.set_binning('linear')
+    assert data_model.averager is None
+
+
+def test_curve_cache_with_bin_edge_array(image):
+    cache = LRUCache(maxsize=8)
+    data_model = IntegratorWidget_DataModel(image,curve_cache=cache)
+    edges = np.linspace(0.005,0.05,21)
+    data_model.set_mode('sector',phi=0.0,dphi=45.0,binning=edges)
+    data_model.integrate()
+    assert len(cache)==1
+    first = data_model.data1D
+
+    data_model.set_mode('sector',phi=0.0,dphi=45.0,binning=list(edges))
+    data_model.integrate()
+    assert len(cache)==1
+    assert data_model.data1D is first
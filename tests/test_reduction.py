@@ -0,0 +1,58 @@
+import numpy as np
+
+from typySANS import Reduction
+from typySANS.Reduction import ReductionPipeline,ABS_COLUMNS
+from typySANS.Calibration import solid_angle_correction
+
+
+def sample_image(x0=64.0,y0=60.0,shape=(128,128),seed=0):
+    '''Poisson counts of a decaying curve around the beam center'''
+    y,x = np.indices(shape)
+    r = np.hypot(x+0.5-x0,y+0.5-y0)
+    rng = np.random.default_rng(seed)
+    return rng.poisson(1000.0/(1.0+(r/10.0)**2)+5.0).astype(np.int32)
+
+
+def test_log_binning_has_no_empty_rows(tmp_path,nexus_writer):
+    fname = tmp_path/'sample.nxs.ngb'
+    nexus_writer(fname,sample_image())
+
+    pipeline = ReductionPipeline(npt=50,binning='log',max_workers=1)
+    ABS = pipeline.run([fname])[str(fname)]
+    assert list(ABS.columns)==ABS_COLUMNS
+    # the narrow low-q bins hold no pixel and are left out
+    assert 0<len(ABS)<50
+    assert np.all(np.isfinite(ABS[['q','I','dI']].values))
+    assert np.all(ABS.I>0) and np.all(ABS.dI>0)
+    assert np.all(np.diff(ABS.q)>0)
+
+
+def test_configurations_are_read_in_the_workers(tmp_path,nexus_writer):
+    files = []
+    for i,(SDD,x0) in enumerate([(400.0,64.0),(130.0,60.5),(400.0,64.0)]):
+        fname = tmp_path/f'run{i}.nxs.ngb'
+        nexus_writer(fname,sample_image(x0=x0,seed=i),SDD=SDD,x0=x0)
+        files.append(fname)
+
+    pipeline = ReductionPipeline(npt=40,max_workers=1)
+    tasks = pipeline.build_tasks([Reduction.read_frame(f,counts=False) for f in files])
+    assert sorted(task['files'] for task in tasks)==sorted([[str(files[0]),str(files[2])],[str(files[1])]])
+    assert all('frames' not in task for task in tasks)
+
+    serial = {str(f):pipeline.run([f])[str(f)] for f in files}
+    results = ReductionPipeline(npt=40,max_workers=2).run(files)
+    assert list(results)==[str(f) for f in files]
+    for fname,ABS in results.items():
+        np.testing.assert_allclose(ABS.values,serial[fname].values)
+
+
+def test_no_solid_angle_correction_by_default():
+    div = np.random.default_rng(0).uniform(0.5,1.5,(16,16))
+    geometry = {'SDD':130.0,'wavelength':6.0,'x0':8.0,'y0':8.0,'pixel_size':0.00508}
+
+    calibration = ReductionPipeline(div=div).calibration_store.get(geometry,shape=(16,16))
+    np.testing.assert_allclose(calibration.correction,1.0/div)
+
+    calibration = ReductionPipeline(div=div,solid_angle=True).calibration_store.get(geometry,shape=(16,16))
+    np.testing.assert_allclose(calibration.correction*div,solid_angle_correction(130.0,8.0,8.0,(16,16)))
+    assert not np.allclose(calibration.correction,1.0/div)
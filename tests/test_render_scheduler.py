@@ -0,0 +1,22 @@
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from typySANS.RenderScheduler import RenderScheduler
+
+
+def test_agg_canvas_renders_synchronously():
+    fig,ax = plt.subplots()
+    rendered = []
+    def render(keys):
+        rendered.append(keys)
+        return False
+    scheduler = RenderScheduler(fig,render)
+    assert scheduler.synchronous
+
+    scheduler.request({1})
+    scheduler.request({2,3})
+    assert rendered==[{1},{2,3}]
+    assert not scheduler.scheduled
+    assert scheduler.dirty==set()
+    plt.close(fig)
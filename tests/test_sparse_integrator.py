@@ -0,0 +1,147 @@
+import warnings
+
+import numpy as np
+import pytest
+
+pyFAI = pytest.importorskip('pyFAI')
+from pyFAI.detectors import Detector
+from pyFAI.azimuthalIntegrator import AzimuthalIntegrator
+
+from typySANS.SparseIntegrator import CircularAverager,BatchIntegrator,get_polar_map
+
+SHAPE = (128,128)
+PIXEL_SIZE = 0.00508
+NPT = 100
+RTOL = 1e-6 #pyFAI works in float32, measured agreement is ~5e-8
+
+# beam center off the detector center and away from pixel centers
+GEOMETRIES = [
+    {'SDD':400.0,'wavelength':6.0,'x0':57.3,'y0':71.8},
+    {'SDD':130.0,'wavelength':8.0,'x0':70.6,'y0':52.15},
+]
+
+
+@pytest.fixture(scope='module')
+def image():
+    rng = np.random.default_rng(0)
+    return rng.poisson(100,SHAPE).astype(float)
+
+
+@pytest.fixture(scope='module')
+def mask():
+    '''beam stop, a dead stripe and a masked corner'''
+    y,x = np.indices(SHAPE)
+    mask = np.hypot(x-60.0,y-68.0)<6.0
+    mask[:,3:5] = True
+    mask[100:,100:] = True
+    return mask
+
+
+def integrate1d(geometry,data,mask,edges,oversample=1):
+    '''pyFAI reference on the bins of the sparse averager
+
+    Pixel splitting is reproduced by integrating an image upsampled onto an
+    oversample x oversample sub-pixel detector without splitting.
+    '''
+    pixel_size = PIXEL_SIZE/oversample
+    shape = (SHAPE[0]*oversample,SHAPE[1]*oversample)
+    if oversample>1:
+        block = np.ones((oversample,oversample))
+        data = np.kron(data,block)
+        mask = np.kron(mask,block).astype(bool)
+    ai = AzimuthalIntegrator(
+        dist=geometry['SDD']/100.0,
+        poni1=geometry['y0']*PIXEL_SIZE,
+        poni2=geometry['x0']*PIXEL_SIZE,
+        wavelength=geometry['wavelength']*1e-10,
+        detector=Detector(pixel_size,pixel_size,max_shape=shape),
+    )
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        result = ai.integrate1d(
+            data,
+            len(edges)-1,
+            unit='q_A^-1',
+            method=('no','histogram','cython'),
+            correctSolidAngle=False,
+            mask=mask,
+            radial_range=(edges[0],edges[-1]),
+            error_model='poisson',
+        )
+    return result
+
+
+def unambiguous(geometry,edges,oversample=1):
+    '''Bins without a sub-pixel q within float32 precision of one of their edges
+
+    pyFAI computes q in float32, so such sub-pixels may land in the neighbouring
+    bin there.
+    '''
+    polar = get_polar_map(**geometry,shape=SHAPE,pixel_size=PIXEL_SIZE,oversample=oversample)
+    q = np.sort(polar.q)
+    close = np.zeros(len(edges),dtype=bool)
+    for i,edge in enumerate(edges):
+        j = np.searchsorted(q,edge)
+        near = q[max(j-1,0):j+1]
+        close[i] = np.any(np.abs(near-edge)<=1e-6*edge)
+    return ~(close[:-1] | close[1:])
+
+
+@pytest.mark.parametrize('geometry',GEOMETRIES)
+def test_circular_average_matches_pyFAI_histogram(geometry,image,mask):
+    averager = CircularAverager(**geometry,npt=NPT,mask=mask,shape=SHAPE,pixel_size=PIXEL_SIZE)
+    I,dI,counts,q_mean = averager.average(image)
+    ref = integrate1d(geometry,image,mask,averager.edges)
+
+    filled = (counts>0) & unambiguous(geometry,averager.edges)
+    assert filled.sum()>NPT//2
+    np.testing.assert_allclose(averager.q,ref.radial,rtol=RTOL)
+    np.testing.assert_allclose(I[filled],ref.intensity[filled],rtol=RTOL)
+    np.testing.assert_allclose(dI[filled],ref.sigma[filled],rtol=RTOL)
+
+
+@pytest.mark.parametrize('oversample',[2,4])
+@pytest.mark.parametrize('geometry',GEOMETRIES)
+def test_circular_average_matches_pyFAI_split(geometry,oversample,image,mask):
+    averager = CircularAverager(
+        **geometry,
+        npt=NPT,
+        mask=mask,
+        shape=SHAPE,
+        pixel_size=PIXEL_SIZE,
+        oversample=oversample,
+    )
+    I,dI,counts,q_mean = averager.average(image)
+    ref = integrate1d(geometry,image,mask,averager.edges,oversample)
+
+    filled = (counts>0) & unambiguous(geometry,averager.edges,oversample)
+    assert filled.sum()>NPT//2
+    np.testing.assert_allclose(averager.q,ref.radial,rtol=RTOL)
+    np.testing.assert_allclose(I[filled],ref.intensity[filled],rtol=RTOL)
+
+
+@pytest.mark.parametrize('oversample',[1,2])
+def test_batch_integrator_matches_pyFAI(oversample,image,mask):
+    rng = np.random.default_rng(1)
+    stack = np.stack([image,rng.poisson(20,SHAPE).astype(float),image[::-1]])
+    configs = [GEOMETRIES[0],GEOMETRIES[1],GEOMETRIES[0]]
+
+    integrator = BatchIntegrator(npt=NPT,mask=mask,pixel_size=PIXEL_SIZE,oversample=oversample)
+    q,I,dI = integrator.integrate(stack,configs,errors=True)
+    assert I.shape==(3,NPT)
+
+    for i,(frame,geometry) in enumerate(zip(stack,configs)):
+        averager = CircularAverager(
+            **geometry,
+            npt=NPT,
+            mask=mask,
+            shape=SHAPE,
+            pixel_size=PIXEL_SIZE,
+            oversample=oversample,
+        )
+        ref = integrate1d(geometry,frame,mask,averager.edges,oversample)
+        filled = (ref.count>0) & unambiguous(geometry,averager.edges,oversample)
+        np.testing.assert_allclose(q[i],ref.radial,rtol=RTOL)
+        np.testing.assert_allclose(I[i][filled],ref.intensity[filled],rtol=RTOL)
+        if oversample==1:
+            np.testing.assert_allclose(dI[i][filled],ref.sigma[filled],rtol=RTOL)
@@ -8,6 +8,8 @@ import pandas as pd
 import datetime
 import pathlib
 
+from typySANS.misc import LRUCache
+
 def readABS(fpath,trimLo=0,trimHi=0):
     '''Read ASCII .ABS files and, if possible, extract instrument configuration 
     
@@ -59,6 +61,34 @@ def readABS(fpath,trimLo=0,trimHi=0):
     df = pd.DataFrame(data_table,columns=['q','I','dI','dq','qbar','shadfac'],)
     return df,config_dict
 
+_ABS_CACHE = LRUCache(maxsize=512)
+def readABS_cached(fpath):
+    '''Cached version of readABS keyed by file path and modification time
+    
+    Files that have already been parsed are returned from an in-memory LRU cache
+    unless they have been modified since. The returned dataframe is shared between
+    callers and should not be modified in place.
+    
+    Arguments
+    ---------
+    fpath: str or pathlib.Path
+        Full path with filename to an ABS file
+    
+    Returns:
+    --------
+    See readABS
+    '''
+    fpath = pathlib.Path(fpath)
+    key = (str(fpath.resolve()),fpath.stat().st_mtime_ns)
+    try:
+        return _ABS_CACHE[key]
+    except KeyError:
+        pass
+    
+    result = readABS(fpath)
+    _ABS_CACHE[key] = result
+    return result
+
 def writeABS(fname,dfABS,dfShift,shiftConfig,df_trim,path='./',shift=True,sort_by_q=True):
     header  = 'COMBINED FILE CREATED: {}\n'
     header += 'pyNSORT-ed {} ' + '+ {} '*(dfABS.shape[0]-1) + '\n'
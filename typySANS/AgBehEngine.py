@@ -0,0 +1,246 @@
+'''
+Headless silver behenate (AgBeh) calibration
+
+For every wavelength the beam center is fit on the transmission image, the
+scattering image is circularly averaged and each AgBeh order in range is fit
+with a gaussian on a linear background. The deviations of the fitted peak
+positions from n*AGBEH_Q1 give corrected detector distances and wavelengths.
+'''
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from typySANS.BeamCenter import fit_beam_center
+from typySANS.SparseIntegrator import CircularAverager
+from typySANS.FitUtil import init_gaussian1D_lmfit
+
+AGBEH_Q1 = 0.1076 #1/Å, first order of the 58.38 Å lamellar spacing
+
+def corrected_SDD(q_fit,q_expected,SDD,wavelength):
+    '''Detector distance [cm] that would put the peak measured at q_fit at q_expected'''
+    r = SDD*np.tan(2.0*np.arcsin(q_fit*wavelength/(4.0*np.pi)))
+    return r/np.tan(2.0*np.arcsin(q_expected*wavelength/(4.0*np.pi)))
+
+def corrected_wavelength(q_fit,q_expected,wavelength):
+    '''Wavelength [Å] that would put the peak measured at q_fit at q_expected'''
+    return wavelength*q_fit/q_expected
+
+def fit_peak(q,I,center,window=0.15,min_points=5):
+    '''Fit a gaussian on a linear background to I(q) within center*(1±window)
+
+    Returns
+    -------
+    result: lmfit.model.ModelResult or None
+        None if the window isn't fully inside the measured q-range or has fewer
+        than min_points finite points
+    '''
+    measured = np.isfinite(I) & (I>0)
+    if not measured.any() or center*(1+window)>q[measured].max() or center*(1-window)<q[measured].min():
+        return None
+    keep = (np.abs(q-center)<=window*center) & measured
+    if keep.sum()<min_points:
+        return None
+    q,I = q[keep],I[keep]
+
+    model,params = init_gaussian1D_lmfit()
+    background = min(I[0],I[-1])
+    sigma = window*center/3.0
+    params['center'].set(value=q[np.argmax(I)],min=q.min(),max=q.max())
+    params['sigma'].set(value=sigma,min=0.0,max=window*center)
+    params['amplitude'].set(value=(I.max()-background)*sigma*np.sqrt(2*np.pi),min=0.0)
+    params['intercept'].set(value=background)
+    return model.fit(I,x=q,params=params)
+
+def calibrate_wavelength(trans_img,scatt_img,SDD,wavelength,orders=(1,2,3),npt=200,window=0.15,mask=None):
+    '''Calibrate one wavelength
+
+    Arguments
+    ---------
+    trans_img,scatt_img: np.ndarray
+        (Ny,Nx) transmission (direct beam) and AgBeh scattering images
+
+    SDD: float
+        nominal sample to detector distance [cm]
+
+    wavelength: float
+        nominal wavelength [Å]
+
+    orders: sequence
+        AgBeh orders to fit. Orders outside the measured q-range are skipped.
+
+    npt: int
+        number of q-bins
+
+    window: float
+        relative half width of the fit window around each expected peak
+
+    mask: np.ndarray or None
+        boolean array, True for pixels to exclude
+
+    Returns
+    -------
+    result: dict
+        beam_center (dict of the beam center fit parameters), q, I, dI (the
+        circular average) and peaks (list of dicts, one per fitted order)
+    '''
+    beam = fit_beam_center(trans_img,mask=mask)
+    beam_center = {name:par.value for name,par in beam.params.items()}
+
+    averager = CircularAverager(
+        SDD,
+        wavelength,
+        beam_center['x0'],
+        beam_center['y0'],
+        npt=npt,
+        mask=mask,
+        shape=np.shape(scatt_img),
+    )
+    I,dI,counts,q_mean = averager.average(scatt_img)
+    q = averager.q
+
+    peaks = []
+    for order in orders:
+        q_expected = order*AGBEH_Q1
+        fit = fit_peak(q,I,q_expected,window=window)
+        if fit is None:
+            continue
+        q_fit = fit.params['center'].value
+        peaks.append({
+            'order':order,
+            'q_expected':q_expected,
+            'q_fit':q_fit,
+            'q_err':fit.params['center'].stderr,
+            'sigma':fit.params['sigma'].value,
+            'redchi':fit.redchi,
+            'params':{name:par.value for name,par in fit.params.items()},
+            'SDD_corrected':corrected_SDD(q_fit,q_expected,SDD,wavelength),
+            'wavelength_corrected':corrected_wavelength(q_fit,q_expected,wavelength),
+        })
+
+    result = {
+        'SDD':SDD,
+        'wavelength':wavelength,
+        'beam_center':beam_center,
+        'q':q,
+        'I':I,
+        'dI':dI,
+        'peaks':peaks,
+    }
+    return result
+
+def _calibrate(kwargs):
+    return calibrate_wavelength(**kwargs)
+
+class AgBehEngine:
+    '''Calibrate all wavelengths of an AgBeh dataset in parallel
+
+    Arguments
+    ---------
+    df: pandas.DataFrame
+        one transmission (transmission==True) and one scattering row per
+        wavelength with columns wavelength, SDD [cm], transmission and img
+
+    orders: sequence
+        AgBeh orders to fit
+
+    npt: int
+        number of q-bins
+
+    window: float
+        relative half width of the fit window around each expected peak
+
+    mask: np.ndarray or None
+        boolean array, True for pixels to exclude
+
+    max_workers: int or None
+        number of worker processes. With max_workers=1 everything runs in this
+        process.
+    '''
+    def __init__(self,df,orders=(1,2,3),npt=200,window=0.15,mask=None,max_workers=None):
+        self.df = df
+        self.orders = tuple(orders)
+        self.npt = npt
+        self.window = window
+        self.mask = mask
+        self.max_workers = max_workers
+        self.results = {}
+        self.check()
+
+    def check(self):
+        for wavelength,sdf in self.df.groupby('wavelength'):
+            if not (len(sdf)==2 and sdf.transmission.sum()==1):
+                strval=f'There should be one transmission and one scattering file for each wavelength. Found:\n{sdf}'
+                raise ValueError(strval)
+
+    @property
+    def wavelengths(self):
+        return sorted(self.df.wavelength.unique())
+
+    def tasks(self):
+        tasks = []
+        for wavelength,sdf in self.df.groupby('wavelength'):
+            trans = sdf[sdf.transmission.astype(bool)].iloc[0]
+            scatt = sdf[~sdf.transmission.astype(bool)].iloc[0]
+            tasks.append({
+                'trans_img':np.asarray(trans.img,dtype=float),
+                'scatt_img':np.asarray(scatt.img,dtype=float),
+                'SDD':float(scatt.SDD),
+                'wavelength':float(wavelength),
+                'orders':self.orders,
+                'npt':self.npt,
+                'window':self.window,
+                'mask':self.mask,
+            })
+        return tasks
+
+    def run(self):
+        '''Calibrate all wavelengths and return the peak table (see table)'''
+        tasks = self.tasks()
+        if self.max_workers==1 or len(tasks)<=1:
+            outputs = list(map(_calibrate,tasks))
+        else:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                outputs = list(executor.map(_calibrate,tasks))
+        self.results = {result['wavelength']:result for result in outputs}
+        return self.table()
+
+    def table(self):
+        '''Fitted peaks and corrections
+
+        Returns
+        -------
+        df: pandas.DataFrame
+            one row per wavelength and order with the beam center (x0,y0), the
+            expected and fitted peak positions and the corrected SDD and wavelength
+        '''
+        rows = []
+        for wavelength,result in sorted(self.results.items()):
+            for peak in result['peaks']:
+                row = {
+                    'wavelength':wavelength,
+                    'SDD':result['SDD'],
+                    'x0':result['beam_center']['x0'],
+                    'y0':result['beam_center']['y0'],
+                }
+                row.update({k:v for k,v in peak.items() if k!='params'})
+                rows.append(row)
+        return pd.DataFrame(rows)
+
+    def corrections(self):
+        '''Per-wavelength corrections averaged over orders, weighted by 1/q_err^2'''
+        df = self.table()
+        rows = []
+        for wavelength,sdf in df.groupby('wavelength'):
+            err = sdf.q_err.astype(float).values
+            weights = np.where(np.isfinite(err) & (err>0),1.0/err**2,0.0)
+            if not weights.sum()>0:
+                weights = np.ones_like(err)
+            rows.append({
+                'wavelength':wavelength,
+                'SDD':sdf.SDD.iloc[0],
+                'SDD_corrected':np.average(sdf.SDD_corrected,weights=weights),
+                'wavelength_corrected':np.average(sdf.wavelength_corrected,weights=weights),
+                'orders':len(sdf),
+            })
+        return pd.DataFrame(rows)
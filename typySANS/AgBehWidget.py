@@ -6,76 +6,107 @@ import ipywidgets
 import plotly.subplots
 import plotly.graph_objs as go
 
-from typySANS.FitUtil import init_image_mesh,init_gaussian1D_lmfit,init_gaussian2D_lmfit
+from typySANS.FitUtil import init_image_mesh,init_gaussian1D_lmfit,init_gaussian2D_jacobian_lmfit
 from typySANS.ImageWidget import ImageWidget
 from typySANS.Fit1DWidget import Fit1DWidget
 from typySANS.Fit2DWidget import Fit2DWidget
 from typySANS.IntegratorWidget import IntegratorWidget
+from typySANS.AgBehEngine import AgBehEngine,AGBEH_Q1
 
 
 class AgBehWidget:
-    def __init__(self,df):
+    '''AgBeh calibration with one tab per wavelength
+
+    The calibration runs headless in AgBehEngine (in parallel over wavelengths);
+    the interactive Fit2D, Integrator and Fit1D widgets of a wavelength are only
+    built when its tab is first selected.
+    '''
+    def __init__(self,df,orders=(1,2,3),max_workers=None):
         self.df = df
-        self.check()
+        self.engine = AgBehEngine(df,orders=orders,max_workers=max_workers)
 
         self.model1D,self.param1D = init_gaussian1D_lmfit()
-        self.model2D,self.param2D = init_gaussian2D_lmfit()
-        self.wavelengths = sorted(self.df.wavelength.unique())
+        self.model2D,self.param2D = init_gaussian2D_jacobian_lmfit()
+        self.wavelengths = self.engine.wavelengths
         
-        self.data_view = AgBehWidget_DataView(self.wavelengths)
-    
-    def build_widgets(self):
         self.Fit1DWidgets = {}
         self.Fit2DWidgets = {}
         self.IntegratorWidgets = {}
+        self.data_view = AgBehWidget_DataView(self.wavelengths)
+    
+    def build_widgets(self,wavelength):
+        '''Build the interactive widgets of one wavelength from the engine results'''
+        result = self.engine.results[wavelength]
+        sdf = self.df[self.df.wavelength==wavelength]
+        sdf_trans = sdf.query('transmission==True')
+        sdf_scatt = sdf.query('transmission==False')
+        
+        param2D = self.param2D.copy()
+        for name,value in result['beam_center'].items():
+            param2D[name].value = value
+        Fit2D = Fit2DWidget(
+            sdf_trans.img.values[0],
+            self.model2D,
+            param2D,
+        )
         
-        for wavelength,sdf in self.df.groupby('wavelength'):
-            sdf_trans = sdf.query('transmission==True')
-            sdf_scatt = sdf.query('transmission==False')
-            Fit2D = Fit2DWidget(
-                sdf_trans.img.values[0],
-                self.model2D,
-                self.param2D,
-            )
-            
-            Integrator = IntegratorWidget(
-                sdf_scatt.img.values[0],
-                x0= Fit2D.get_fit_param('x0').value,
-                y0= Fit2D.get_fit_param('y0').value,
-                wavelength=sdf_scatt.wavelength.values[0],
-                SDD=sdf_scatt.SDD.values[0],
-            )
-            
-            x,y = Integrator.get_integrated_data()
-            Fit1D = Fit1DWidget(
-                x,y,
-                self.model1D,
-                self.param1D,
-            )
-            Fit1D.data_view.add_vertical_line(0.1076,y0=y.min(),y1=y.max())
-            
-            self.Fit2DWidgets[wavelength]  = Fit2D
-            self.IntegratorWidgets[wavelength]  = Integrator
-            self.Fit1DWidgets[wavelength]  = Fit1D
+        Integrator = IntegratorWidget(
+            sdf_scatt.img.values[0],
+            x0=result['beam_center']['x0'],
+            y0=result['beam_center']['y0'],
+            wavelength=result['wavelength'],
+            SDD=result['SDD'],
+        )
+        
+        x,y = Integrator.get_integrated_data()
+        param1D = self.param1D.copy()
+        if result['peaks']:
+            for name,value in result['peaks'][0]['params'].items():
+                param1D[name].value = value
+        Fit1D = Fit1DWidget(
+            x,y,
+            self.model1D,
+            param1D,
+        )
+        for order in self.engine.orders:
+            Fit1D.data_view.add_vertical_line(order*AGBEH_Q1,y0=y.min(),y1=y.max())
+        
+        self.Fit2DWidgets[wavelength]  = Fit2D
+        self.IntegratorWidgets[wavelength]  = Integrator
+        self.Fit1DWidgets[wavelength]  = Fit1D
+        return Fit2D,Integrator,Fit1D
+    
+    def get_tab(self,wavelength):
+        Fit2D,Integrator,Fit1D = self.build_widgets(wavelength)
+        return self.data_view.build_sub_tab(Fit2D.run(),Integrator.run(),Fit1D.run())
         
     def check(self):
-        for i,(index,sdf) in enumerate(self.df.groupby('wavelength')):
-            if not (len(sdf)==2):
-                strval=f'There should be one transmission and one scattering file for each wavelength. Found:\n{sdf}'
-                raise ValueError(strval)
+        self.engine.check()
+    
+    def get_centers(self):
+        '''First order peak positions, refit interactively where the tab has been built'''
+        table = self.engine.table()
+        centers = {}
+        for wavelength in self.wavelengths:
+            if wavelength in self.Fit1DWidgets:
+                param = self.Fit1DWidgets[wavelength].get_fit_param('center')
+                centers[wavelength] = (param.value,param.stderr)
+                continue
+            sdf = table[(table.wavelength==wavelength) & (table.order==1)] if table.shape[0]>0 else table
+            if sdf.shape[0]>0:
+                centers[wavelength] = (sdf.q_fit.values[0],sdf.q_err.values[0])
+            else:
+                centers[wavelength] = (np.nan,np.nan)
+        return centers
                 
     def run(self):
-        self.build_widgets()
-        self.data_view.build_tabs(
-            self.Fit2DWidgets,
-            self.IntegratorWidgets,
-            self.Fit1DWidgets,
-        )
+        self.table = self.engine.run()
+        self.data_view.build_tabs(self.get_tab,self.get_centers())
         self.data_view.build_buttons()
         
         update_button = self.data_view.buttons.children[-1]
         update_button.on_click(
-            lambda x: self.data_view.update_summary(self.Fit1DWidgets)
+            lambda x: self.data_view.update_summary(self.get_centers())
         )
         
         VBox = ipywidgets.VBox([
@@ -89,49 +120,45 @@ class AgBehWidget_DataView:
         self.wavelengths = wavelengths
         self.tabs = None
         self.N = len(self.wavelengths)
-        self.progress=None
-    def prog_string(self,i):
-        return str(i) + f'/{self.N} Wavelengths Processed'
-    def init_progress(self):
-        self.hbox = ipywidgets.HBox([ 
-            ipywidgets.IntProgress(min=0,max=len(self.wavelengths)),
-            ipywidgets.Label(self.prog_string(0))
-        ])
+        self.built = set()
+        self.sub_tab_selection = None
+        
+    def build_sub_tab(self,Fit2D,Integrator,Fit1D):
+        sub_tab = ipywidgets.Tab()
+        sub_tab.children = [Fit2D,Integrator,Fit1D]
+        sub_tab.set_title(0,'Fit Beam Center')
+        sub_tab.set_title(1,'Azimuthal Integration')
+        sub_tab.set_title(2,'1D Gaussian Fit')
+        if self.sub_tab_selection is not None:
+            sub_tab.selected_index = self.sub_tab_selection
+        return sub_tab
+        
+    def build_tabs(self,get_tab,centers):
+        '''Build the tab layout with placeholders, get_tab(wavelength) is called on first selection'''
+        self.get_tab = get_tab
+        self.built = set()
         
-        self.progress = self.hbox.children[0]
-        self.prog_label = self.hbox.children[1]
-        display(self.hbox)
-        
-    def build_tabs(self,Fit2DWidgets,IntegratorWidgets,Fit1DWidgets):
-        if self.progress is None:
-            self.init_progress()
-            
         self.tabs = ipywidgets.Tab()
         children = []
         for i,wavelength in enumerate(self.wavelengths):
-            self.progress.value = i
-            self.prog_label.value = self.prog_string(i)
-            
-            self.tabs.set_title(i,'λ={}'.format(wavelength))
-            
-            Fit2D = Fit2DWidgets[wavelength].run()
-            Integrator = IntegratorWidgets[wavelength].run()
-            Fit1D = Fit1DWidgets[wavelength].run()
-            
-            sub_tab = ipywidgets.Tab()
-            sub_tab.children = [Fit2D,Integrator,Fit1D]
-            sub_tab.set_title(0,'Fit Beam Center')
-            sub_tab.set_title(1,'Azimuthal Integration')
-            sub_tab.set_title(2,'1D Gaussian Fit')
-            children.append(sub_tab)
-        
-        self.build_summary(Fit1DWidgets)
-        children.append(self.summary)
-        self.tabs.set_title(i+1,'Summary'.format(wavelength))
+            children.append(ipywidgets.VBox([ipywidgets.Label('Building...')]))
         
-        self.progress.value = i+1
-        self.prog_label.value = self.prog_string(i+1)
+        self.build_summary(centers)
+        children.append(self.summary)
         self.tabs.children = children
+        for i,wavelength in enumerate(self.wavelengths):
+            self.tabs.set_title(i,'λ={}'.format(wavelength))
+        self.tabs.set_title(len(self.wavelengths),'Summary')
+        
+        self.tabs.observe(self.render_tab,names='selected_index')
+        self.tabs.selected_index = len(self.wavelengths)
+        
+    def render_tab(self,change=None):
+        i = self.tabs.selected_index
+        if (i is None) or (i>=len(self.wavelengths)) or (i in self.built):
+            return
+        self.built.add(i)
+        self.tabs.children[i].children = [self.get_tab(self.wavelengths[i])]
         
     def build_buttons(self):
         button1 = ipywidgets.Button(description='Fit Beam Center')
@@ -145,43 +172,36 @@ class AgBehWidget_DataView:
         self.buttons = ipywidgets.HBox([button1,button2,button3,button4])
         
     def select_tab(self,tab_selection):
-        for i,tab in enumerate(self.tabs.children):
-            if not ('λ' in self.tabs.get_title(i)):
-                continue
-            tab.selected_index=tab_selection
+        self.sub_tab_selection = tab_selection
+        for i in self.built:
+            self.tabs.children[i].children[0].selected_index=tab_selection
     
-    def update_summary(self,Fit1DWidgets):
-        y = []
-        yerr = []
-        for i,wavelength in enumerate(self.wavelengths):
-            y.append(Fit1DWidgets[wavelength].get_fit_param('center').value)
-            yerr.append(Fit1DWidgets[wavelength].get_fit_param('center').stderr)
+    def update_summary(self,centers):
+        y = [centers[wavelength][0] for wavelength in self.wavelengths]
+        yerr = [centers[wavelength][1] for wavelength in self.wavelengths]
         self.summary.data[0].y = y
         self.summary.data[0].error_y = dict(array=yerr)
             
-    def build_summary(self,Fit1DWidgets):
-        y = []
-        yerr = []
-        for i,wavelength in enumerate(self.wavelengths):
-            y.append(Fit1DWidgets[wavelength].get_fit_param('center').value)
-            yerr.append(Fit1DWidgets[wavelength].get_fit_param('center').stderr)
+    def build_summary(self,centers):
+        y = [centers[wavelength][0] for wavelength in self.wavelengths]
+        yerr = [centers[wavelength][1] for wavelength in self.wavelengths]
         
         self.summary = go.FigureWidget()
         self.summary.add_scatter(y=y,error_y={'array':yerr})
         
-        yval = 0.1076
+        yval = AGBEH_Q1
         self.summary.add_shape( 
             xref='paper', x0=0, x1=1, y0=yval, y1=yval, line=dict(dash='dash'))
         
         
         for pct in [0.5,1]:
             for sign in [1.0,-1.0]:
-                yval = 0.1076*(1.00+sign*pct/100)
+                yval = AGBEH_Q1*(1.00+sign*pct/100)
                 self.summary.add_shape(
                     xref='paper', x0=0, x1=1, y0=yval, y1=yval, line=dict(dash='dot',color='red') 
                 )
 
-        self.summary.add_annotation(x=0.5,y=0.1076*(1.00-0.5/100),text='0.5% Error')
+        self.summary.add_annotation(x=0.5,y=AGBEH_Q1*(1.00-0.5/100),text='0.5% Error')
         self.summary.update_layout(
             xaxis_title = 'Wavelength',
             yaxis_title = 'AgBeh Peak q',
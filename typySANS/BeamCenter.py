@@ -0,0 +1,362 @@
+'''
+Fast beam-center estimation
+
+The beam center is found in two steps: the centroid and second moments of the
+thresholded direct-beam image give a seed, and a 2D gaussian is then fit only
+to a small window around it. Coordinates are pixel indices, matching
+init_image_mesh and Fit2DWidget.
+'''
+import os
+import struct
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import h5py
+
+from typySANS.FitUtil import init_gaussian2D_jacobian_lmfit,init_image_mesh
+from typySANS.RAWFile import RAWFile
+from typySANS.Catalog import BEAM_CENTER_COLUMNS
+from typySANS.Consolidate import open_stack
+from typySANS.Reduction import read_frame
+from typySANS.misc import split_stack_path,mask_hash
+
+class NoBeamError(ValueError):
+    '''Raised when an image has no beam to estimate the center from'''
+
+def moment_seed(img,threshold=0.5,mask=None):
+    '''Estimate the beam position and width from image moments
+
+    Arguments
+    ---------
+    img: np.ndarray
+        (Ny,Nx) direct beam image
+
+    threshold: float
+        only pixels above B + threshold*(max-B) are used, where the background B
+        is the image median
+
+    mask: np.ndarray or None
+        boolean array, True for pixels to exclude
+
+    Returns
+    -------
+    seed: dict
+        x0, y0, sig_x, sig_y, A and B in the parameter convention of
+        FitUtil.gaussian2D
+
+    Raises NoBeamError if there are no valid pixels or no peak above background.
+    '''
+    img = np.asarray(img,dtype=float)
+    valid = np.isfinite(img)
+    if mask is not None:
+        valid &= ~np.asarray(mask,dtype=bool)
+    if not valid.any():
+        raise NoBeamError('Cannot estimate the beam center: no valid pixels')
+
+    background = np.median(img[valid])
+    peak = img[valid].max()
+    weights = np.where(valid,img-background,0.0)
+    weights[weights<threshold*(peak-background)] = 0.0
+    total = weights.sum()
+    if not total>0:
+        raise NoBeamError('Cannot estimate the beam center: image has no peak above background')
+
+    y,x = np.indices(img.shape)
+    x0 = (weights*x).sum()/total
+    y0 = (weights*y).sum()/total
+    # the moments of a gaussian truncated at a fraction t of its peak underestimate
+    # its width by sqrt(1 + ln(t)*t/(1-t)); undo that
+    t = min(max(threshold,1e-6),1-1e-6)
+    truncation = np.sqrt(1.0 + np.log(t)*t/(1.0-t))
+    sig_x = np.sqrt((weights*(x-x0)**2).sum()/total)/truncation
+    sig_y = np.sqrt((weights*(y-y0)**2).sum()/total)/truncation
+
+    seed = {
+        'x0':x0,
+        'y0':y0,
+        'sig_x':max(sig_x,0.5),
+        'sig_y':max(sig_y,0.5),
+        'A':peak-background,
+        'B':max(background,0.0),
+    }
+    return seed
+
+def seed_params(params,seed):
+    '''Copy of params with the seed values (clipped to the parameter bounds)'''
+    params = params.copy()
+    for name,value in seed.items():
+        if name in params:
+            param = params[name]
+            param.value = float(np.clip(value,param.min,param.max))
+    return params
+
+def window_mask(shape,seed,n_sigma=4.0,min_half_width=5):
+    '''Boolean (Ny,Nx) array selecting a window of ±n_sigma widths around the seed'''
+    Ny,Nx = shape
+    hx = max(n_sigma*seed['sig_x'],min_half_width)
+    hy = max(n_sigma*seed['sig_y'],min_half_width)
+    window = np.zeros(shape,dtype=bool)
+    window[
+        max(int(np.floor(seed['y0']-hy)),0):min(int(np.ceil(seed['y0']+hy))+1,Ny),
+        max(int(np.floor(seed['x0']-hx)),0):min(int(np.ceil(seed['x0']+hx))+1,Nx),
+    ] = True
+    return window
+
+def fit_beam_center(img,mask=None,model=None,params=None,threshold=0.5,n_sigma=4.0,min_half_width=5,XY=None):
+    '''Fit a 2D gaussian to a window around the moment-estimated beam center
+
+    Arguments
+    ---------
+    img: np.ndarray
+        (Ny,Nx) direct beam image
+
+    mask: np.ndarray or None
+        boolean array, True for pixels to exclude
+
+    model,params: lmfit.Model, lmfit.Parameters
+        2D model with x0, y0, sig_x, sig_y, A and B parameters evaluated on XY.
+        Defaults to FitUtil.init_gaussian2D_jacobian_lmfit. params is not modified.
+
+    threshold: float
+        relative threshold of the moment estimate, see moment_seed
+
+    n_sigma: float
+        half width of the fit window in units of the estimated beam width
+
+    min_half_width: int
+        minimum half width of the fit window [pixels]
+
+    XY: np.ndarray or None
+        (Ny*Nx,2) pixel coordinates, see FitUtil.init_image_mesh
+
+    Returns
+    -------
+    result: lmfit.model.ModelResult
+        fit result with parameters in full-image pixel coordinates
+    '''
+    img = np.asarray(img,dtype=float)
+    if model is None:
+        model,default_params = init_gaussian2D_jacobian_lmfit()
+        if params is None:
+            params = default_params
+    if XY is None:
+        Ny,Nx = img.shape
+        XY = init_image_mesh(Nx,Ny)[-1]
+
+    seed = moment_seed(img,threshold=threshold,mask=mask)
+    keep = window_mask(img.shape,seed,n_sigma,min_half_width)
+    if mask is not None:
+        keep &= ~np.asarray(mask,dtype=bool)
+    keep = keep.ravel()
+
+    result = model.fit(img.ravel()[keep],XY=XY[keep],params=seed_params(params,seed))
+    return result
+
+def roi_slices(roi,shape=(128,128)):
+    '''Convert a region of interest (y_start,y_stop,x_start,x_stop) [pixels] to
+    (slice_y,slice_x), clipped to the detector shape'''
+    Ny,Nx = shape
+    y_start,y_stop,x_start,x_stop = (int(round(v)) for v in roi)
+    return (
+        slice(min(max(y_start,0),Ny),min(max(y_stop,0),Ny)),
+        slice(min(max(x_start,0),Nx),min(max(x_stop,0),Nx)),
+    )
+
+def beam_roi(x0,y0,half_width=16):
+    '''Square region of interest (y_start,y_stop,x_start,x_stop) around a nominal beam center'''
+    return (y0-half_width,y0+half_width+1,x0-half_width,x0+half_width+1)
+
+def header_roi(fname,half_width=16):
+    '''beam_roi around the beam center in the header of a Nexus or RAW file or of a
+    stack member, or None if the header has no (valid) beam center'''
+    try:
+        geometry = read_frame(fname,counts=False)['geometry']
+    except (OSError,KeyError,ValueError,struct.error):
+        return None
+    x0,y0 = geometry['x0'],geometry['y0']
+    if not (np.isfinite(x0) and np.isfinite(y0)):
+        return None
+    return beam_roi(x0,y0,half_width)
+
+def read_image(fname,roi=None):
+    '''Read the (Ny,Nx) detector image of a Nexus or RAW file or of a consolidated stack member
+
+    Arguments
+    ---------
+    fname: str or pathlib.Path
+        Nexus, RAW or stack member ("store.h5::filename") path
+
+    roi: tuple or None
+        (y_start,y_stop,x_start,x_stop) [pixels]. Only this region is read: an
+        HDF5 hyperslab for Nexus files and stacks and the covering byte range of
+        the detector block for RAW files.
+    '''
+    store,member = split_stack_path(fname)
+    if member is not None:
+        stack = open_stack(store)
+        slices = None if roi is None else roi_slices(roi,stack.shape[1:])
+        return np.asarray(stack.frame(member,slices),dtype=float)
+    if h5py.is_hdf5(fname):
+        with h5py.File(fname,'r') as h5:
+            data = h5['entry/data/y']
+            if roi is None:
+                return np.asarray(data[()].T,dtype=float)
+            # entry/data/y is stored (Nx,Ny)
+            slice_y,slice_x = roi_slices(roi,data.shape[::-1])
+            return np.asarray(data[slice_x,slice_y].T,dtype=float)
+    raw = RAWFile(str(fname),readFileNow=False)
+    if roi is not None:
+        if os.path.getsize(fname)!=33316:
+            raise ValueError(f'{fname} is neither a Nexus nor a RAW file')
+        return np.asarray(raw.readDetectorROI(*roi_slices(roi)),dtype=float)
+    if not raw.isRAW():
+        raise ValueError(f'{fname} is neither a Nexus nor a RAW file')
+    raw.read()
+    return np.asarray(raw.SANSData['rawCounts'],dtype=float)
+
+def _fit_file(args):
+    '''Fit the beam center of one file (runs in a worker process)'''
+    fname,roi,half_width,fit_kwargs = args
+    row = {'x0':np.nan,'y0':np.nan,'sig_x':np.nan,'sig_y':np.nan,'A':np.nan,'B':np.nan,'redchi':np.nan,'success':False}
+    x_start = y_start = 0
+    if roi is None:
+        roi = header_roi(fname,half_width)
+    elif roi is False:
+        roi = None
+    if roi is not None:
+        slices = roi_slices(roi)
+        y_start,x_start = slices[0].start,slices[1].start
+        if fit_kwargs.get('mask',None) is not None:
+            mask = np.asarray(fit_kwargs['mask'])
+            fit_kwargs = dict(fit_kwargs,mask=mask[roi_slices(roi,mask.shape)])
+    try:
+        result = fit_beam_center(read_image(fname,roi),**fit_kwargs)
+    except (OSError,KeyError,ValueError):
+        return fname,row
+    for name in BEAM_CENTER_COLUMNS[:6]:
+        row[name] = result.params[name].value
+    row['x0'] += x_start
+    row['y0'] += y_start
+    row['redchi'] = result.redchi
+    row['success'] = bool(result.success)
+    return fname,row
+
+def fit_settings_key(roi=None,half_width=16,**fit_kwargs):
+    '''Digest of the settings of fit_beam_centers, under which results are cataloged'''
+    items = [('roi',roi),('half_width',half_width)]
+    for name,value in sorted(fit_kwargs.items()):
+        if name=='mask':
+            value = mask_hash(value)
+        elif isinstance(value,np.ndarray):
+            value = (value.shape,str(value.dtype),hashlib.sha1(np.ascontiguousarray(value)).hexdigest())
+        items.append((name,value))
+    return hashlib.sha1(repr(items).encode('utf8')).hexdigest()
+
+def fit_beam_centers(files,catalog=None,refit=False,max_workers=None,roi=None,half_width=16,**fit_kwargs):
+    '''Fit the beam centers of many transmission or empty beam files in parallel
+
+    Arguments
+    ---------
+    files: list
+        Nexus or RAW files
+
+    catalog: Catalog.FileCatalog or None
+        catalog to look up previous results in and to store new results to.
+        Results are cataloged per fit settings (roi, half_width and fit_kwargs,
+        see fit_settings_key); failed fits aren't stored and are tried again.
+
+    refit: bool
+        fit all files even if the catalog already has their beam centers
+
+    max_workers: int or None
+        number of worker processes. With max_workers=1 everything runs in this
+        process.
+
+    roi: tuple or None or False
+        (y_start,y_stop,x_start,x_stop) [pixels] around the direct beam (see
+        beam_roi). Only this region is read and fit; the results are still in
+        full-detector pixel indices. The beam must lie inside the region. With
+        None, each file is read in a region of ±half_width pixels around the
+        beam center in its header (see header_roi), or completely if the header
+        has none. With False, the full detector is read.
+
+    half_width: int
+        half width of the regions derived from the headers [pixels]
+
+    **fit_kwargs:
+        passed on to fit_beam_center (mask, threshold, n_sigma, ...). Must be
+        picklable. A full-detector mask is cut to the roi.
+
+    Returns
+    -------
+    df: pandas.DataFrame
+        x0, y0, sig_x, sig_y, A, B (in pixel indices, as Fit2DWidget), reduced
+        chi-square (redchi) and fit success, indexed by file name. Files that
+        couldn't be read or fit have success=False and NaN parameters.
+    '''
+    files = [str(fname) for fname in files]
+    settings = fit_settings_key(roi,half_width,**fit_kwargs)
+    if (catalog is None) or refit:
+        known = pd.DataFrame(columns=BEAM_CENTER_COLUMNS)
+    else:
+        known = catalog.get_beam_centers(files,settings)
+    todo = [fname for fname in files if fname not in known.index]
+
+    tasks = [(fname,roi,half_width,fit_kwargs) for fname in todo]
+    if max_workers==1 or len(tasks)<=1:
+        outputs = list(map(_fit_file,tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            outputs = list(executor.map(_fit_file,tasks,chunksize=max(len(tasks)//32,1)))
+
+    fitted = pd.DataFrame.from_dict(dict(outputs),orient='index',columns=BEAM_CENTER_COLUMNS)
+    if catalog is not None:
+        succeeded = fitted[fitted['success'].astype(bool)]
+        if succeeded.shape[0]>0:
+            catalog.store_beam_centers(succeeded,settings)
+
+    df = pd.concat([known,fitted]).reindex(files)
+    df = df.astype({c:float for c in BEAM_CENTER_COLUMNS[:-1]})
+    df['success'] = df['success'].fillna(False).astype(bool)
+    return df
+
+def _box_sum(args):
+    '''Sum the counts of one file in a region (runs in a worker process)'''
+    fname,roi = args
+    try:
+        return np.nansum(read_image(fname,roi))
+    except (OSError,KeyError,ValueError):
+        return np.nan
+
+def box_sums(files,roi,max_workers=None):
+    '''Sum the counts within a region of interest (e.g. for transmissions) of many files
+
+    Arguments
+    ---------
+    files: list
+        Nexus, RAW or stack member files
+
+    roi: tuple
+        (y_start,y_stop,x_start,x_stop) [pixels], see beam_roi. Only this region
+        of each file is read.
+
+    max_workers: int or None
+        number of worker processes. With max_workers=1 everything runs in this
+        process.
+
+    Returns
+    -------
+    sums: pandas.Series
+        box sums indexed by file name, NaN for files that couldn't be read
+    '''
+    files = [str(fname) for fname in files]
+    tasks = [(fname,roi) for fname in files]
+    if max_workers==1 or len(tasks)<=1:
+        outputs = list(map(_box_sum,tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            outputs = list(executor.map(_box_sum,tasks,chunksize=max(len(tasks)//32,1)))
+    return pd.Series(outputs,index=files,dtype=float,name='box_sum')
+
@@ -0,0 +1,241 @@
+'''
+Memory-resident calibration frames for reduction
+
+Empty cell, blocked beam and sensitivity (DIV) frames are the same for every
+sample measured in a configuration. They are read and monitor-normalized once,
+combined with the DIV and solid-angle corrections into a single per-pixel
+correction array, and reused for all samples.
+'''
+import pathlib
+
+import numpy as np
+
+from typySANS.misc import LRUCache,split_stack_path
+
+def solid_angle_correction(SDD,x0,y0,shape=(128,128),pixel_size=0.00508):
+    '''Per-pixel factor 1/cos^3(2θ) that corrects for the smaller solid angle
+    of pixels far from the beam center on a flat detector
+
+    Arguments
+    ---------
+    SDD: float
+        sample to detector distance [cm]
+
+    x0,y0: float
+        beam center location [pixels]
+
+    shape: tuple
+        detector shape (Ny,Nx) [pixels]
+
+    pixel_size: float
+        detector pixel size [m]
+    '''
+    Ny,Nx = shape
+    dx = (np.arange(Nx)+0.5-x0)*pixel_size*100.0 #cm
+    dy = (np.arange(Ny)+0.5-y0)*pixel_size*100.0
+    r2 = dx[np.newaxis,:]**2 + dy[:,np.newaxis]**2
+    cos_2theta = SDD/np.sqrt(SDD**2 + r2)
+    return 1.0/cos_2theta**3
+
+class Calibration:
+    '''Normalized reference frames and corrections of one configuration
+
+    For every sample frame with counts C, monitor M, transmission T and thickness d
+
+        I = abs_scale*(C*norm/M - B - T/T_emp*(E - B))*correction/(T*d)
+
+    where E and B are the monitor-normalized empty cell and blocked beam frames and
+    correction combines 1/DIV and the solid angle factor.
+
+    Arguments
+    ---------
+    empty: dict or None
+        empty cell reference with keys counts (Ny,Nx), monitor and transmission
+
+    blocked: dict or None
+        blocked beam reference with keys counts (Ny,Nx) and monitor
+
+    div: np.ndarray or None
+        (Ny,Nx) detector sensitivity (DIV) file
+
+    solid_angle: np.ndarray or None
+        (Ny,Nx) solid angle correction factor (see solid_angle_correction)
+
+    monitor_norm: float
+        monitor counts to normalize to
+    '''
+    def __init__(self,empty=None,blocked=None,div=None,solid_angle=None,monitor_norm=1e8):
+        self.monitor_norm = monitor_norm
+
+        self.B,self.vB = self.normalize(blocked)
+        E,vE = self.normalize(empty)
+        if empty is None:
+            self.EB = 0.0
+            self.vE = 0.0
+            self.transmission_empty = None
+        else:
+            self.EB = E - self.B
+            self.vE = vE
+            self.transmission_empty = empty['transmission']
+
+        correction = 1.0
+        if div is not None:
+            correction = correction/np.asarray(div,dtype=float)
+        if solid_angle is not None:
+            correction = correction*solid_angle
+        self.correction = correction
+        self.correction_sq = np.square(correction)
+
+    def normalize(self,reference):
+        if reference is None:
+            return 0.0,0.0
+        scale = self.monitor_norm/reference['monitor']
+        counts = np.asarray(reference['counts'],dtype=float)
+        return counts*scale,np.clip(counts,0,None)*scale**2
+
+    def apply(self,counts,monitor,transmission,thickness,abs_scale=1.0):
+        '''Reduce a stack of frames to absolute intensity
+
+        Arguments
+        ---------
+        counts: np.ndarray
+            (N,Ny,Nx) raw detector counts
+
+        monitor,transmission,thickness: np.ndarray
+            (N,) monitor counts, sample transmissions and thicknesses [cm]
+
+        abs_scale: float
+            absolute scale factor (kappa) from the open beam measurement
+
+        Returns
+        -------
+        I: np.ndarray
+            (N,Ny,Nx) corrected intensities
+
+        variance: np.ndarray
+            (N,Ny,Nx) variance of I
+        '''
+        counts = np.asarray(counts,dtype=float)
+        N = counts.shape[0]
+        per_frame = lambda v: np.broadcast_to(np.asarray(v,dtype=float),(N,)).reshape(N,1,1)
+        scale = self.monitor_norm/per_frame(monitor)
+        transmission = per_frame(transmission)
+        factor = abs_scale/(transmission*per_frame(thickness))
+
+        if self.transmission_empty is None:
+            ratio = 0.0
+        else:
+            ratio = transmission/self.transmission_empty
+
+        I = (counts*scale - self.B - ratio*self.EB)*(self.correction*factor)
+        variance = (
+            np.clip(counts,0,None)*scale**2
+            + ratio**2*self.vE
+            + (1.0-ratio)**2*self.vB
+        )*(self.correction_sq*factor**2)
+        return I,variance
+
+class CalibrationStore:
+    '''Cache of reference frames and Calibrations
+
+    Reference files are read once (and again only if they are modified) and every
+    Calibration is built once per configuration, so reducing many samples in the
+    same configuration doesn't touch the reference files again.
+
+    Arguments
+    ---------
+    reader: callable
+        reader(fname) -> frame dict (see Reduction.read_frame)
+
+    div: np.ndarray or None
+        (Ny,Nx) detector sensitivity (DIV) file
+
+    solid_angle: bool
+        include the solid angle correction. Off by default, as in
+        Reduction.ReductionPipeline.
+
+    monitor_norm: float
+        monitor counts to normalize to
+
+    maxsize: int
+        Maximum number of files and of configurations to keep
+    '''
+    def __init__(self,reader,div=None,solid_angle=False,monitor_norm=1e8,maxsize=32):
+        self.reader = reader
+        self.div = div
+        self.solid_angle = solid_angle
+        self.monitor_norm = monitor_norm
+        self.frames = LRUCache(maxsize)
+        self.calibrations = LRUCache(maxsize)
+
+    def file_key(self,fname):
+        store,member = split_stack_path(fname)
+        fpath = pathlib.Path(store)
+        return (str(fpath.resolve()),member,fpath.stat().st_mtime_ns)
+
+    def read(self,fname):
+        '''Return the (cached) frame of a reference file'''
+        key = self.file_key(fname)
+        frame = self.frames.get(key,None)
+        if frame is None:
+            frame = self.reader(fname)
+            self.frames[key] = frame
+        return frame
+
+    def combine(self,files):
+        '''Sum the counts and monitors of several measurements of the same reference'''
+        if not files:
+            return None
+        frames = [self.read(fname) for fname in files]
+        reference = {
+            'counts':np.sum([f['counts'] for f in frames],axis=0),
+            'monitor':np.sum([f['monitor'] for f in frames]),
+            'transmission':frames[0]['transmission'],
+        }
+        return reference
+
+    def get(self,geometry,empty=(),blocked=(),shape=(128,128)):
+        '''Return the (cached) Calibration of a configuration
+
+        Arguments
+        ---------
+        geometry: dict
+            SDD [cm], wavelength [Å], x0, y0 [pixels] and pixel_size [m]
+
+        empty,blocked: sequence
+            empty cell and blocked beam files of this configuration
+
+        shape: tuple
+            detector shape (Ny,Nx) [pixels]
+        '''
+        key = (
+            tuple(sorted(geometry.items())),
+            tuple(self.file_key(f) for f in empty),
+            tuple(self.file_key(f) for f in blocked),
+            tuple(shape),
+        )
+        calibration = self.calibrations.get(key,None)
+        if calibration is None:
+            if self.solid_angle:
+                solid_angle = solid_angle_correction(
+                    geometry['SDD'],
+                    geometry['x0'],
+                    geometry['y0'],
+                    shape,
+                    geometry.get('pixel_size',0.00508),
+                )
+            else:
+                solid_angle = None
+            calibration = Calibration(
+                empty=self.combine(empty),
+                blocked=self.combine(blocked),
+                div=self.div,
+                solid_angle=solid_angle,
+                monitor_norm=self.monitor_norm,
+            )
+            self.calibrations[key] = calibration
+        return calibration
+
+    def clear(self):
+        self.frames.clear()
+        self.calibrations.clear()
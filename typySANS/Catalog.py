@@ -0,0 +1,275 @@
+'''
+SQLite sidecar catalog of per-file results
+
+Results are keyed by file path, size and modification time so that entries for
+files that have been changed or replaced are ignored.
+'''
+import os
+import pathlib
+import hashlib
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import h5py
+
+from typySANS.misc import STACK_SEPARATOR,split_stack_path
+
+BEAM_CENTER_COLUMNS = ['x0','y0','sig_x','sig_y','A','B','redchi','success']
+
+NEXUS_COLUMNS = ['label','countTime','detectorDistance','wavelength','beamCenterX','beamCenterY']
+
+def read_nexus_metadata(fname):
+    '''Read the NEXUS_COLUMNS of a Nexus file. Unreadable values are NaN (label None).'''
+    row = {'label':None,'countTime':np.nan,'detectorDistance':np.nan,'wavelength':np.nan,'beamCenterX':np.nan,'beamCenterY':np.nan}
+    try:
+        with h5py.File(fname,'r') as h5:
+            row['label'] = h5['entry/sample/description'][()][0].decode('utf8')
+            row['countTime'] = float(h5['entry/collection_time'][()][0])
+            row['detectorDistance'] = float(h5['entry/DAS_logs/detectorPosition/softPosition'][()][0])
+            row['wavelength'] = float(h5['entry/DAS_logs/wavelength/wavelength'][()][0])
+            row['beamCenterX'] = float(h5['entry/instrument/detector/beam_center_x'][()][0])
+            row['beamCenterY'] = float(h5['entry/instrument/detector/beam_center_y'][()][0])
+    except (OSError,KeyError,IndexError,ValueError):
+        pass
+    return row
+
+def _read_metadata(fnames):
+    '''Read the metadata of a chunk of files (runs in a worker process)'''
+    return [read_nexus_metadata(fname) for fname in fnames]
+
+def user_cache_dir():
+    '''Per-user cache directory of typySANS ($XDG_CACHE_HOME/typySANS)'''
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'),'.cache')
+    return pathlib.Path(base)/'typySANS'
+
+def writable(path):
+    '''True if the database file path can be created or written, including its journal'''
+    path = pathlib.Path(path)
+    if not os.access(path.parent,os.W_OK):
+        return False
+    return os.access(path,os.W_OK) if path.exists() else True
+
+class FileCatalog:
+    '''SQLite catalog stored next to the data files
+
+    If the catalog can't be written there (e.g. read-only data directories), it is
+    kept in the per-user cache directory under a name derived from the resolved
+    catalog path, and as a last resort in memory.
+
+    Arguments
+    ---------
+    path: str or pathlib.Path
+        Path to the catalog database or to the data directory, in which case the
+        catalog is stored in that directory as catalog_name
+
+    catalog_name: str
+        File name of the catalog database inside a data directory
+
+    cache_dir: str or pathlib.Path or None
+        fallback directory, see user_cache_dir
+    '''
+    def __init__(self,path,catalog_name='.typySANS_catalog.sqlite',cache_dir=None):
+        path = pathlib.Path(path)
+        if path.is_dir():
+            path = path/catalog_name
+        if cache_dir is None:
+            cache_dir = user_cache_dir()
+        digest = hashlib.sha1(str(path.resolve()).encode('utf8')).hexdigest()[:16]
+        fallback = pathlib.Path(cache_dir)/f'{digest}_{path.name}'
+
+        self.connection = None
+        for candidate in (path,fallback,':memory:'):
+            if candidate is fallback:
+                try:
+                    fallback.parent.mkdir(parents=True,exist_ok=True)
+                except OSError:
+                    continue
+            if candidate!=':memory:' and not writable(candidate):
+                continue
+            try:
+                self.connection = sqlite3.connect(str(candidate))
+                self.create_tables()
+            except sqlite3.Error:
+                if self.connection is not None:
+                    self.connection.close()
+                    self.connection = None
+                continue
+            self.path = candidate
+            break
+
+    def create_tables(self):
+        columns = ','.join(f'{c} REAL' for c in BEAM_CENTER_COLUMNS)
+        nexus_columns = ','.join(f'{c} TEXT' if c=='label' else f'{c} REAL' for c in NEXUS_COLUMNS)
+        # beam centers are keyed by the fit settings too; catalogs from before
+        # that hold results of unknown settings, which are dropped
+        known = [row[1] for row in self.connection.execute('PRAGMA table_info(beam_centers)')]
+        with self.connection:
+            if known and 'settings' not in known:
+                self.connection.execute('DROP TABLE beam_centers')
+            self.connection.execute(
+                f'CREATE TABLE IF NOT EXISTS beam_centers '
+                f'(path TEXT, settings TEXT, size INTEGER, mtime INTEGER, {columns}, '
+                f'PRIMARY KEY (path,settings))'
+            )
+            self.connection.execute(
+                f'CREATE TABLE IF NOT EXISTS nexus_metadata '
+                f'(path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, {nexus_columns})'
+            )
+
+    def close(self):
+        self.connection.close()
+
+    def prune(self):
+        '''Delete the entries of files that no longer exist
+
+        Returns
+        -------
+        n: int
+            number of deleted entries
+        '''
+        n = 0
+        for table in ('beam_centers','nexus_metadata'):
+            paths = [row[0] for row in self.connection.execute(f'SELECT path FROM {table}')]
+            gone = [(path,) for path in paths if not os.path.exists(split_stack_path(path)[0])]
+            with self.connection:
+                self.connection.executemany(f'DELETE FROM {table} WHERE path=?',gone)
+            n += len(gone)
+        return n
+
+    @staticmethod
+    def file_key(fname):
+        '''(resolved path, size, mtime) of a file. Consolidated stack members
+        ("store.h5::filename") take the size and mtime of the stack.'''
+        store,member = split_stack_path(fname)
+        fpath = pathlib.Path(store)
+        stat = fpath.stat()
+        path = str(fpath.resolve())
+        if member is not None:
+            path += STACK_SEPARATOR+member
+        return path,stat.st_size,stat.st_mtime_ns
+
+    def store_beam_centers(self,df,settings=''):
+        '''Store a table of beam centers indexed by file name (see BeamCenter.fit_beam_centers)
+
+        settings: str
+            digest of the fit settings the beam centers were obtained with (see
+            BeamCenter.fit_settings_key)
+        '''
+        rows = []
+        for fname,row in df.iterrows():
+            path,size,mtime = self.file_key(fname)
+            rows.append((path,settings,size,mtime)+tuple(float(row[c]) for c in BEAM_CENTER_COLUMNS))
+        placeholders = ','.join('?'*(4+len(BEAM_CENTER_COLUMNS)))
+        with self.connection:
+            self.connection.executemany(
+                f'INSERT OR REPLACE INTO beam_centers VALUES ({placeholders})',
+                rows
+            )
+
+    def get_beam_centers(self,files,settings=''):
+        '''Return the stored beam centers of the (unmodified) files fit with the
+        given settings (see store_beam_centers)
+
+        Returns
+        -------
+        df: pandas.DataFrame
+            beam centers indexed by file name as passed in. Files without a
+            valid entry are left out.
+        '''
+        columns = ','.join(BEAM_CENTER_COLUMNS)
+        results = {}
+        for fname in files:
+            path,size,mtime = self.file_key(fname)
+            row = self.connection.execute(
+                f'SELECT {columns} FROM beam_centers WHERE path=? AND settings=? AND size=? AND mtime=?',
+                (path,settings,size,mtime)
+            ).fetchone()
+            if row is not None:
+                results[str(fname)] = row
+        df = pd.DataFrame.from_dict(results,orient='index',columns=BEAM_CENTER_COLUMNS)
+        df['success'] = df['success'].astype(bool)
+        return df
+
+    def get_beam_center(self,fname,settings=''):
+        '''Return the stored beam center of a file as a dict, or None'''
+        df = self.get_beam_centers([fname],settings)
+        if df.shape[0]==0:
+            return None
+        return df.iloc[0].to_dict()
+
+    def scan_nexus(self,path,pattern='*nxs*',max_workers=None,chunksize=64):
+        '''Metadata of all Nexus files in a directory, reading only new or changed files
+
+        Arguments
+        ---------
+        path: str or pathlib.Path
+            data directory
+
+        pattern: str
+            glob pattern of the Nexus files
+
+        max_workers: int or None
+            number of worker processes used to read new files. With max_workers=1
+            everything runs in this process.
+
+        chunksize: int
+            number of files read per worker task
+
+        Returns
+        -------
+        df: pandas.DataFrame
+            filename and NEXUS_COLUMNS, sorted by filename
+        '''
+        path = pathlib.Path(path).resolve()
+        files = {}
+        for entry in os.scandir(path):
+            if entry.is_file() and pathlib.PurePath(entry.name).match(pattern):
+                stat = entry.stat()
+                files[entry.name] = (str(path/entry.name),stat.st_size,stat.st_mtime_ns)
+
+        # one query for the whole directory rather than one per file. A range
+        # rather than LIKE, in which '_' and '%' of directory names are wildcards;
+        # entries of subdirectories sort into the range too and are left out
+        columns = ','.join(NEXUS_COLUMNS)
+        prefix = str(path)+os.sep
+        known = {}
+        for row in self.connection.execute(
+            f'SELECT path,size,mtime,{columns} FROM nexus_metadata WHERE path>=? AND path<?',
+            (prefix,prefix[:-1]+chr(ord(os.sep)+1))
+        ):
+            if os.sep not in row[0][len(prefix):]:
+                known[row[0]] = row
+        todo = [name for name,key in sorted(files.items()) if known.get(key[0],(None,None,None))[:3]!=key]
+
+        # forget files that were deleted from the directory
+        current = {key[0] for key in files.values()}
+        gone = [(p,) for p in known if p not in current and not os.path.exists(p)]
+        if gone:
+            with self.connection:
+                self.connection.executemany('DELETE FROM nexus_metadata WHERE path=?',gone)
+
+        chunks = [[str(path/name) for name in todo[i:i+chunksize]] for i in range(0,len(todo),chunksize)]
+        if max_workers==1 or len(chunks)<=1:
+            outputs = list(map(_read_metadata,chunks))
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                outputs = list(executor.map(_read_metadata,chunks))
+        rows = [row for output in outputs for row in output]
+
+        if todo:
+            placeholders = ','.join('?'*(3+len(NEXUS_COLUMNS)))
+            new = [files[name]+tuple(row[c] for c in NEXUS_COLUMNS) for name,row in zip(todo,rows)]
+            with self.connection:
+                self.connection.executemany(f'INSERT OR REPLACE INTO nexus_metadata VALUES ({placeholders})',new)
+            for row in new:
+                known[row[0]] = row
+
+        df = pd.DataFrame(
+            [(name,)+known[key[0]][3:] for name,key in sorted(files.items())],
+            columns=['filename']+NEXUS_COLUMNS,
+        )
+        df = df.astype({c:float for c in NEXUS_COLUMNS[1:]})
+        return df
+
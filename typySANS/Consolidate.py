@@ -0,0 +1,284 @@
+'''
+Consolidated frame stacks
+
+All frames of an experiment are packed into a single HDF5 file:
+
+    frames              (N,Ny,Nx) detector counts, one compressed chunk per frame
+    metadata/<column>   (N,) one array per metadata column
+
+The metadata holds the catalog fields (see Catalog.NEXUS_COLUMNS), the values
+needed for reduction and the first value of every numeric DAS_logs dataset
+(columns named DAS_logs/<group>/<dataset>).
+
+Frames in a stack are addressed as "store.h5::filename", which RAW/Nexus readers
+(Reduction.read_frame, BeamCenter.read_image) accept like regular paths.
+'''
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import h5py
+
+from typySANS.Catalog import read_nexus_metadata
+from typySANS.SparseIntegrator import geometry_from_nexus
+from typySANS.misc import LRUCache,STACK_SEPARATOR,split_stack_path
+
+STACK_FORMAT = 'typySANS consolidated stack'
+STACK_VERSION = 1
+
+_STACKS = LRUCache(maxsize=8) #open stacks, see open_stack
+
+def das_log_scalars(h5):
+    '''First value of every numeric dataset below entry/DAS_logs
+
+    Returns
+    -------
+    values: dict
+        {'DAS_logs/<group>/<dataset>': float}
+    '''
+    values = {}
+    if 'entry/DAS_logs' not in h5:
+        return values
+    def visit(name,obj):
+        if isinstance(obj,h5py.Dataset) and obj.dtype.kind in 'biuf' and obj.size>0:
+            values['DAS_logs/'+name] = float(obj[(0,)*obj.ndim])
+    h5['entry/DAS_logs'].visititems(visit)
+    return values
+
+def read_member(fname):
+    '''Read the counts and metadata row of one Nexus file
+
+    Returns
+    -------
+    img: np.ndarray
+        (Ny,Nx) counts
+
+    row: dict
+        metadata columns
+    '''
+    row = {'filename':pathlib.Path(fname).name,'path':str(fname)}
+    row.update(read_nexus_metadata(fname))
+    with h5py.File(fname,'r') as h5:
+        img = h5['entry/data/y'][()].T
+        geometry = geometry_from_nexus(h5)
+        row.update({
+            'monitor':float(h5['entry/control/monitor_counts'][()][0]),
+            'transmission':float(h5['entry/sample/transmission'][()][0]),
+            'thickness':float(h5['entry/sample/thickness'][()][0]),
+        })
+        row.update(geometry)
+        row.update(das_log_scalars(h5))
+    return img,row
+
+def _read_members(fnames):
+    '''Read a chunk of files (runs in a worker process)'''
+    return [read_member(fname) for fname in fnames]
+
+def consolidate(files,out,max_workers=None,chunksize=16,compression='gzip',compression_opts=4):
+    '''Pack Nexus files into one chunked, compressed HDF5 stack
+
+    Arguments
+    ---------
+    files: list
+        Nexus files, all with the same detector shape. File names must be unique.
+
+    out: str or pathlib.Path
+        stack file to write (overwritten)
+
+    max_workers: int or None
+        number of worker processes used to read the files. With max_workers=1
+        everything runs in this process.
+
+    chunksize: int
+        number of files read per worker task
+
+    compression,compression_opts:
+        HDF5 compression filter of the frames (see h5py.Group.create_dataset)
+
+    Returns
+    -------
+    metadata: pandas.DataFrame
+        metadata table as stored, one row per frame
+    '''
+    files = [str(fname) for fname in files]
+    names = [pathlib.Path(fname).name for fname in files]
+    if len(set(names))!=len(names):
+        raise ValueError('Cannot consolidate files with duplicate file names')
+    if not files:
+        raise ValueError('No files to consolidate')
+
+    stack = _STACKS.pop(str(pathlib.Path(out).resolve()),None)
+    if stack is not None:
+        stack.close()
+
+    chunks = [files[i:i+chunksize] for i in range(0,len(files),chunksize)]
+    rows = []
+    with h5py.File(out,'w') as h5:
+        h5.attrs['format'] = STACK_FORMAT
+        h5.attrs['version'] = STACK_VERSION
+        frames = None
+        if max_workers==1 or len(chunks)<=1:
+            outputs = map(_read_members,chunks)
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(max_workers=max_workers)
+            outputs = executor.map(_read_members,chunks)
+        try:
+            # frames are written as they arrive so the stack never has to fit in memory
+            for output in outputs:
+                for img,row in output:
+                    if frames is None:
+                        frames = h5.create_dataset(
+                            'frames',
+                            shape=(len(files),)+img.shape,
+                            dtype=img.dtype,
+                            chunks=(1,)+img.shape,
+                            compression=compression,
+                            compression_opts=compression_opts,
+                            shuffle=True,
+                        )
+                    frames[len(rows)] = img
+                    rows.append(row)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        metadata = pd.DataFrame(rows)
+        group = h5.create_group('metadata')
+        group.attrs['columns'] = list(metadata.columns)
+        for column in metadata.columns:
+            values = metadata[column]
+            if pd.api.types.is_string_dtype(values) or pd.api.types.is_object_dtype(values):
+                strings = np.array([str(v) for v in values.fillna('')],dtype=object)
+                group.create_dataset(column,data=strings,dtype=h5py.string_dtype())
+            else:
+                group.create_dataset(column,data=values.values)
+    return metadata
+
+def is_stack(fname):
+    '''True if fname is a consolidated stack file'''
+    try:
+        if not h5py.is_hdf5(fname):
+            return False
+        with h5py.File(fname,'r') as h5:
+            return h5.attrs.get('format',None)==STACK_FORMAT
+    except OSError:
+        return False
+
+class ConsolidatedStack:
+    '''Read access to a consolidated stack
+
+    Frames can be addressed by position or by their original file name.
+
+    Arguments
+    ---------
+    path: str or pathlib.Path
+        stack file written by consolidate
+    '''
+    def __init__(self,path):
+        self.path = str(path)
+        self.h5 = h5py.File(self.path,'r')
+        if self.h5.attrs.get('format',None)!=STACK_FORMAT:
+            self.h5.close()
+            raise ValueError(f'{path} is not a consolidated stack')
+        self._metadata = None
+        self._index = None
+
+    def close(self):
+        self.h5.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def __len__(self):
+        return self.h5['frames'].shape[0]
+
+    @property
+    def shape(self):
+        return self.h5['frames'].shape
+
+    @property
+    def metadata(self):
+        '''Metadata table (pandas.DataFrame), one row per frame'''
+        if self._metadata is None:
+            group = self.h5['metadata']
+            data = {}
+            for column in group.attrs['columns']:
+                values = group[column]
+                if h5py.check_string_dtype(values.dtype) is not None:
+                    data[column] = values.asstr()[()]
+                else:
+                    data[column] = values[()]
+            self._metadata = pd.DataFrame(data)
+        return self._metadata
+
+    @property
+    def filenames(self):
+        return list(self.metadata['filename'])
+
+    def paths(self):
+        '''Member paths ("store.h5::filename") of all frames'''
+        return [self.path+STACK_SEPARATOR+name for name in self.filenames]
+
+    def index(self,key):
+        '''Position of a frame given its position or file name'''
+        if isinstance(key,str):
+            if self._index is None:
+                self._index = {name:i for i,name in enumerate(self.filenames)}
+            try:
+                return self._index[key]
+            except KeyError:
+                raise ValueError(f'{key} is not in {self.path}')
+        return int(key)
+
+    def frame(self,key,roi=None):
+        '''(Ny,Nx) counts of one frame, or only the region roi=(slice_y,slice_x)'''
+        if roi is None:
+            return self.h5['frames'][self.index(key)]
+        return self.h5['frames'][(self.index(key),)+tuple(roi)]
+
+    def frames(self,keys=None):
+        '''(N,Ny,Nx) counts of several frames (all if keys is None)'''
+        if keys is None:
+            return self.h5['frames'][()]
+        indices = np.array([self.index(key) for key in keys],dtype=int)
+        # h5py needs increasing, unique indices for a point selection
+        unique,inverse = np.unique(indices,return_inverse=True)
+        return self.h5['frames'][unique][inverse]
+
+    def read_frame(self,key,counts=True):
+        '''Frame of one member in the format of Reduction.read_frame'''
+        i = self.index(key)
+        row = self.metadata.iloc[i]
+        frame = {
+            'fname':self.path+STACK_SEPARATOR+row['filename'],
+            'shape':self.shape[1:],
+            'monitor':float(row['monitor']),
+            'transmission':float(row['transmission']),
+            'thickness':float(row['thickness']),
+            'geometry':{k:float(row[k]) for k in ['SDD','wavelength','x0','y0','pixel_size']},
+            'resolution':None,
+        }
+        if counts:
+            frame['counts'] = np.asarray(self.frame(i),dtype=float)
+        return frame
+
+def open_stack(path):
+    '''Open a stack, reusing already open stacks'''
+    path = str(pathlib.Path(path).resolve())
+    stack = _STACKS.get(path,None)
+    if stack is None:
+        stack = ConsolidatedStack(path)
+        _STACKS[path] = stack
+    return stack
+
+def read_stack_frame(fname,counts=True):
+    '''Read the frame of a member path "store.h5::filename", see Reduction.read_frame'''
+    store,member = split_stack_path(fname)
+    if member is None:
+        raise ValueError(f'{fname} is not a stack member path')
+    return open_stack(store).read_frame(member,counts)
@@ -0,0 +1,158 @@
+'''
+Tidy extraction of Nexus DAS_logs
+
+Every numeric dataset below entry/DAS_logs/<group> is a channel named
+<group>/<path inside group>, e.g. temp/primaryNode/value. A dataset with a
+sibling "time" dataset of the same length is taken as a time series on that
+time axis.
+'''
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import h5py
+
+DAS_LOG_COLUMNS = ['path','filename','channel','index','time','value']
+
+def read_das_log_arrays(fname,groups=None):
+    '''Read the DAS_logs channels of one file
+
+    Arguments
+    ---------
+    fname: str or pathlib.Path
+        Nexus file
+
+    groups: list or None
+        DAS_logs groups to read (e.g. ['temp','magnet']), all if None
+
+    Returns
+    -------
+    arrays: dict
+        {channel: (time,value)} with 1D arrays; time is None for channels
+        without a time axis
+    '''
+    arrays = {}
+    with h5py.File(fname,'r') as h5:
+        if 'entry/DAS_logs' not in h5:
+            return arrays
+        logs = h5['entry/DAS_logs']
+        if groups is None:
+            groups = list(logs.keys())
+
+        for group in groups:
+            if group not in logs or not isinstance(logs[group],h5py.Group):
+                continue
+            datasets = {}
+            def visit(name,obj):
+                if isinstance(obj,h5py.Dataset) and obj.dtype.kind in 'biuf':
+                    datasets[name] = obj
+            logs[group].visititems(visit)
+
+            for name,dataset in datasets.items():
+                parent,_,leaf = name.rpartition('/')
+                if leaf=='time':
+                    continue
+                value = np.ravel(dataset[()]).astype(float)
+                time_name = parent+'/time' if parent else 'time'
+                time = None
+                if time_name in datasets and datasets[time_name].size==value.shape[0]:
+                    time = np.ravel(datasets[time_name][()]).astype(float)
+                arrays[group+'/'+name] = (time,value)
+    return arrays
+
+def read_das_logs(fname,groups=None):
+    '''DAS_logs of one file as a long-format table, see extract_das_logs'''
+    arrays = read_das_log_arrays(fname,groups)
+    if not arrays:
+        return pd.DataFrame({c:[] for c in DAS_LOG_COLUMNS})
+
+    channels = list(arrays.keys())
+    lengths = np.array([arrays[c][1].shape[0] for c in channels])
+    offsets = np.repeat(np.cumsum(lengths)-lengths,lengths)
+    time = np.concatenate([
+        np.full(n,np.nan) if arrays[c][0] is None else arrays[c][0]
+        for c,n in zip(channels,lengths)
+    ])
+    df = pd.DataFrame({
+        'path':str(fname),
+        'filename':pathlib.Path(fname).name,
+        'channel':pd.Categorical(np.repeat(channels,lengths)),
+        'index':np.arange(lengths.sum())-offsets,
+        'time':time,
+        'value':np.concatenate([arrays[c][1] for c in channels]),
+    })
+    return df
+
+def _read_das_logs(args):
+    '''Read the DAS_logs of a chunk of files (runs in a worker process)'''
+    fnames,groups = args
+    frames = []
+    for fname in fnames:
+        try:
+            frames.append(read_das_logs(fname,groups))
+        except (OSError,KeyError):
+            continue
+    if not frames:
+        return pd.DataFrame({c:[] for c in DAS_LOG_COLUMNS})
+    return pd.concat(frames,ignore_index=True)
+
+def extract_das_logs(files,groups=None,max_workers=None,chunksize=16):
+    '''Extract DAS_logs channels from many Nexus files in parallel
+
+    Arguments
+    ---------
+    files: list
+        Nexus files
+
+    groups: list or None
+        DAS_logs groups to read (e.g. ['temp','magnet','sampleStage']), all if None
+
+    max_workers: int or None
+        number of worker processes. With max_workers=1 everything runs in this
+        process.
+
+    chunksize: int
+        number of files read per worker task
+
+    Returns
+    -------
+    df: pandas.DataFrame
+        one row per logged value with columns path (as passed in), filename,
+        channel, index (position in the channel), time (NaN for channels without
+        a time axis) and value. Unreadable files are left out.
+    '''
+    files = [str(fname) for fname in files]
+    tasks = [(files[i:i+chunksize],groups) for i in range(0,len(files),chunksize)]
+    if max_workers==1 or len(tasks)<=1:
+        outputs = list(map(_read_das_logs,tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            outputs = list(executor.map(_read_das_logs,tasks))
+
+    outputs = [df for df in outputs if df.shape[0]>0]
+    if not outputs:
+        return pd.DataFrame({c:[] for c in DAS_LOG_COLUMNS})
+    df = pd.concat(outputs,ignore_index=True)
+    df['channel'] = df['channel'].astype('category')
+    return df
+
+def summarize_das_logs(df,agg='mean'):
+    '''Wide table of one aggregate per file and channel
+
+    Arguments
+    ---------
+    df: pandas.DataFrame
+        long-format table from extract_das_logs
+
+    agg: str or callable
+        aggregation applied to the values of each channel (e.g. 'mean', 'std',
+        'first', 'last')
+
+    Returns
+    -------
+    df: pandas.DataFrame
+        indexed by path (as passed to extract_das_logs, like box_sums and
+        BeamCenter.fit_beam_centers) with one column per channel
+    '''
+    return df.groupby(['path','channel'],observed=True)['value'].agg(agg).unstack('channel')
@@ -0,0 +1,62 @@
+import numpy as np
+from matplotlib.collections import LineCollection
+
+
+class ErrorBarCollection(LineCollection):
+    '''Vertical error bars drawn as a single, cheaply updatable LineCollection
+
+    Matplotlib's errorbar containers are made of many artists and are very difficult
+    to update. This collection instead owns a preallocated (capacity,2,2) segment
+    buffer that is rewritten in place on every update so that changing the data
+    doesn't require removing and re-adding artists. Unused segments are set to NaN
+    and are not drawn.
+
+    Arguments
+    ---------
+    capacity: int
+        Initial number of error bars to allocate. The buffer grows if needed.
+
+    **kwargs:
+        Passed on to matplotlib.collections.LineCollection (e.g. color, lw)
+    '''
+    def __init__(self,capacity=256,**kwargs):
+        super().__init__([],**kwargs)
+        self.n = 0
+        self.allocate(capacity)
+
+    def allocate(self,capacity):
+        self.segments = np.full((capacity,2,2),np.nan)
+        # matplotlib builds the segment paths from views of the buffer, so
+        # in-place writes below are picked up without calling set_segments again
+        self.set_segments(self.segments)
+
+    @property
+    def capacity(self):
+        return self.segments.shape[0]
+
+    def update_data(self,x,y,dy):
+        '''Set the error bars to span y-dy to y+dy at each x
+
+        Arguments
+        ---------
+        x,y,dy: np.ndarray
+            Positions, values and (symmetric) uncertainties of the error bars
+        '''
+        n = len(x)
+        if n>self.capacity:
+            self.allocate(max(n,2*self.capacity))
+
+        seg = self.segments
+        seg[:n,0,0] = x
+        seg[:n,1,0] = x
+        np.subtract(y,dy,out=seg[:n,0,1])
+        np.add(y,dy,out=seg[:n,1,1])
+        if n<self.n:
+            seg[n:self.n] = np.nan
+        self.n = n
+        self.stale = True
+
+    def clear_data(self):
+        self.segments[:self.n] = np.nan
+        self.n = 0
+        self.stale = True
@@ -1,38 +1,138 @@
 import ftplib
 import threading
-import queue
 import pathlib
-from concurrent.futures import ProcessPoolExecutor
-
-# needs to be free function
-def download_file(paths,url='ncnr.nist.gov'):
-    src_path,dest_path = paths
-    filename = src_path.parts[-1] #assumed src_path is a pathlib.Path object!
-    with ftplib.FTP(url) as ftp:
-        ftp.login()
-        with open(dest_path/filename,'wb') as f:
-            ftp.retrbinary(f'RETR {str(src_path)}',f.write)
-            
+from concurrent.futures import ThreadPoolExecutor
+
 class FTP:
-    def __init__(self,url='ncnr.nist.gov'):
+    '''Download files over pooled, persistent FTP connections
+
+    Every worker thread of the pool logs in once and reuses its control
+    connection for all of its RETRs. A connection that fails is closed and
+    re-established, and the transfer retried.
+
+    Arguments
+    ---------
+    url: str
+        FTP host
+
+    max_workers: int
+        number of worker threads, i.e. of simultaneous connections
+
+    user,passwd: str
+        login credentials (anonymous by default)
+
+    port: int
+        FTP control port
+
+    retries: int
+        number of times a failed transfer is retried on a new connection
+
+    timeout: float
+        socket timeout [s]
+    '''
+    def __init__(self,url='ncnr.nist.gov',max_workers=5,user='',passwd='',port=21,retries=3,timeout=60):
         self.url = url
+        self.max_workers = max_workers
+        self.user = user
+        self.passwd = passwd
+        self.port = port
+        self.retries = retries
+        self.timeout = timeout
         self.executor = None
-            
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+
     def stop(self,*args):#*args makes this callable
         if self.executor is not None:
             self.executor.shutdown(wait=False)
             self.executor = None
-            
+        self.close()
+
+    def close(self):
+        '''Close all open connections'''
+        with self.lock:
+            connections,self.connections = self.connections,[]
+        for ftp in connections:
+            try:
+                ftp.quit()
+            except ftplib.all_errors:
+                ftp.close()
+        self.local = threading.local()
+
+    def connect(self):
+        '''Open and log in a new connection'''
+        ftp = ftplib.FTP(timeout=self.timeout)
+        ftp.connect(self.url,self.port)
+        ftp.login(self.user,self.passwd)
+        return ftp
+
+    def get_connection(self):
+        '''Connection of the calling thread, opened on first use'''
+        ftp = getattr(self.local,'ftp',None)
+        if ftp is None:
+            ftp = self.connect()
+            self.local.ftp = ftp
+            with self.lock:
+                self.connections.append(ftp)
+        return ftp
+
+    def drop_connection(self):
+        '''Discard the (failed) connection of the calling thread'''
+        ftp = getattr(self.local,'ftp',None)
+        self.local.ftp = None
+        if ftp is None:
+            return
+        with self.lock:
+            if ftp in self.connections:
+                self.connections.remove(ftp)
+        ftp.close()
+
+    def init_worker(self):
+        '''Pool initializer: log in each worker up front. Failures are left to be
+        retried by the first download.'''
+        try:
+            self.get_connection()
+        except ftplib.all_errors:
+            self.drop_connection()
+
+    def call(self,func):
+        '''Call func(ftp) on the calling thread's connection, reconnecting on failure'''
+        for attempt in range(self.retries+1):
+            try:
+                return func(self.get_connection())
+            except ftplib.error_perm:
+                #e.g. missing file, retrying won't help
+                raise
+            except ftplib.all_errors:
+                self.drop_connection()
+                if attempt==self.retries:
+                    raise
+
+    def download(self,paths):
+        '''Download one (src_path,dest_path) pair'''
+        src_path,dest_path = paths
+        filename = src_path.parts[-1]
+        def retrieve(ftp):
+            with open(dest_path/filename,'wb') as f:
+                ftp.retrbinary(f'RETR {str(src_path)}',f.write)
+        self.call(retrieve)
+        return dest_path/filename
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers,initializer=self.init_worker)
+        return self.executor
+
     def get_file_list(self,src_path):
-        with ftplib.FTP(self.url) as ftp:
-            ftp.login()
-            src_path_list = ftp.nlst(str(src_path))
-        return src_path_list
-                
+        #run on a pool thread so that its connection is reused by the downloads
+        future = self.get_executor().submit(self.call,lambda ftp: ftp.nlst(str(src_path)))
+        return future.result()
+
     def download_all_files(self,src_path,dest_path,select_key='nxs',progress=None):
         src_paths = self.get_file_list(src_path)
         self.download_filelist(src_paths,dest_path,select_key,progress)
-        
+
     def download_filelist(self,src_paths,dest_path,select_key='nxs',progress=None):
         dest_path = pathlib.Path(dest_path)
         paths = []
@@ -41,13 +141,10 @@ class FTP:
                 continue
             src_path = pathlib.Path(src_path)
             paths.append((src_path,dest_path))
-            
+
         if progress is not None:
             progress.set(0,len(paths))
-            
-        if self.executor is None:
-            self.executor =  ProcessPoolExecutor(max_workers=5)
-            
-        for result in self.executor.map(download_file,paths):
+
+        for result in self.get_executor().map(self.download,paths):
             if progress is not None:
-                progress.increment()
\ No newline at end of file
+                progress.increment()
@@ -8,12 +8,18 @@ import plotly.graph_objs as go
 
 from typySANS.ImageWidget import ImageWidget
 from typySANS.MVC import Fit_DataView
+from typySANS.FitUtil import auto_seed_1D
 
 
 class Fit1DWidget:
-    '''MVC Controller for 1D Data Fitters'''
-    def __init__(self,x,y,fit_model,fit_params):
-        self.data_model = Fit1DWidget_DataModel(x,y,fit_model,fit_params)
+    '''MVC Controller for 1D Data Fitters
+    
+    If fit_model is None, peaks are detected automatically and fit with one
+    gaussian each in windows around them (see FitUtil.auto_seed_1D, which
+    seed_kw are passed to).
+    '''
+    def __init__(self,x,y,fit_model=None,fit_params=None,**seed_kw):
+        self.data_model = Fit1DWidget_DataModel(x,y,fit_model,fit_params,**seed_kw)
         
         subplot_kw = dict( rows=1, cols=1,)
         self.data_view = Fit1DWidget_DataView(subplot_kw)
@@ -59,17 +65,25 @@ class Fit1DWidget:
     
 class Fit1DWidget_DataModel:
     '''MVC DataModel for 1D Data Fitters'''
-    def __init__(self,x,y,model,params):
+    def __init__(self,x,y,model=None,params=None,**seed_kw):
         self.model  = model
         self.params = params
+        self.auto = model is None
+        self.seed_kw = seed_kw
         self.fit_params = None
         self.update_data(x,y)
         
     def update_data(self,x,y):
         self.data  = xr.DataArray(y,dims=['x'],coords={'x':x})
         self.mask  = np.ones_like(y,dtype=bool)
+        if self.auto:
+            self.auto_seed(**self.seed_kw)
         self.fit()
     
+    def auto_seed(self,**seed_kw):
+        '''Replace the model, parameters and mask with automatically seeded peaks'''
+        self.model,self.params,self.mask = auto_seed_1D(self.data.x.values,self.data.values,**seed_kw)
+    
     def update_mask(self,indices):
         self.mask = np.in1d(range(self.data.shape[0]),indices)
         
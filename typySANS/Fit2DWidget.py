@@ -9,12 +9,13 @@ import plotly.graph_objs as go
 from typySANS.FitUtil import init_image_mesh
 from typySANS.ImageWidget import ImageWidget
 from typySANS.MVC import Fit_DataView
+from typySANS.BeamCenter import fit_beam_center,NoBeamError
 
 
 class Fit2DWidget:
     '''MVC Controller for 2D Data Fitters'''
-    def __init__(self,img,fit_model,fit_params):
-        self.data_model = Fit2DWidget_DataModel(img,fit_model,fit_params)
+    def __init__(self,img,fit_model,fit_params,mask=None,windowed=True):
+        self.data_model = Fit2DWidget_DataModel(img,fit_model,fit_params,mask=mask,windowed=windowed)
         
         subplot_kw = dict(
             rows=2,
@@ -29,6 +30,9 @@ class Fit2DWidget:
     def get_fit_param(self,name):
         return self.data_model.fit_result.params[name]
     
+    def update_mask(self,mask):
+        self.data_model.set_mask(mask)
+        
     def update_image(self,image):
         self.data_model.update_data(image)
         self.data_model.fit()
@@ -89,33 +93,80 @@ class Fit2DWidget:
     
     
 class Fit2DWidget_DataModel:
-    '''MVC DataModel for 2D Data Fitters'''
-    def __init__(self,data,model,params,fit_now=True):
-        self.model  = model
-        self.params = params
-        self.slices = {}
+    '''MVC DataModel for 2D Data Fitters
+    
+    With windowed=True the model (which must have x0, y0, sig_x, sig_y, A and B 
+    parameters) is seeded from the image moments and only fit to a window around
+    the beam, see BeamCenter.fit_beam_center. Otherwise all unmasked pixels are
+    fit starting from params.
+    '''
+    def __init__(self,data,model,params,fit_now=True,mask=None,windowed=True):
+        self.model    = model
+        self.params   = params
+        self.slices   = {}
+        self.mask     = mask
+        self.windowed = windowed
         
         self.update_data(data)
         if fit_now:
             self.fit()
             
     def update_data(self,data):
-        Nx,Ny = np.shape(data)
+        Ny,Nx = np.shape(data)
         x,y,X,Y,self.XY = init_image_mesh(Nx,Ny)
         self.data    = xr.DataArray(data,dims=['y','x'],coords={'x':x,'y':y})
+        self.set_mask(self.mask)
+        
+    def set_mask(self,mask):
+        '''Set the pixels to exclude from the fit (boolean array, True=excluded, or None)'''
+        self.mask = mask
+        if mask is None:
+            self.keep = slice(None)
+        else:
+            self.keep = ~np.asarray(mask,dtype=bool).ravel()
+        self.XY_fit = self.XY[self.keep]
         
     def fit(self):
-        fit = self.model.fit(self.data.values.ravel(),XY=self.XY,params=self.params)
+        fit = None
+        if self.windowed:
+            try:
+                fit = fit_beam_center(
+                    self.data.values,
+                    mask=self.mask,
+                    model=self.model,
+                    params=self.params,
+                    XY=self.XY,
+                )
+            except NoBeamError:
+                # no beam to seed from (e.g. a blank placeholder image)
+                pass
+        if fit is None:
+            # only the unmasked pixels enter the residual
+            fit = self.model.fit(self.data.values.ravel()[self.keep],XY=self.XY_fit,params=self.params)
         self.fit_result = fit
         
-        x_fit,y_fit,X_fit,Y_fit,XY_fit = init_image_mesh(*np.shape(self.data),step=0.25)
-        data_fit = self.model.eval(XY=XY_fit,params=self.fit_result.params).reshape(512,-1)
-        self.data_fit = xr.DataArray(data_fit,dims=['y','x'],coords={'x':x_fit,'y':y_fit})
+    def eval_slice(self,dim,value,step=0.25):
+        '''Evaluate the fitted model along the line dim=value
+        
+        Only the points on the line are evaluated, at step pixel spacing along the
+        other dimension.
+        '''
+        other = 'y' if dim=='x' else 'x'
+        coord = np.arange(0,self.data.sizes[other],step)
+        XY = np.empty((len(coord),2))
+        if dim=='x':
+            XY[:,0] = value
+            XY[:,1] = coord
+        else:
+            XY[:,0] = coord
+            XY[:,1] = value
+        values = self.model.eval(XY=XY,params=self.fit_result.params)
+        return xr.DataArray(values,dims=[other],coords={other:coord,dim:value})
         
     def make_slice(self,name,dim,value):
         self.slices[name] = {
             'data': self.data.interp(**{dim:value}),
-            'data_fit': self.data_fit.interp(**{dim:value}),
+            'data_fit': self.eval_slice(dim,value),
         }
     def get_slice(self,name,index,fit=False):
         if fit:
@@ -1,5 +1,6 @@
 import numpy as np
 import lmfit
+import scipy.signal
 import pyFAI,pyFAI.azimuthalIntegrator
 import matplotlib as mpl
 import xarray as xr
@@ -46,6 +47,99 @@ def init_gaussian2D_lmfit():
     params.add('A',5000.0)
     return model,params
 
+class Gaussian2DModel(lmfit.Model):
+    '''gaussian2D with an analytic Jacobian for the leastsq (Levenberg-Marquardt) fitter
+    
+    The Jacobian is passed to the optimizer automatically so that it doesn't need
+    to estimate it from 6 extra model evaluations per iteration. Intermediate
+    arrays are kept in work buffers that are reused as long as the number of 
+    fitted pixels doesn't change, so a model instance should not be shared between
+    threads. Only free parameters (vary=True, no expr) are supported.
+    '''
+    param_order = ('x0','y0','sig_x','sig_y','A','B')
+    
+    def __init__(self,**kwargs):
+        super().__init__(self.gaussian2D,independent_vars=['XY'],**kwargs)
+        self.buffers = {}
+        
+    def get_buffers(self,n):
+        if self.buffers.get('n',None)!=n:
+            self.buffers = {
+                'n':n,
+                'u':np.empty(n),
+                'v':np.empty(n),
+                'g':np.empty(n),
+                'jac':np.empty((len(self.param_order),n)),
+            }
+        return self.buffers
+    
+    def evaluate(self,XY,x0,y0,sig_x,sig_y,A):
+        '''Fill the u=(x-x0)/sig_x, v=(y-y0)/sig_y and g=exp(-(u^2+v^2)/2) buffers'''
+        buf = self.get_buffers(XY.shape[0])
+        u,v,g = buf['u'],buf['v'],buf['g']
+        np.subtract(XY[:,0],x0,out=u)
+        u /= sig_x
+        np.subtract(XY[:,1],y0,out=v)
+        v /= sig_y
+        np.multiply(u,u,out=g)
+        g += v*v
+        g *= -0.5
+        np.exp(g,out=g)
+        return buf
+        
+    def gaussian2D(self,XY,x0,y0,sig_x,sig_y,A,B):
+        buf = self.evaluate(XY,x0,y0,sig_x,sig_y,A)
+        return A*buf['g'] + B
+    
+    def jacobian(self,params,data,weights,XY,**kwargs):
+        '''Jacobian of the residual (data-model)*weights, one row per free parameter'''
+        values = {name:params[name].value for name in self.param_order}
+        buf = self.evaluate(XY,**{k:values[k] for k in self.param_order[:-1]})
+        u,v,g,jac = buf['u'],buf['v'],buf['g'],buf['jac']
+        A = values['A']
+        
+        # d(model)/d(param)
+        np.multiply(g,-A/values['sig_x'],out=jac[0])   #-dm/dx0 / u
+        np.multiply(g,-A/values['sig_y'],out=jac[1])   #-dm/dy0 / v
+        np.multiply(jac[0],u*u,out=jac[2])             #-dm/dsig_x
+        np.multiply(jac[1],v*v,out=jac[3])             #-dm/dsig_y
+        jac[0] *= u
+        jac[1] *= v
+        np.negative(g,out=jac[4])
+        jac[5] = -1.0
+        
+        # lmfit orders the free parameters as they were added to params
+        rows = [self.param_order.index(name) for name,par in params.items() if par.vary and not par.expr]
+        jac = jac[rows]
+        if weights is not None:
+            jac = jac*weights
+        return jac
+    
+    def fit(self,data,params=None,weights=None,method='leastsq',fit_kws=None,**kwargs):
+        if method=='leastsq':
+            fit_kws = dict(fit_kws or {})
+            fit_kws.setdefault('Dfun',self.jacobian)
+            fit_kws.setdefault('col_deriv',True)
+            
+            # the gradient of lmfit's bounds transformation vanishes on the bounds,
+            # so a parameter starting exactly on one would never move
+            if params is None:
+                params = self.make_params()
+            params = params.copy()
+            for par in params.values():
+                if par.vary and not par.expr:
+                    step = 1e-6*max(abs(par.value),1.0)
+                    if par.value<=par.min:
+                        par.value = min(par.min+step,0.5*(par.min+par.max))
+                    elif par.value>=par.max:
+                        par.value = max(par.max-step,0.5*(par.min+par.max))
+        return super().fit(data,params=params,weights=weights,method=method,fit_kws=fit_kws,**kwargs)
+    
+def init_gaussian2D_jacobian_lmfit():
+    '''Same as init_gaussian2D_lmfit, but using the analytic-Jacobian Gaussian2DModel'''
+    _,params = init_gaussian2D_lmfit()
+    return Gaussian2DModel(),params
+
 def init_gaussian1D_lmfit():
     model = lmfit.models.GaussianModel() + lmfit.models.LinearModel()
     
@@ -57,3 +151,165 @@ def init_gaussian1D_lmfit():
     params.add('intercept',20)
     return model,params
 
+def detrend_1D(x,y,log=True):
+    '''Curve with its overall trend removed, for peak detection
+
+    With log=True and positive x and y, a power law is removed from log(y), which
+    takes out the steep decay of SANS backgrounds. Otherwise a straight line is
+    removed from y.
+
+    Returns
+    -------
+    z: np.ndarray
+        detrended curve
+
+    log: bool
+        True if z is on a log scale
+    '''
+    log = log and np.all(x>0) and np.all(y>0)
+    if log:
+        u,z = np.log(x),np.log(y)
+    else:
+        u,z = x,y
+    trend = np.polyval(np.polyfit(u,z,1),u)
+    return z-trend,log
+
+def find_peaks_1D(x,y,max_peaks=5,prominence=0.05,min_width=2,log=True):
+    '''Seed gaussian peaks from a 1D curve with scipy.signal.find_peaks
+    
+    Peaks are detected on the detrended curve (see detrend_1D), so that a steep
+    background doesn't set the scale for the prominence.
+    
+    Arguments
+    ---------
+    x,y: np.ndarray
+        curve with increasing x. Non-finite y values are ignored.
+    
+    max_peaks: int
+        keep at most this many peaks, the most prominent first
+    
+    prominence: float
+        minimum peak prominence relative to the range of the detrended curve
+    
+    min_width: float
+        minimum peak width at half prominence [points]
+    
+    log: bool
+        detect peaks on log(y) if x and y are positive
+    
+    Returns
+    -------
+    seeds: list
+        dicts with center, sigma, amplitude (gaussian area) and height, sorted
+        by center
+    '''
+    x = np.asarray(x,dtype=float)
+    y = np.asarray(y,dtype=float)
+    finite = np.isfinite(y) & np.isfinite(x)
+    x,y = x[finite],y[finite]
+    if y.shape[0]<3:
+        return []
+    
+    z,log = detrend_1D(x,y,log)
+    zrange = z.max()-z.min()
+    #a curve that follows its trend to rounding precision has no peaks
+    if not zrange>1e-9*(1.0 if log else np.abs(y).max()):
+        return []
+    indices,props = scipy.signal.find_peaks(z,prominence=prominence*zrange,width=min_width)
+    
+    order = np.argsort(props['prominences'])[::-1][:max_peaks]
+    indices = indices[order]
+    dx = np.interp(indices+0.5,np.arange(x.shape[0]),x)-np.interp(indices-0.5,np.arange(x.shape[0]),x)
+    sigma = props['widths'][order]*np.abs(dx)/(2.0*np.sqrt(2.0*np.log(2.0)))
+    if log:
+        #prominence of log(y) -> height above the local base in y
+        height = y[indices]*(1.0-np.exp(-props['prominences'][order]))
+    else:
+        height = props['prominences'][order]
+    seeds = [
+        {'center':x[i],'sigma':s,'amplitude':h*s*np.sqrt(2.0*np.pi),'height':h}
+        for i,s,h in zip(indices,sigma,height)
+    ]
+    return sorted(seeds,key=lambda seed:seed['center'])
+
+def init_multi_gaussian1D_lmfit(seeds,background=0.0,degree=2):
+    '''Sum of one gaussian per seed (prefixes p0_, p1_, ...) on a polynomial background
+    
+    Arguments
+    ---------
+    seeds: list
+        dicts with center, sigma and amplitude, see find_peaks_1D
+    
+    background: float
+        initial constant term (c0) of the background
+    
+    degree: int
+        degree of the background polynomial (coefficients c0, c1, ...)
+    '''
+    model = lmfit.models.PolynomialModel(degree=degree)
+    params = lmfit.Parameters()
+    for i in range(degree+1):
+        params.add(f'c{i}',background if i==0 else 0.0)
+    for i,seed in enumerate(seeds):
+        prefix = f'p{i}_'
+        model = model + lmfit.models.GaussianModel(prefix=prefix)
+        params.add(prefix+'amplitude',seed['amplitude'],min=0.0)
+        params.add(prefix+'center',seed['center'],min=seed['center']-2*seed['sigma'],max=seed['center']+2*seed['sigma'])
+        params.add(prefix+'sigma',seed['sigma'],min=0.0,max=3*seed['sigma'])
+    return model,params
+
+def peak_windows(x,seeds,n_sigma=4.0):
+    '''Boolean array selecting x within ±n_sigma widths of any seed'''
+    x = np.asarray(x,dtype=float)
+    keep = np.zeros(x.shape,dtype=bool)
+    for seed in seeds:
+        keep |= np.abs(x-seed['center'])<=n_sigma*seed['sigma']
+    return keep
+
+def auto_seed_1D(x,y,n_sigma=4.0,degree=2,**peak_kw):
+    '''Detect peaks and build the composite model and fit windows for them
+    
+    Arguments
+    ---------
+    x,y: np.ndarray
+        curve to seed from
+    
+    n_sigma: float
+        half width of the fit windows in units of the seeded peak widths
+    
+    degree: int
+        degree of the background polynomial
+    
+    **peak_kw:
+        passed on to find_peaks_1D
+    
+    Returns
+    -------
+    model,params: lmfit.Model, lmfit.Parameters
+        see init_multi_gaussian1D_lmfit. If no peaks are found, the default
+        single peak model of init_gaussian1D_lmfit.
+    
+    keep: np.ndarray
+        boolean array of the points within the fit windows (all finite points
+        for the default model)
+    '''
+    seeds = find_peaks_1D(x,y,**peak_kw)
+    if not seeds:
+        model,params = init_gaussian1D_lmfit()
+        return model,params,np.isfinite(np.asarray(y,dtype=float))
+    keep = peak_windows(x,seeds,n_sigma) & np.isfinite(y)
+    model,params = init_multi_gaussian1D_lmfit(seeds,background=np.nanmin(np.asarray(y)[keep]),degree=degree)
+    return model,params,keep
+
+def fit_peaks_1D(x,y,n_sigma=4.0,degree=2,**peak_kw):
+    '''Fit all automatically detected peaks of a curve, see auto_seed_1D
+    
+    Returns
+    -------
+    result: lmfit.model.ModelResult
+        fit of the points within the peak windows
+    '''
+    x = np.asarray(x,dtype=float)
+    y = np.asarray(y,dtype=float)
+    model,params,keep = auto_seed_1D(x,y,n_sigma=n_sigma,degree=degree,**peak_kw)
+    return model.fit(y[keep],x=x[keep],params=params)
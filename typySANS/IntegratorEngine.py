@@ -0,0 +1,151 @@
+import warnings
+
+import numpy as np
+import pyFAI,pyFAI.azimuthalIntegrator
+from pyFAI.method_registry import IntegrationMethod
+
+from typySANS.misc import LRUCache,mask_hash
+
+
+# (split,algorithm,implementation) in order of preference. All of these run on
+# the CPU so that reduction works on nodes without OpenCL.
+CPU_METHODS = [
+    ('bbox','csr','cython'),
+    ('bbox','histogram','cython'),
+    ('bbox','csr','python'),
+]
+
+def select_method(methods=CPU_METHODS):
+    '''Return the first pyFAI 1D integration method in methods that is available'''
+    for method in methods:
+        if IntegrationMethod.select_one_available(method,dim=1,degradable=False) is not None:
+            return method
+    raise ValueError(f'None of the requested integration methods are available: {methods}')
+
+class IntegratorEngine:
+    '''Azimuthal integrator for one fixed detector geometry
+
+    The pyFAI integrator builds its sparse (CSR) pixel->bin lookup on first use and
+    keeps it for as long as the geometry isn't changed. An engine is therefore
+    never modified after creation; a new geometry means a new engine.
+
+    Arguments
+    ---------
+    SDD: float
+        sample to detector distance [cm]
+
+    wavelength: float
+        wavelength of neutron beam [angstroms]
+
+    x0,y0: float
+        beam center location [pixels]
+
+    npt: int
+        number of q-bins
+
+    mask: np.ndarray or None
+        boolean array, True for pixels to exclude
+
+    shape: tuple
+        detector shape (Ny,Nx) [pixels]
+
+    pixel_size: float
+        detector pixel size [m]
+
+    method: tuple
+        pyFAI integration method (split,algorithm,implementation)
+    '''
+    def __init__(self,SDD,wavelength,x0,y0,npt=200,mask=None,shape=(128,128),pixel_size=0.00508,method=None):
+        self.npt = npt
+        self.mask = mask
+        self.shape = shape
+        if method is None:
+            method = select_method()
+        self.method = method
+
+        detector = pyFAI.detectors.Detector(pixel_size,pixel_size,max_shape=shape)
+        self.integrator = pyFAI.azimuthalIntegrator.AzimuthalIntegrator(
+                                                     dist=float(SDD)/100.0, #meter
+                                                     poni1=float(y0)*pixel_size,
+                                                     poni2=float(x0)*pixel_size,
+                                                     wavelength=float(wavelength)*1e-10, #meters
+                                                     detector=detector,
+                                                )
+
+    def __str__(self):
+        return str(self.integrator)
+
+    def integrate(self,data):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            pf_result = self.integrator.integrate1d(
+                data=data,
+                unit='q_A^-1',
+                method=self.method,
+                correctSolidAngle=False,
+                npt=self.npt,
+                mask=self.mask,
+            )
+        return pf_result
+
+    def build(self):
+        '''Force pyFAI to build the sparse lookup now rather than on first use'''
+        self.integrate(np.zeros(self.shape))
+        return self
+
+class IntegratorEngineCache:
+    '''LRU cache of IntegratorEngines keyed by detector geometry
+
+    Arguments
+    ---------
+    maxsize: int
+        Maximum number of engines (i.e. distinct geometries) to keep
+
+    pixel_size: float
+        detector pixel size [m]
+
+    methods: list
+        pyFAI integration methods in order of preference. The first available
+        one is used for all engines.
+    '''
+    def __init__(self,maxsize=32,pixel_size=0.00508,methods=CPU_METHODS):
+        self.engines = LRUCache(maxsize)
+        self.pixel_size = pixel_size
+        self.method = select_method(methods)
+
+    def key(self,SDD,wavelength,x0,y0,npt=200,mask=None,shape=(128,128)):
+        return (
+            float(SDD),
+            float(wavelength),
+            float(x0),
+            float(y0),
+            int(npt),
+            mask_hash(mask),
+            tuple(shape),
+        )
+
+    def get(self,SDD,wavelength,x0,y0,npt=200,mask=None,shape=(128,128)):
+        '''Return a (prebuilt) IntegratorEngine for this geometry, creating it if needed'''
+        key = self.key(SDD,wavelength,x0,y0,npt,mask,shape)
+        engine = self.engines.get(key,None)
+        if engine is None:
+            engine = IntegratorEngine(
+                SDD,
+                wavelength,
+                x0,
+                y0,
+                npt=npt,
+                mask=mask,
+                shape=shape,
+                pixel_size=self.pixel_size,
+                method=self.method,
+            ).build()
+            self.engines[key] = engine
+        return engine
+
+    def clear(self):
+        self.engines.clear()
+
+# shared by all integrator widgets so that files with the same configuration reuse
+# the same engine
+ENGINE_CACHE = IntegratorEngineCache()
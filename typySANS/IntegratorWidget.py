@@ -8,16 +8,18 @@ import plotly.graph_objs as go
 
 from typySANS.FitUtil import init_image_mesh
 from typySANS.MVC import Fit_DataView
+from typySANS.IntegratorEngine import ENGINE_CACHE
+from typySANS.SparseIntegrator import CircularAverager,SectorAverager,AnnulusAverager,SlitAverager,binning_key
+from typySANS.misc import mask_hash
 
-import pyFAI,pyFAI.azimuthalIntegrator
-
+import hashlib
 import warnings
 
 
 class IntegratorWidget:
     '''MVC Controller for 2D-1D Integrators'''
-    def __init__(self,data,**integrator_kwargs):
-        self.data_model = IntegratorWidget_DataModel(data)
+    def __init__(self,data,mask=None,curve_cache=None,**integrator_kwargs):
+        self.data_model = IntegratorWidget_DataModel(data,mask=mask,curve_cache=curve_cache)
         
         subplot_kw = dict(
             rows=1,
@@ -78,6 +80,15 @@ class IntegratorWidget:
     def update_integrator(self,**kwargs):
         self.data_model.update_integrator(**kwargs)
         
+    def update_mask(self,mask):
+        self.data_model.set_mask(mask)
+        
+    def update_binning(self,binning):
+        self.data_model.set_binning(binning)
+        
+    def update_mode(self,mode,**kwargs):
+        self.data_model.set_mode(mode,**kwargs)
+        
     def integrate(self):
         self.data_model.integrate()
         data1D = self.data_model.data1D
@@ -112,9 +123,26 @@ class IntegratorWidget:
     
     
 class IntegratorWidget_DataModel:
-    '''MVC DataModel for 2D->1D Integrator'''
-    def __init__(self,data=None):
+    '''MVC DataModel for 2D->1D Integrator
+    
+    curve_cache: misc.LRUCache or None
+        if given, integrated curves are cached per image and integration
+        configuration
+    '''
+    def __init__(self,data=None,npt=200,engine_cache=None,mask=None,binning='linear',curve_cache=None):
+        if engine_cache is None:
+            engine_cache = ENGINE_CACHE
+        self.engine_cache = engine_cache
+        self.curve_cache = curve_cache
+        self.npt = npt
+        self.binning = 'linear'
+        self.mask = mask
+        self.mode = 'circular'
+        self.mode_kwargs = {}
+        self.averager = None
+        
         self.init_integrator() 
+        self.set_binning(binning)
         if data is not None:
             self.set_image(data) 
     
@@ -122,6 +150,12 @@ class IntegratorWidget_DataModel:
         Nx,Ny = np.shape(data)
         x,y,X,Y,self.XY = init_image_mesh(Nx,Ny)
         self.data2D    = xr.DataArray(data,dims=['y','x'],coords={'x':x,'y':y})
+        self.data_key = None
+        if self.curve_cache is not None:
+            self.data_key = hashlib.sha1(np.ascontiguousarray(data)).hexdigest()
+        if np.shape(data)!=self.shape:
+            self.shape = np.shape(data)
+            self.update_engine()
         
     @property
     def x(self):
@@ -131,20 +165,91 @@ class IntegratorWidget_DataModel:
     def y(self):
         return self.data1D.values
     
-    def init_integrator(self,Nx=128,Ny=128,pixel_dx=0.00508,pixel_dy=0.00508):
-        SDD = 5.0 # in m
-        dx = dy = 0.00508 #pixel size in m
-        poni1 = 64.5*dy  #dummy
-        poni2 = 64.5*dx #dummy 
-        wavelength = 5*1e-10 #dummy (in m)
-        detector = pyFAI.detectors.Detector(dx,dy,max_shape=(Ny,Nx))
-        self.integrator = pyFAI.azimuthalIntegrator.AzimuthalIntegrator(
-                                                     dist=SDD, #meter
-                                                     poni1=poni1,
-                                                     poni2=poni2,
-                                                     wavelength=wavelength, #meters
-                                                     detector=detector,
-                                                )                   
+    @property
+    def integrator(self):
+        return self.engine.integrator
+    
+    def init_integrator(self,Nx=128,Ny=128):
+        self.shape = (Ny,Nx)
+        self.geometry = {
+            'SDD':500.0,      #dummy (in cm)
+            'wavelength':5.0, #dummy (in angstroms)
+            'x0':64.5,        #dummy (in pixels)
+            'y0':64.5,        #dummy (in pixels)
+        }
+        self.update_engine()
+        
+    def update_engine(self):
+        '''Fetch the (cached) integration engine for the current geometry'''
+        self.engine = self.engine_cache.get(
+            npt=self.npt,
+            mask=self.mask,
+            shape=self.shape,
+            **self.geometry
+        )
+        if self.mode=='circular' and not (isinstance(self.binning,str) and self.binning=='linear'):
+            # pyFAI only bins linearly
+            self.averager = CircularAverager(
+                npt=self.npt,
+                mask=self.mask,
+                shape=self.shape,
+                binning=self.binning,
+                **self.geometry
+            )
+        elif self.mode!='circular':
+            kwargs = dict(self.mode_kwargs)
+            if self.mode in ('sector','slit'):
+                # the current npt and binning unless given to set_mode
+                kwargs.setdefault('npt',self.npt)
+                kwargs.setdefault('binning',self.binning)
+            self.averager = self.averager_cls[self.mode](
+                mask=self.mask,
+                shape=self.shape,
+                **self.geometry,
+                **kwargs
+            )
+        else:
+            self.averager = None
+        
+    # non-circular modes use the sparse averagers, which share a cached polar map
+    # per geometry so that changing e.g. the sector angle only rebuilds the bins
+    averager_cls = {
+        'sector':SectorAverager,
+        'annulus':AnnulusAverager,
+        'slit':SlitAverager,
+    }
+    
+    def set_mask(self,mask):
+        '''Set the pixels to exclude (boolean array, True=excluded, or None)'''
+        self.mask = mask
+        self.update_engine()
+        
+    def set_binning(self,binning='linear'):
+        ''' 
+        binning: str or array-like
+            'linear', 'log' or explicit q-bin edges [1/Å]. Bin edges are cached
+            per configuration.
+        '''
+        if not isinstance(binning,str):
+            binning = tuple(binning)
+        self.binning = binning
+        self.update_engine()
+        
+    def set_mode(self,mode='circular',**kwargs):
+        ''' 
+        mode: str
+            'circular': full circular average I(q)
+            'sector': I(q) within phi ± dphi (kwargs: phi, dphi, mirror, npt)
+            'annulus': I(phi) for qmin <= q <= qmax (kwargs: qmin, qmax, nphi)
+            'slit': I(q) in a strip through the beam center (kwargs: phi, width, npt)
+        '''
+        if mode!='circular' and mode not in self.averager_cls:
+            raise ValueError(f'Integration mode not understood: {mode}')
+        self.mode = mode
+        self.mode_kwargs = kwargs
+        self.averager = None
+        self.update_engine()
+        
     def update_integrator(self,**kwargs):
         ''' 
         x0,y0: [pixels]
@@ -156,38 +261,55 @@ class IntegratorWidget_DataModel:
         SDD: [cm]
             sample to detector distance
         '''
-        dy = self.integrator.get_pixel1()
-        dx = self.integrator.get_pixel2()
-        #print('Integrator Args:')
         for k,v in kwargs.items():
-            #print(k,v)
-            if k=='y0':
-                self.integrator.set_poni1(dy*float(v))
-            elif k=='x0':
-                self.integrator.set_poni2(dx*float(v))
-            elif k=='wavelength':
-                self.integrator.set_wavelength(float(v)*1e-10)
-            elif k=='SDD':
-                self.integrator.set_dist(float(v)/100.0)
-            else:
+            if not (k in self.geometry):
                 raise ValueError(f'Integrator parameter not understood: {k}={v}')
+            self.geometry[k] = float(v)
+        self.update_engine()
+        
+    def config_key(self):
+        '''Hashable description of everything the integrated curve depends on besides the image'''
+        # bin edges may be given to set_mode as a list or array
+        mode_kwargs = tuple(sorted(
+            (k,binning_key(v) if k=='binning' else v) for k,v in self.mode_kwargs.items()
+        ))
+        return (
+            self.mode,
+            mode_kwargs,
+            self.binning,
+            self.npt,
+            tuple(sorted(self.geometry.items())),
+            self.shape,
+            None if self.mask is None else mask_hash(self.mask),
+        )
         
     def integrate(self):
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            pf_result = self.integrator.integrate1d(
-                data=self.data2D.values,
-                unit='q_A^-1',
-                #method='csr_ocl_1,3',
-                method='csr_ocl',
-                correctSolidAngle=False,
-                npt=200,
+        if self.curve_cache is not None:
+            key = (self.data_key,self.config_key())
+            data1D = self.curve_cache.get(key,None)
+            if data1D is None:
+                self._integrate()
+                self.curve_cache[key] = self.data1D
+            else:
+                self.data1D = data1D
+        else:
+            self._integrate()
+        
+    def _integrate(self):
+        if self.averager is None:
+            pf_result = self.engine.integrate(self.data2D.values)
+            self.data1D = xr.DataArray(
+                pf_result.intensity,
+                dims=['x'],
+                coords={'x':pf_result.radial}
+            )
+        else:
+            I,dI,counts,x_mean = self.averager.average(self.data2D.values)
+            self.data1D = xr.DataArray(
+                I,
+                dims=['x'],
+                coords={'x':self.averager.x}
             )
-        self.data1D = xr.DataArray(
-            pf_result.intensity,
-            dims=['x'],
-            coords={'x':pf_result.radial}
-        )
         
             
 class IntegratorWidget_DataView(Fit_DataView):
@@ -0,0 +1,157 @@
+'''
+Detector masks shared by the integrators and the 2D fitters
+
+Masks follow the pyFAI convention: boolean arrays indexed as [y,x] that are True
+for pixels to exclude.
+'''
+import numpy as np
+import matplotlib.path
+
+from typySANS.misc import LRUCache
+
+def circle_mask(shape,x,y,radius):
+    '''Mask all pixels whose center lies within radius [pixels] of (x,y)'''
+    Ny,Nx = shape
+    X,Y = np.meshgrid(np.arange(Nx)+0.5,np.arange(Ny)+0.5)
+    return np.hypot(X-x,Y-y)<=radius
+
+def rectangle_mask(shape,x0,x1,y0,y1):
+    '''Mask all pixels with x0 <= x < x1 and y0 <= y < y1 (pixel indices)'''
+    mask = np.zeros(shape,dtype=bool)
+    mask[int(y0):int(y1),int(x0):int(x1)] = True
+    return mask
+
+def polygon_mask(shape,vertices):
+    '''Mask all pixels whose center lies within the polygon [(x,y),...] [pixels]'''
+    Ny,Nx = shape
+    X,Y = np.meshgrid(np.arange(Nx)+0.5,np.arange(Ny)+0.5)
+    path = matplotlib.path.Path(vertices)
+    inside = path.contains_points(np.column_stack((X.ravel(),Y.ravel())))
+    return inside.reshape(shape)
+
+def edge_mask(shape,width=1):
+    '''Mask width pixels along every detector edge'''
+    mask = np.zeros(shape,dtype=bool)
+    if width>0:
+        mask[:width,:]  = True
+        mask[-width:,:] = True
+        mask[:,:width]  = True
+        mask[:,-width:] = True
+    return mask
+
+class MaskStore:
+    '''Build and cache detector masks per configuration
+
+    Every mask is the union of a beamstop mask built from the file header and a
+    set of user regions (drawn regions, detector edges and dead pixels) shared by
+    all configurations. Masks are stored bit-packed and keyed by the beamstop
+    configuration, so reducing many frames from the same configuration only builds
+    the mask once. Changing the user regions invalidates all stored masks.
+
+    The beamstop is centered on the beam center. beamStopX/beamStopY are motor
+    positions rather than detector coordinates and are only used to tell apart
+    configurations.
+
+    Arguments
+    ---------
+    shape: tuple
+        detector shape (Ny,Nx) [pixels]
+
+    pixel_size: float
+        detector pixel size [m]
+
+    edge: int
+        number of pixels to mask along the detector edges
+
+    maxsize: int
+        Maximum number of configurations to keep masks for
+    '''
+    def __init__(self,shape=(128,128),pixel_size=0.00508,edge=0,maxsize=64):
+        self.shape = tuple(shape)
+        self.pixel_size = pixel_size
+        self.masks = LRUCache(maxsize)
+        self.user = edge_mask(self.shape,edge)
+
+    def add_region(self,mask):
+        '''Add a boolean (Ny,Nx) region to the user mask'''
+        mask = np.asarray(mask,dtype=bool)
+        if mask.shape!=self.shape:
+            raise ValueError(f'Mask shape {mask.shape} does not match detector shape {self.shape}')
+        self.user = self.user | mask
+        self.masks.clear()
+
+    def add_circle(self,x,y,radius):
+        self.add_region(circle_mask(self.shape,x,y,radius))
+
+    def add_rectangle(self,x0,x1,y0,y1):
+        self.add_region(rectangle_mask(self.shape,x0,x1,y0,y1))
+
+    def add_polygon(self,vertices):
+        self.add_region(polygon_mask(self.shape,vertices))
+
+    def add_pixels(self,pixels):
+        '''Mask individual (dead) pixels given as a sequence of (x,y) indices'''
+        mask = np.zeros(self.shape,dtype=bool)
+        pixels = np.asarray(pixels,dtype=int).reshape(-1,2)
+        mask[pixels[:,1],pixels[:,0]] = True
+        self.add_region(mask)
+
+    def add_edges(self,width=1):
+        self.add_region(edge_mask(self.shape,width))
+
+    def clear_regions(self):
+        self.user = np.zeros(self.shape,dtype=bool)
+        self.masks.clear()
+
+    def key(self,x0,y0,beamstop,beamStopX=0.0,beamStopY=0.0):
+        return (float(x0),float(y0),float(beamstop),float(beamStopX),float(beamStopY))
+
+    def build(self,x0,y0,beamstop):
+        '''Build the full mask for a beamstop of diameter beamstop [mm] centered on (x0,y0)'''
+        radius = 0.5*beamstop/(self.pixel_size*1000.0) #mm -> pixels
+        mask = self.user.copy()
+        if radius>0:
+            mask |= circle_mask(self.shape,x0,y0,radius)
+        return mask
+
+    def get(self,x0,y0,beamstop,beamStopX=0.0,beamStopY=0.0):
+        '''Return the (cached) mask of a configuration
+
+        Arguments
+        ---------
+        x0,y0: float
+            beam center location [pixels]
+
+        beamstop: float
+            beamstop diameter [mm]
+
+        beamStopX,beamStopY: float
+            beamstop motor positions
+
+        Returns
+        -------
+        mask: np.ndarray
+            (Ny,Nx) boolean array, True for pixels to exclude. Unpacked fresh on
+            every call so it can be modified safely.
+        '''
+        key = self.key(x0,y0,beamstop,beamStopX,beamStopY)
+        packed = self.masks.get(key,None)
+        if packed is None:
+            packed = np.packbits(self.build(x0,y0,beamstop))
+            self.masks[key] = packed
+        mask = np.unpackbits(packed,count=self.shape[0]*self.shape[1]).astype(bool)
+        return mask.reshape(self.shape)
+
+    def from_RAW(self,raw):
+        '''Return the mask for the configuration in a RAWFile or sqlRAWFile header'''
+        if hasattr(raw,'SANSData'):
+            header = raw.SANSData #RAWFile
+        else:
+            header = vars(raw) #sqlRAWFile
+        return self.get(
+            header['detectorBeamX'],
+            header['detectorBeamY'],
+            header['detectorBeamStop'],
+            header.get('beamStopX',0.0),
+            header.get('beamStopY',0.0),
+        )
@@ -7,15 +7,17 @@ import datetime
 
 from typySANS.misc import *
 from typySANS.ABSFile import *
+from typySANS.ErrorBarCollection import ErrorBarCollection
 
 from ipywidgets import HBox,VBox,Output,SelectMultiple
 
 
 class MultiPlotABS(object):
-    def __init__(self,file_list,max_lines=10):
+    def __init__(self,file_list,max_lines=10,show_errors=True):
         self.file_list_path = [pathlib.Path(i) for i in file_list]
         self.file_list = [pathlib.Path(i).parts[-1] for i in file_list]
         self.max_lines = max_lines
+        self.show_errors = show_errors
 
     def update_plot(self,event):
         options = event['owner'].options
@@ -26,6 +28,7 @@ class MultiPlotABS(object):
             line.set_xdata([])
             line.set_ydata([])
             line.set_label('')
+            self.errorbars[i].clear_data()
             
         self.text_output.clear_output()
         with self.text_output:
@@ -40,9 +43,10 @@ class MultiPlotABS(object):
                     
                 line = self.lines[i]
                 print('--> Showing {}'.format(file))
-                df,config = readABS(file_path)
+                df,config = readABS_cached(file_path)
                 line.set_xdata(df['q'].values)
                 line.set_ydata(df['I'].values)
+                self.errorbars[i].update_data(df['q'].values,df['I'].values,df['dI'].values)
                 line.set_label(file)
                 lines.append(file)
         self.ax.relim()
@@ -57,7 +61,7 @@ class MultiPlotABS(object):
         self.select = SelectMultiple(options=self.file_list,
                                      layout={'width':'400px'},
                                      rows=20)
-        self.select.observe(self.update_plot)
+        self.select.observe(self.update_plot,names='index')
         
         VB = VBox([self.select],layout={'align_self':'center'})
         HB = HBox([VB,self.plot_output])
@@ -73,11 +77,17 @@ class MultiPlotABS(object):
         # init lines
         colors = sns.palettes.color_palette(palette='bright',n_colors=self.max_lines)
         self.lines = []
+        self.errorbars = []
         for i in range(self.max_lines):
             line = plt.matplotlib.lines.Line2D([],[])
             line.set(color=colors[i],marker='o',ms=3,ls='None')
             ax.add_line(line)
             self.lines.append(line)
+            
+            errorbar = ErrorBarCollection(color=colors[i],lw=0.5)
+            errorbar.set_visible(self.show_errors)
+            ax.add_collection(errorbar,autolim=False)
+            self.errorbars.append(errorbar)
         ax.set_xscale('log')
         ax.set_yscale('log')
         
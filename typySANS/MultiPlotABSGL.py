@@ -0,0 +1,66 @@
+import plotly.colors
+import plotly.graph_objs as go
+from IPython.display import display
+
+from typySANS.ABSFile import readABS_cached
+from typySANS.MultiPlotABS import MultiPlotABS
+
+
+class MultiPlotABSGL(MultiPlotABS):
+    '''MultiPlotABS drawn with WebGL (plotly Scattergl) traces
+    
+    There is no cap on the number of displayed curves. Parsed ABS files are cached
+    and, on every selection change, only the traces of files that were selected or
+    deselected are added or removed.
+    '''
+    def __init__(self,file_list,show_errors=False):
+        super().__init__(file_list,max_lines=None,show_errors=show_errors)
+        self.shown = set() #indices of the files currently plotted
+        self.colors = plotly.colors.qualitative.Plotly
+        
+    def make_trace(self,index):
+        file = self.file_list[index]
+        df,config = readABS_cached(self.file_list_path[index])
+        color = self.colors[index%len(self.colors)]
+        trace = go.Scattergl(
+            x=df['q'].values,
+            y=df['I'].values,
+            error_y=dict(type='data',array=df['dI'].values,visible=self.show_errors,thickness=0.5),
+            mode='markers',
+            marker=dict(size=4,color=color),
+            name=file,
+            meta=index,
+        )
+        return trace
+        
+    def update_plot(self,event):
+        index_list = event['owner'].index
+        selected = set(index_list)
+        removed = self.shown - selected
+        added = [index for index in index_list if not (index in self.shown)]
+        
+        self.text_output.clear_output()
+        traces = []
+        with self.text_output:
+            for index in added:
+                print('--> Showing {}'.format(self.file_list[index]))
+                traces.append(self.make_trace(index))
+            
+        if removed:
+            self.fig.data = [trace for trace in self.fig.data if not (trace.meta in removed)]
+        if traces:
+            self.fig.add_traces(traces)
+        self.shown = selected
+        
+    def init_plot(self):
+        self.fig = go.FigureWidget(
+            layout=dict(
+                width=600,
+                height=450,
+                margin=dict(t=25,b=25),
+                xaxis=dict(type='log',title='q [Å⁻¹]'),
+                yaxis=dict(type='log',title='dΣ/dΩ [cm⁻¹]'),
+            )
+        )
+        with self.plot_output:
+            display(self.fig)
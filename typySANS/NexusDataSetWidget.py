@@ -1,5 +1,4 @@
 import pathlib
-import pandas as pd
 import numpy as np 
 
 import ipywidgets
@@ -15,7 +14,10 @@ from typySANS.ProgressWidget import ProgressWidget
 from typySANS.ImageWidget import ImageWidget
 from typySANS.IntegratorWidget import IntegratorWidget
 from typySANS.Fit2DWidget import Fit2DWidget
-from typySANS.FitUtil import init_gaussian2D_lmfit
+from typySANS.FitUtil import init_gaussian2D_jacobian_lmfit
+from typySANS.Catalog import FileCatalog
+from typySANS.BeamCenter import beam_roi,header_roi,roi_slices,read_image
+from typySANS.misc import LRUCache,Prefetcher
 
 import plotly.graph_objects as go
 
@@ -25,10 +27,11 @@ class NexusDataSetWidget:
         self.data_view = NexusDataSetWidget_DataView()
         
         dummy_image = np.ones((128,128))
-        self.integrator = IntegratorWidget(dummy_image)
+        self.integrator = IntegratorWidget(dummy_image,curve_cache=self.data_model.curves)
         
-        model,params = init_gaussian2D_lmfit()
+        model,params = init_gaussian2D_jacobian_lmfit()
         self.fit2D = Fit2DWidget(dummy_image,model,params)
+        self.fit2D_origin = (0,0) #(y,x) of the fit image on the detector
         self.selected_img = None
     
     def load_files(self,*args):
@@ -55,6 +58,13 @@ class NexusDataSetWidget:
         grid_data_out['rows'] = grid_data_out['grid'].loc[[index]]
         self.plot_data()
         
+    def neighbour_files(self,selected_row):
+        '''Filenames of the grid rows before and after the selected row (wrapping around)'''
+        grid = self.data_view.grid.grid_data_out['grid']
+        indices = list(grid.index.get_level_values(0))
+        position = indices.index(selected_row.name[0])
+        return [grid['filename'].iloc[(position+step)%len(indices)] for step in (1,-1)]
+        
     def fit_center(self,*args):
         #initialize 
         if self.data_view.accordion.children[1].children[1] is self.data_view.dummy:
@@ -71,12 +81,20 @@ class NexusDataSetWidget:
         filename = selected_row['filename']#.squeeze()
             
         load_path = pathlib.Path(self.data_view.load_path.value)
-        filepath = load_path/filename
-        with h5py.File(filepath,'r') as h5:
-            sample_label = h5['entry/sample/description'][()][0].decode('utf8')
-            self.selected_img = h5['entry/data/y'][()].T
+        # only read the region around the beam center from the catalog (or header)
+        roi = self.data_model.beam_roi(load_path/filename,selected_row)
+        slices = (slice(0,None),slice(0,None)) if roi is None else roi_slices(roi)
+        self.fit2D_origin = (slices[0].start,slices[1].start)
+        self.selected_img = read_image(load_path/filename,roi)
         
         self.fit2D.update_image(self.selected_img)
+        
+    def get_beam_center(self):
+        '''Fitted beam center (x0,y0) in full-detector pixel indices'''
+        y_start,x_start = self.fit2D_origin
+        x0 = self.fit2D.get_fit_param('x0').value + x_start
+        y0 = self.fit2D.get_fit_param('y0').value + y_start
+        return x0,y0
             
     def plot_data(self,*args):
         #initialize 
@@ -94,11 +112,10 @@ class NexusDataSetWidget:
         filename = selected_row['filename']#.squeeze()
             
         load_path = pathlib.Path(self.data_view.load_path.value)
-        filepath = load_path/filename
-        with h5py.File(filepath,'r') as h5:
-            sample_label = h5['entry/sample/description'][()][0].decode('utf8')
-            self.selected_img = h5['entry/data/y'][()].T
-            
+        frame = self.data_model.get_frame(load_path/filename)
+        sample_label = frame['label']
+        self.selected_img = frame['img']
+        self.data_model.prefetch([load_path/fname for fname in self.neighbour_files(selected_row)])
         
         self.integrator.update_image(self.selected_img)
         self.integrator.update_integrator(
@@ -154,24 +171,80 @@ class NexusDataSetWidget:
                 
         
 class NexusDataSetWidget_DataModel:
-    def __init__(self):
+    '''Arguments
+    ---------
+    max_workers: int or None
+        number of worker processes used to read the metadata of new files
+    
+    maxsize: int
+        number of decoded frames and of integrated curves kept in memory
+    '''
+    def __init__(self,max_workers=None,maxsize=64):
         self.path = None
+        self.max_workers = max_workers
+        self.catalogs = {}
+        self.frames = Prefetcher(self.read_frame,maxsize=maxsize)
+        self.curves = LRUCache(maxsize)
+        
+    @staticmethod
+    def read_frame(key):
+        '''Read the sample label and (Ny,Nx) image of the file of a frame_key'''
+        fname = key[0]
+        with h5py.File(fname,'r') as h5:
+            frame = {
+                'label':h5['entry/sample/description'][()][0].decode('utf8'),
+                'img':h5['entry/data/y'][()].T,
+            }
+        return frame
+        
+    @staticmethod
+    def frame_key(fname):
+        '''(path, mtime) so that modified files are read again'''
+        fname = pathlib.Path(fname)
+        return (str(fname),fname.stat().st_mtime_ns)
+        
+    def get_frame(self,fname):
+        '''Decoded frame of a file from the cache, a pending prefetch or the disk'''
+        return self.frames.get(self.frame_key(fname))
+        
+    def prefetch(self,fnames):
+        '''Read frames in the background'''
+        keys = []
+        for fname in fnames:
+            try:
+                keys.append(self.frame_key(fname))
+            except OSError:
+                continue
+        self.frames.prefetch(keys)
+        
+    @staticmethod
+    def beam_roi(fname,row=None,half_width=16):
+        '''Region around the beam center of a file (see BeamCenter.beam_roi) taken
+        from its catalog row (beamCenterX, beamCenterY) or else from its header.
+        None if neither has a beam center.'''
+        if row is not None:
+            try:
+                x0,y0 = float(row['beamCenterX']),float(row['beamCenterY'])
+            except (KeyError,TypeError,ValueError):
+                x0 = y0 = np.nan
+            if np.isfinite(x0) and np.isfinite(y0):
+                return beam_roi(x0,y0,half_width)
+        return header_roi(fname,half_width)
+        
+    def get_catalog(self,path):
+        '''FileCatalog stored in the data directory, opened once per directory'''
+        path = pathlib.Path(path).resolve()
+        if path not in self.catalogs:
+            self.catalogs[path] = FileCatalog(path)
+        return self.catalogs[path]
+        
     def get_filedata(self,path):
         self.path = pathlib.Path(path)
         
-        filedata = []
-        for file in sorted(self.path.glob('*nxs*')):
-            with h5py.File(file,'r') as h5:
-                filedata.append({
-                    'filename':str(file.parts[-1]),
-                    'label':h5['entry/sample/description'][()][0].decode('utf8'),
-                    'countTime':'{:.2f}'.format(float(h5['entry/collection_time'][()][0])),
-                    'detectorDistance':'{:5.2f}'.format(h5['entry/DAS_logs/detectorPosition/softPosition'][()][0]),
-                    'wavelength':float(h5['entry/DAS_logs/wavelength/wavelength'][()][0]),
-                    'beamCenterX':float(h5['entry/instrument/detector/beam_center_x'][()][0]),
-                    'beamCenterY':float(h5['entry/instrument/detector/beam_center_y'][()][0]),
-                })
-        filedata = pd.DataFrame(filedata)
+        catalog = self.get_catalog(self.path)
+        filedata = catalog.scan_nexus(self.path,max_workers=self.max_workers)
+        filedata['countTime'] = filedata['countTime'].map('{:.2f}'.format)
+        filedata['detectorDistance'] = filedata['detectorDistance'].map('{:5.2f}'.format)
         return filedata
         
         
@@ -2,6 +2,24 @@ import struct
 import numpy as np
 import os
 
+_RAW_PIXEL_INDEX = None
+
+def rawPixelIndex():
+  '''
+  Position (in shorts after byte 514) of every pixel of the flattened rawCounts array,
+  following the skip pattern of RAWFile.SkipAndDecompress
+  '''
+  global _RAW_PIXEL_INDEX
+  if _RAW_PIXEL_INDEX is None:
+    index = np.empty(16384,dtype=np.int64)
+    skip = 0
+    for ii in range(16384):
+      if (((ii+skip)%1022)==0):
+        skip+=1
+      index[ii] = ii+skip
+    _RAW_PIXEL_INDEX = index
+  return _RAW_PIXEL_INDEX
+
 class RAWFile(object):
   def __init__(self,fileName,readFileNow=True):
     self.reset(fileName)
@@ -21,6 +39,15 @@ class RAWFile(object):
       self.readHeader()
       self.readDetector()
 
+  def readHeaderOnly(self):
+    '''
+    Parse the header from the first 514 bytes without reading the detector block
+    '''
+    with open(self.fileName,'rb') as f:
+      self.fileBytes = f.read(514)
+    self.readHeader()
+    self.fileBytes = None
+
   def readFile(self,force=False):
     if force or (self.fileBytes is not None): #already read
       return
@@ -287,6 +314,27 @@ class RAWFile(object):
     self.SANSData['rawCounts']     = rawDet
     # print('--> Done reading detector counts!')
   
+  def readDetectorROI(self,rows,cols):
+    '''
+    Read only the bytes of the detector block covering rawCounts[rows,cols]
+
+    rows,cols are slices of the 128x128 rawCounts array. The file is not read
+    completely (fileBytes is left untouched) and the header is not parsed.
+    '''
+    rows = range(128)[rows]
+    cols = range(128)[cols]
+    if len(rows)==0 or len(cols)==0:
+      return np.zeros((len(rows),len(cols)),dtype=int)
+    index = rawPixelIndex()
+    pixels = (np.array(rows)[:,None]*128 + np.array(cols)[None,:])
+    first = index[pixels.min()]
+    last = index[pixels.max()]
+    with open(self.fileName,'rb') as f:
+      f.seek(514+2*first)
+      block = np.frombuffer(f.read(2*(last-first+1)),dtype='<u2')
+    # values are read unsigned, for which Decompress is the identity
+    return block[index[pixels]-first].astype(int)
+
   def SkipAndDecompress(self,arr_in):
     '''
     Directly translated from NCNR_SANS_Package_7.50/NCNR_User_Procedures/Reduction/SANS/NCNR_DataReadWrite.ipf
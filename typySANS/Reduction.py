@@ -0,0 +1,287 @@
+'''
+Headless reduction of detector frames to absolute intensity
+
+Follows the standard NCNR (Igor) reduction:
+
+    S,E,B = sample, empty cell and blocked beam counts, each normalized to
+            monitor_norm monitor counts
+    COR   = (S - B) - (T_sam/T_emp)*(E - B)
+    ABS   = abs_scale * COR/DIV / (T_sam*thickness)
+
+optionally with a solid angle correction (see Calibration; off by default like
+the pyFAI integration engine), followed by a circular average to six-column ABS
+data. Variances are propagated assuming counting statistics for the raw frames.
+'''
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import h5py
+
+from typySANS.RAWFile import RAWFile
+from typySANS.SparseIntegrator import BatchIntegrator,config_key,geometry_from_RAW,geometry_from_nexus
+from typySANS.Resolution import resolution_from_RAW
+from typySANS.Calibration import Calibration,CalibrationStore
+from typySANS.Consolidate import read_stack_frame
+from typySANS.misc import split_stack_path
+
+ABS_COLUMNS = ['q','I','dI','dq','qbar','shadfac']
+
+def frame_from_RAW(fname,counts=True):
+    '''Read counts and the metadata needed for reduction from a RAW file
+
+    Arguments
+    ---------
+    fname: str or pathlib.Path
+        RAW file
+
+    counts: bool
+        read the detector counts. Otherwise only the header is read.
+
+    Returns
+    -------
+    frame: dict
+        counts (Ny,Nx) (if read), shape, monitor, transmission, thickness [cm],
+        geometry (see SparseIntegrator.geometry_from_RAW) and resolution (see
+        Resolution.resolution_from_RAW)
+    '''
+    raw = RAWFile(str(fname),readFileNow=counts)
+    if not counts:
+        raw.readHeaderOnly()
+    header = raw.SANSData
+    frame = {
+        'fname':str(fname),
+        'shape':(128,128),
+        'monitor':header['runMonitorCount'],
+        'transmission':header['sampleTransmission'],
+        'thickness':header['sampleThickness'],
+        'geometry':geometry_from_RAW(raw),
+        'resolution':resolution_from_RAW(raw),
+    }
+    if counts:
+        frame['counts'] = np.asarray(header['rawCounts'],dtype=float)
+    return frame
+
+def frame_from_nexus(fname,counts=True):
+    '''Read counts and the metadata needed for reduction from a Nexus file
+
+    Nexus files don't carry the aperture information needed for the q-resolution,
+    so resolution is None.
+
+    Returns
+    -------
+    frame: dict
+        See frame_from_RAW
+    '''
+    with h5py.File(fname,'r') as h5:
+        data = h5['entry/data/y']
+        frame = {
+            'fname':str(fname),
+            'shape':data.shape[::-1], #stored (Nx,Ny)
+            'monitor':float(h5['entry/control/monitor_counts'][()][0]),
+            'transmission':float(h5['entry/sample/transmission'][()][0]),
+            'thickness':float(h5['entry/sample/thickness'][()][0]),
+            'geometry':geometry_from_nexus(h5),
+            'resolution':None,
+        }
+        if counts:
+            frame['counts'] = np.asarray(data[()].T,dtype=float)
+    return frame
+
+def read_frame(fname,counts=True):
+    '''Read a RAW or Nexus (.nxs.ngb, .nxs.sans, .h5) file or a consolidated stack
+    member ("store.h5::filename"), see frame_from_RAW. With counts=False only the
+    metadata is read.'''
+    if split_stack_path(fname)[1] is not None:
+        return read_stack_frame(fname,counts)
+    if h5py.is_hdf5(fname):
+        return frame_from_nexus(fname,counts)
+    return frame_from_RAW(fname,counts)
+
+def correct_frames(counts,monitor,transmission,thickness,empty=None,blocked=None,div=None,abs_scale=1.0,monitor_norm=1e8):
+    '''Reduce a stack of frames to absolute intensity
+
+    Arguments
+    ---------
+    counts: np.ndarray
+        (N,Ny,Nx) raw detector counts
+
+    monitor,transmission,thickness: np.ndarray
+        (N,) monitor counts, sample transmissions and thicknesses [cm]
+
+    empty: dict or None
+        empty cell reference with keys counts (Ny,Nx), monitor and transmission
+
+    blocked: dict or None
+        blocked beam reference with keys counts (Ny,Nx) and monitor
+
+    div: np.ndarray or None
+        (Ny,Nx) detector sensitivity (DIV) file
+
+    abs_scale: float
+        absolute scale factor (kappa) from the open beam measurement
+
+    monitor_norm: float
+        monitor counts to normalize to
+
+    Returns
+    -------
+    I: np.ndarray
+        (N,Ny,Nx) corrected intensities
+
+    variance: np.ndarray
+        (N,Ny,Nx) variance of I
+    '''
+    calibration = Calibration(empty=empty,blocked=blocked,div=div,monitor_norm=monitor_norm)
+    return calibration.apply(counts,monitor,transmission,thickness,abs_scale)
+
+def _reduce_configuration(task):
+    '''Read and reduce all frames of one configuration (runs in a worker process)'''
+    frames = [read_frame(fname) for fname in task['files']]
+    I,variance = task['calibration'].apply(
+        counts=np.stack([f['counts'] for f in frames]),
+        monitor=[f['monitor'] for f in frames],
+        transmission=[f['transmission'] for f in frames],
+        thickness=[f['thickness'] for f in frames],
+        abs_scale=task['abs_scale'],
+    )
+    integrator = BatchIntegrator(
+        npt=task['npt'],
+        binning=task['binning'],
+        mask=task['mask'],
+        pixel_size=frames[0]['geometry']['pixel_size'],
+    )
+    configs = [config_key(f['geometry']) for f in frames]
+    ABS = integrator.integrate_ABS(I,configs,[f['resolution'] for f in frames],variance=variance)
+    return [f['fname'] for f in frames],ABS
+
+class ReductionPipeline:
+    '''Reduce RAW or Nexus sample files to ABS data
+
+    Sample files are grouped by configuration from their headers alone. Each
+    worker process then reads the counts of one configuration and reduces them in
+    one vectorized pass, so frames aren't read serially here and pickled to the
+    workers. Empty cell and blocked beam files are matched to the sample
+    configurations by detector distance and wavelength. The references and
+    corrections are kept in a CalibrationStore and reused across runs.
+
+    Arguments
+    ---------
+    npt: int
+        number of q-bins
+
+    binning: str or array-like
+        'linear', 'log' or explicit q-bin edges [1/Å]
+
+    div: np.ndarray or None
+        (Ny,Nx) detector sensitivity (DIV) file
+
+    abs_scale: float
+        absolute scale factor (kappa) from the open beam measurement
+
+    mask_store: Mask.MaskStore or None
+        source of the pixel masks for each configuration
+
+    monitor_norm: float
+        monitor counts to normalize to
+
+    solid_angle: bool
+        include the 1/cos^3(2θ) solid angle correction (see
+        Calibration.solid_angle_correction). Off by default, as in
+        CalibrationStore and in the pyFAI engine (correctSolidAngle=False).
+
+    max_workers: int or None
+        number of worker processes. With max_workers=1 everything runs in this
+        process.
+    '''
+    def __init__(self,npt=200,binning='linear',div=None,abs_scale=1.0,mask_store=None,monitor_norm=1e8,solid_angle=False,max_workers=None):
+        self.npt = npt
+        self.binning = binning
+        self.abs_scale = abs_scale
+        self.mask_store = mask_store
+        self.max_workers = max_workers
+        self.calibration_store = CalibrationStore(
+            read_frame,
+            div=div,
+            solid_angle=solid_angle,
+            monitor_norm=monitor_norm,
+        )
+
+    @staticmethod
+    def instrument_key(frame):
+        '''Configuration used to match references to samples'''
+        geometry = frame['geometry']
+        return (round(geometry['SDD'],1),round(geometry['wavelength'],2))
+
+    def get_mask(self,frame):
+        if self.mask_store is None:
+            return None
+        geometry = frame['geometry']
+        beamstop = 0.0 if frame['resolution'] is None else frame['resolution']['BS']
+        return self.mask_store.get(geometry['x0'],geometry['y0'],beamstop)
+
+    def build_tasks(self,samples,empty=(),blocked=()):
+        '''One task per configuration of the samples (frame dicts, with or without
+        counts), see _reduce_configuration'''
+        groups = {}
+        for frame in samples:
+            groups.setdefault(config_key(frame['geometry']),[]).append(frame)
+
+        references = {}
+        for name,files in (('empty',empty),('blocked',blocked)):
+            for fname in files:
+                frame = self.calibration_store.read(fname)
+                references.setdefault((name,self.instrument_key(frame)),[]).append(fname)
+
+        tasks = []
+        for frames in groups.values():
+            key = self.instrument_key(frames[0])
+            calibration = self.calibration_store.get(
+                frames[0]['geometry'],
+                empty=references.get(('empty',key),[]),
+                blocked=references.get(('blocked',key),[]),
+                shape=frames[0]['shape'],
+            )
+            tasks.append({
+                'files':[frame['fname'] for frame in frames],
+                'calibration':calibration,
+                'abs_scale':self.abs_scale,
+                'npt':self.npt,
+                'binning':self.binning,
+                'mask':self.get_mask(frames[0]),
+            })
+        return tasks
+
+    def run(self,files,empty=(),blocked=()):
+        '''Reduce sample files
+
+        Arguments
+        ---------
+        files: list
+            sample RAW or Nexus files
+
+        empty,blocked: list
+            empty cell and blocked beam RAW or Nexus files of any configuration
+
+        Returns
+        -------
+        results: dict
+            {filename: pandas.DataFrame} with the same columns as readABS and
+            one row per q-bin containing unmasked pixels
+        '''
+        samples = [read_frame(fname,counts=False) for fname in files]
+        tasks = self.build_tasks(samples,empty,blocked)
+
+        if self.max_workers==1 or len(tasks)<=1:
+            outputs = map(_reduce_configuration,tasks)
+        else:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                outputs = list(executor.map(_reduce_configuration,tasks))
+
+        results = {}
+        for fnames,ABS in outputs:
+            for fname,data in zip(fnames,ABS):
+                # empty bins (see BatchIntegrator.integrate_ABS) are left out
+                data = data[np.isfinite(data[:,1])]
+                results[fname] = pd.DataFrame(data,columns=ABS_COLUMNS)
+        return {str(fname):results[str(fname)] for fname in files}
@@ -0,0 +1,87 @@
+from matplotlib.backend_bases import FigureCanvasBase,TimerBase
+
+
+class RenderScheduler(object):
+    '''Coalesce bursts of widget events into a single (blitted) redraw per frame
+
+    Widget observers call request() with the keys (e.g. configurations) that need
+    updating. Requests are accumulated until a single-shot canvas timer fires, at
+    which point the render callback is called once with every key that changed
+    since the last frame. Canvases without a working timer (e.g. inline/Agg, whose
+    new_timer returns a TimerBase that never fires) render on every request. If
+    the canvas supports blitting, the registered artists are marked as animated and
+    only they are redrawn on top of a cached background.
+
+    Arguments
+    ---------
+    fig: matplotlib.figure.Figure
+        Figure to redraw
+
+    render: callable
+        Called as render(keys) with a set of keys. Should update the artist data and
+        return True if a full redraw is needed (e.g. axis limits changed).
+
+    interval: int
+        Frame interval in milliseconds
+    '''
+    def __init__(self,fig,render,interval=30):
+        self.fig = fig
+        self.canvas = fig.canvas
+        self.render = render
+        
+        # only canvases that can push partial updates to the screen (ipympl, GUI
+        # backends) benefit from blitting; static canvases (e.g. inline) just redraw
+        canvas_type = type(self.canvas)
+        self.blit = (
+            hasattr(canvas_type,'copy_from_bbox') 
+            and (canvas_type.blit is not FigureCanvasBase.blit)
+        )
+
+        self.artists    = []
+        self.background = None
+        self.dirty      = set()
+        self.scheduled  = False
+
+        self.timer = self.canvas.new_timer(interval=interval)
+        self.timer.single_shot = True
+        self.timer.add_callback(self.flush)
+        self.synchronous = type(self.timer) is TimerBase
+
+        if self.blit:
+            self.canvas.mpl_connect('draw_event',self.on_draw)
+
+    def add_artists(self,artists):
+        for artist in artists:
+            artist.set_animated(self.blit)
+            self.artists.append(artist)
+
+    def on_draw(self,event):
+        # cache everything but the animated artists, then put them back on top
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_artists()
+
+    def draw_artists(self):
+        for artist in sorted(self.artists,key=lambda a: a.get_zorder()):
+            if artist.get_visible():
+                artist.axes.draw_artist(artist)
+
+    def request(self,keys):
+        self.dirty.update(keys)
+        if self.synchronous:
+            self.flush()
+        elif not self.scheduled:
+            self.scheduled = True
+            self.timer.start()
+
+    def flush(self):
+        self.scheduled = False
+        keys,self.dirty = self.dirty,set()
+
+        redraw = self.render(keys)
+        if redraw or (not self.blit) or (self.background is None):
+            self.canvas.draw_idle()
+        else:
+            self.canvas.restore_region(self.background)
+            self.draw_artists()
+            self.canvas.blit(self.fig.bbox)
+            self.canvas.flush_events()
@@ -0,0 +1,211 @@
+'''
+Instrumental q-resolution of pinhole SANS
+
+Vectorized translation of getResolution from the NCNR Igor macros
+(NCNR_SANS_Package_7.50/NCNR_User_Procedures/Reduction/SANS/NCNR_Utils.ipf).
+For every q-bin this calculates the resolution width sigmaQ, the mean q of the
+resolution function QBar and the beamstop shadowing factor fSubS, i.e. the dq,
+meanQ and ShadowFactor columns of ABS files.
+'''
+import hashlib
+
+import numpy as np
+import pandas as pd
+import scipy.special
+
+from typySANS.misc import LRUCache
+
+RESOLUTION_KEYS = ('wavelength','dlambda','L1','L2','S1','S2','BS','lenses')
+
+def resolution_from_RAW(raw):
+    '''Read the resolution parameters from the header of a RAWFile or sqlRAWFile
+
+    Returns
+    -------
+    params: dict
+        wavelength [Å], dlambda (fractional FWHM), L1 and L2 [m], S1, S2 and BS
+        (diameters) [mm] and lenses (bool). See get_resolution.
+    '''
+    if hasattr(raw,'SANSData'):
+        header = raw.SANSData #RAWFile
+    else:
+        header = vars(raw) #sqlRAWFile
+
+    params = {
+        'wavelength':header['resolutionLambda'],
+        'dlambda':header['resolutionDLambda'],
+        'L1':header['resolutionAP1DIS'],
+        'L2':header['detectorDistance'],
+        'S1':header['resolutionAP1'],
+        'S2':header['resolutionAP2'],
+        'BS':header['detectorBeamStop'],
+        'lenses':header.get('resolutionNLenses',0)>0,
+    }
+    return params
+
+def get_resolution(q,wavelength,dlambda,L1,L2,S1,S2,BS,pixel_size=5.08,DDet=0.4,apOff=5.0,lenses=False):
+    '''Calculate the q-resolution of a pinhole SANS configuration
+
+    Arguments
+    ---------
+    q: np.ndarray
+        q-bin centers [1/Å]
+
+    wavelength: float
+        wavelength of neutron beam [Å]
+
+    dlambda: float
+        wavelength spread (FWHM dλ/λ)
+
+    L1: float
+        source aperture to sample aperture distance [m]
+
+    L2: float
+        sample to detector distance [m]
+
+    S1,S2: float
+        source and sample aperture diameters [mm]
+
+    BS: float
+        beamstop diameter [mm]
+
+    pixel_size: float
+        width of the q-bins on the detector (the pixel size) [mm]
+
+    DDet: float
+        detector spatial resolution (FWHM) [cm]
+
+    apOff: float
+        sample aperture to sample distance [cm]
+
+    lenses: bool
+        True if focusing lenses are in the beam
+
+    Returns
+    -------
+    sigmaQ: np.ndarray
+        standard deviation of the resolution function [1/Å]
+
+    QBar: np.ndarray
+        mean q of the resolution function [1/Å]
+
+    fSubS: np.ndarray
+        fraction of the resolution function not shadowed by the beamstop
+    '''
+    q = np.asarray(q,dtype=float)
+
+    vz_1 = 3.956e5 #velocity [cm/s] of 1 Å neutron
+    g = 981.0      #gravity [cm/s^2]
+
+    S1 = S1*0.5*0.1 #diameter [mm] -> radius [cm]
+    S2 = S2*0.5*0.1
+    L1 = L1*100.0 - apOff
+    L2 = L2*100.0 + apOff
+    del_r = pixel_size*0.1
+    BS = BS*0.5*0.1
+
+    # projected beamstop shadow, based on a point sample aperture
+    LB = 20.1 + 1.61*BS #beamstop to anode plane [cm] (empirical)
+    BS = BS + BS*LB/(L2-LB)
+
+    lp = 1.0/(1.0/L1 + 1.0/L2)
+    v_lambda = dlambda**2/6.0
+    if lenses:
+        v_b = 0.25*(S1*L2/L1)**2 + 0.25*(2.0/3.0)*(dlambda/wavelength)**2*(S2*L2/lp)**2
+    else:
+        v_b = 0.25*(S1*L2/L1)**2 + 0.25*(S2*L2/lp)**2
+    v_d = (DDet/2.3548)**2 + del_r**2/12.0 #FWHM -> gaussian sigma
+    vz = vz_1/wavelength
+    yg = 0.5*g*L2*(L1+L2)/vz**2
+    v_g = 2.0*(2.0*yg**2*v_lambda)
+
+    r0 = L2*np.tan(2.0*np.arcsin(wavelength*q/(4.0*np.pi)))
+    delta = 0.5*(BS-r0)**2/v_d
+    gammp = scipy.special.gammainc(1.5,delta)
+    inc_gamma = scipy.special.gamma(1.5)*np.where(r0<BS,1.0-gammp,1.0+gammp)
+
+    fSubS = 0.5*(1.0+scipy.special.erf((r0-BS)/np.sqrt(2.0*v_d)))
+    fSubS = np.where(fSubS<=0.0,1e-10,fSubS)
+
+    with np.errstate(divide='ignore',invalid='ignore'):
+        fr = 1.0 + np.sqrt(v_d)*np.exp(-1.0*delta)/(r0*fSubS*np.sqrt(2.0*np.pi))
+        fv = inc_gamma/(fSubS*np.sqrt(np.pi)) - r0**2*(fr-1.0)**2/v_d
+
+        rmd = fr*r0
+        v_r1 = v_b + fv*v_d + v_g
+        rm = rmd + 0.5*v_r1/rmd
+        v_r = np.clip(v_r1 - 0.5*(v_r1/rmd)**2,0.0,None)
+
+        QBar = (4.0*np.pi/wavelength)*np.sin(0.5*np.arctan(rm/L2))
+        sigmaQ = QBar*np.sqrt(v_r/rmd**2 + v_lambda)
+    return sigmaQ,QBar,fSubS
+
+class ResolutionCache:
+    '''LRU cache of q-resolutions keyed by configuration and q-bins
+
+    Every frame measured in the same configuration and reduced onto the same q-bins
+    has the same resolution, so batch reductions only calculate it once.
+
+    Arguments
+    ---------
+    maxsize: int
+        Maximum number of configurations to keep
+
+    **kwargs:
+        Fixed instrument parameters passed on to get_resolution (pixel_size,
+        DDet, apOff)
+    '''
+    def __init__(self,maxsize=64,**kwargs):
+        self.results = LRUCache(maxsize)
+        self.kwargs = kwargs
+
+    def key(self,q,params):
+        q = np.ascontiguousarray(q,dtype=float)
+        return (
+            tuple(float(params[k]) for k in RESOLUTION_KEYS),
+            q.shape,
+            hashlib.sha1(q).hexdigest(),
+        )
+
+    def get(self,q,params):
+        '''Return (sigmaQ,QBar,fSubS) for q-bins q and resolution parameters params'''
+        key = self.key(q,params)
+        result = self.results.get(key,None)
+        if result is None:
+            result = get_resolution(q,**params,**self.kwargs)
+            for arr in result:
+                arr.flags.writeable = False
+            self.results[key] = result
+        return result
+
+    def clear(self):
+        self.results.clear()
+
+RESOLUTION_CACHE = ResolutionCache()
+
+def to_ABS(q,I,dI,params,cache=RESOLUTION_CACHE):
+    '''Combine reduced data and its resolution into a six-column ABS table
+
+    Arguments
+    ---------
+    q,I,dI: np.ndarray
+        q-bin centers [1/Å], intensities and their uncertainties
+
+    params: dict
+        resolution parameters, see resolution_from_RAW
+
+    Returns
+    -------
+    df: pandas.Dataframe
+        A dataframe with the same columns as readABS: q, I, dI, dq, qbar, shadfac
+    '''
+    sigmaQ,QBar,fSubS = cache.get(q,params)
+    df = pd.DataFrame({
+        'q':q,
+        'I':I,
+        'dI':dI,
+        'dq':sigmaQ,
+        'qbar':QBar,
+        'shadfac':fSubS,
+    })
+    return df
@@ -0,0 +1,700 @@
+'''
+Headless 2D->1D reduction built on precomputed sparse pixel->bin matrices
+
+All functions here share the geometry conventions of IntegratorEngine: SDD in cm,
+wavelength in angstroms, beam center (x0,y0) in pixels measured from the detector
+edge (so pixel i spans i to i+1) and images indexed as [y,x].
+'''
+import numpy as np
+import scipy.sparse
+import h5py
+
+from typySANS.misc import LRUCache,mask_hash
+from typySANS.Resolution import RESOLUTION_CACHE
+
+CONFIG_KEYS = ('SDD','wavelength','x0','y0')
+
+def config_key(config):
+    '''Convert a configuration (dict or sequence of SDD,wavelength,x0,y0) to a hashable tuple'''
+    if isinstance(config,dict):
+        config = [config[k] for k in CONFIG_KEYS]
+    return tuple(float(v) for v in config)
+
+def pixel_q(SDD,wavelength,x0,y0,shape=(128,128),pixel_size=0.00508):
+    '''Calculate q [1/Å] at the center of every detector pixel
+
+    Arguments
+    ---------
+    SDD: float
+        sample to detector distance [cm]
+
+    wavelength: float
+        wavelength of neutron beam [angstroms]
+
+    x0,y0: float
+        beam center location [pixels]
+
+    shape: tuple
+        detector shape (Ny,Nx) [pixels]
+
+    pixel_size: float
+        detector pixel size [m]
+
+    Returns
+    -------
+    q: np.ndarray
+        Array of q values with the same shape as the detector
+    '''
+    Ny,Nx = shape
+    pixel_size = pixel_size*100.0 #cm
+    x = (np.arange(Nx)+0.5-x0)*pixel_size
+    y = (np.arange(Ny)+0.5-y0)*pixel_size
+    r = np.hypot(x[np.newaxis,:],y[:,np.newaxis])
+    two_theta = np.arctan2(r,SDD)
+    return 4.0*np.pi/wavelength*np.sin(two_theta/2.0)
+
+def linear_bin_edges(q,npt=200):
+    '''npt+1 linearly spaced bin edges spanning all q values on the detector
+
+    Like pyFAI, the range doesn't depend on the mask so that the bins of masked
+    and unmasked reductions line up.
+    '''
+    return np.linspace(np.nanmin(q),np.nanmax(q),npt+1)
+
+def log_bin_edges(q,npt=200):
+    '''npt+1 logarithmically spaced bin edges from the smallest non-zero q to the
+    largest q on the detector'''
+    q = q[np.isfinite(q)]
+    return np.geomspace(q[q>0].min(),q.max(),npt+1)
+
+def bin_edges(q,npt=200,binning='linear'):
+    '''Bin edges for a binning scheme
+
+    Arguments
+    ---------
+    q: np.ndarray
+        q of every (sub-)pixel on the detector
+
+    npt: int
+        number of bins for the 'linear' and 'log' schemes
+
+    binning: str or array-like
+        'linear', 'log' or explicit (increasing) bin edges [1/Å]
+    '''
+    if isinstance(binning,str):
+        if binning=='linear':
+            return linear_bin_edges(q,npt)
+        elif binning=='log':
+            return log_bin_edges(q,npt)
+        raise ValueError(f'Binning scheme not understood: {binning}')
+
+    edges = np.asarray(binning,dtype=float)
+    if edges.ndim!=1 or len(edges)<2 or np.any(np.diff(edges)<=0):
+        raise ValueError('User-specified bin edges must be a 1D, strictly increasing array')
+    return edges
+
+def bin_centers(edges,binning='linear'):
+    '''Arithmetic bin centers, or geometric ones for log binning'''
+    if isinstance(binning,str) and binning=='log':
+        return np.sqrt(edges[1:]*edges[:-1])
+    return 0.5*(edges[1:]+edges[:-1])
+
+def binning_key(binning):
+    '''Hashable version of a binning scheme'''
+    if isinstance(binning,str):
+        return binning
+    return tuple(np.asarray(binning,dtype=float))
+
+class PolarMap:
+    '''Polar coordinates of every (sub-)pixel for one detector geometry
+
+    Computing the map is the expensive part of setting up a reduction, so maps are
+    cached per geometry (see get_polar_map) and shared by all reduction modes.
+    Changing e.g. the sector angle then only rebuilds the bin index.
+
+    All attributes are flat arrays with one entry per sub-pixel:
+
+    pixel: index of the (raveled) detector pixel the sub-pixel belongs to
+    dx,dy: offset from the beam center [pixels]
+    q: magnitude of the scattering vector [1/Å]
+    phi: azimuthal angle, counterclockwise from +x [degrees, 0-360]
+
+    Arguments
+    ---------
+    SDD: float
+        sample to detector distance [cm]
+
+    wavelength: float
+        wavelength of neutron beam [angstroms]
+
+    x0,y0: float
+        beam center location [pixels]
+
+    shape: tuple
+        detector shape (Ny,Nx) [pixels]
+
+    pixel_size: float
+        detector pixel size [m]
+
+    oversample: int
+        split each pixel into oversample x oversample sub-pixels
+    '''
+    def __init__(self,SDD,wavelength,x0,y0,shape=(128,128),pixel_size=0.00508,oversample=1):
+        self.config = config_key((SDD,wavelength,x0,y0))
+        self.shape = tuple(shape)
+        self.oversample = oversample
+        self.npixels = shape[0]*shape[1]
+
+        Ny,Nx = shape
+        offsets = (np.arange(oversample)+0.5)/oversample
+        dx = (np.arange(Nx)[:,np.newaxis]+offsets).ravel()-x0
+        dy = (np.arange(Ny)[:,np.newaxis]+offsets).ravel()-y0
+        dx,dy = np.meshgrid(dx,dy)
+
+        rows,cols = np.indices(dx.shape)
+        self.pixel = ((rows//oversample)*Nx + cols//oversample).ravel()
+        self.dx = dx.ravel()
+        self.dy = dy.ravel()
+
+        r = np.hypot(self.dx,self.dy)*pixel_size*100.0 #cm
+        two_theta = np.arctan2(r,SDD)
+        self.q = 4.0*np.pi/wavelength*np.sin(two_theta/2.0)
+        self.phi = np.degrees(np.arctan2(self.dy,self.dx))%360.0
+
+    def weights(self,index,nbins,valid=None,mask=None,values=None):
+        '''Build a sparse matrix of the fraction of each pixel that falls in each bin
+
+        Arguments
+        ---------
+        index: np.ndarray
+            bin index of every sub-pixel. Indices outside [0,nbins) are ignored.
+
+        nbins: int
+            number of bins
+
+        valid: np.ndarray or None
+            boolean array, False for sub-pixels to ignore (e.g. outside a sector)
+
+        mask: np.ndarray or None
+            (Ny,Nx) boolean array, True for pixels to exclude
+
+        values: np.ndarray or None
+            per sub-pixel coordinate (e.g. q) to sum in each bin
+
+        Returns
+        -------
+        weights: scipy.sparse.csr_matrix
+            (nbins,npixels) matrix of pixel fractions
+
+        value_sum: np.ndarray or None
+            sum of weight*values in each bin
+        '''
+        keep = (index>=0) & (index<nbins)
+        if valid is not None:
+            keep &= valid
+        if mask is not None:
+            keep &= ~np.asarray(mask,dtype=bool).ravel()[self.pixel]
+
+        index = index[keep]
+        fraction = np.full(index.shape,1.0/self.oversample**2)
+
+        # duplicate (bin,pixel) entries are summed on conversion
+        weights = scipy.sparse.coo_matrix(
+            (fraction,(index,self.pixel[keep])),
+            shape=(nbins,self.npixels)
+        ).tocsr()
+
+        if values is None:
+            value_sum = None
+        else:
+            value_sum = np.bincount(index,weights=fraction*values[keep],minlength=nbins)
+        return weights,value_sum
+
+    def q_index(self,edges):
+        '''q-bin index of every sub-pixel (right edge included in the last bin)'''
+        index = np.searchsorted(edges,self.q,side='right')-1
+        index[self.q==edges[-1]] = len(edges)-2
+        return index
+
+_POLAR_MAPS = LRUCache(maxsize=32)
+def get_polar_map(SDD,wavelength,x0,y0,shape=(128,128),pixel_size=0.00508,oversample=1):
+    '''Return the (cached) PolarMap of a geometry'''
+    key = (config_key((SDD,wavelength,x0,y0)),tuple(shape),float(pixel_size),int(oversample))
+    polar = _POLAR_MAPS.get(key,None)
+    if polar is None:
+        polar = PolarMap(SDD,wavelength,x0,y0,shape,pixel_size,oversample)
+        polar.key = key
+        _POLAR_MAPS[key] = polar
+    return polar
+
+_BIN_EDGES = LRUCache(maxsize=128)
+def get_bin_edges(polar,npt=200,binning='linear'):
+    '''Return the (cached) q-bin edges of a PolarMap for a binning scheme'''
+    key = (polar.key,int(npt),binning_key(binning))
+    edges = _BIN_EDGES.get(key,None)
+    if edges is None:
+        edges = bin_edges(polar.q,npt,binning)
+        edges.flags.writeable = False
+        _BIN_EDGES[key] = edges
+    return edges
+
+def _header(raw):
+    if hasattr(raw,'SANSData'):
+        return raw.SANSData #RAWFile
+    return vars(raw) #sqlRAWFile
+
+def geometry_from_RAW(raw):
+    '''Read the detector geometry from the header of a RAWFile or sqlRAWFile
+
+    The beam center is used as stored in the header.
+
+    Returns
+    -------
+    config: dict
+        SDD [cm], wavelength [Å], x0, y0 [pixels] and pixel_size [m]
+    '''
+    header = _header(raw)
+    pixel_size = header.get('calX1',0.0)/1000.0 #mm -> m
+    if not (pixel_size>0):
+        pixel_size = 0.00508
+    config = {
+        'SDD':header['detectorDistance']*100.0, #m -> cm
+        'wavelength':header['resolutionLambda'],
+        'x0':header['detectorBeamX'],
+        'y0':header['detectorBeamY'],
+        'pixel_size':pixel_size,
+    }
+    return config
+
+def geometry_from_nexus(h5):
+    '''Read the detector geometry from a Nexus file
+
+    Arguments
+    ---------
+    h5: h5py.File or str or pathlib.Path
+        Open Nexus file or path to one
+
+    Returns
+    -------
+    config: dict
+        SDD [cm], wavelength [Å], x0, y0 [pixels] and pixel_size [m]
+    '''
+    if not isinstance(h5,h5py.File):
+        with h5py.File(h5,'r') as h5:
+            return geometry_from_nexus(h5)
+
+    try:
+        pixel_size = float(h5['entry/instrument/detector/x_pixel_size'][()][0])/1000.0 #mm -> m
+    except KeyError:
+        pixel_size = 0.00508
+    config = {
+        'SDD':float(h5['entry/DAS_logs/detectorPosition/softPosition'][()][0]),
+        'wavelength':float(h5['entry/DAS_logs/wavelength/wavelength'][()][0]),
+        'x0':float(h5['entry/instrument/detector/beam_center_x'][()][0]),
+        'y0':float(h5['entry/instrument/detector/beam_center_y'][()][0]),
+        'pixel_size':pixel_size,
+    }
+    return config
+
+class SparseAverager:
+    '''Average detector pixels into bins using a precomputed sparse weight matrix
+
+    For the (nbins,npixels) matrix of pixel fractions W, an image D with per-pixel
+    variance V and the averaged coordinate x (q or phi), each bin gets
+
+        counts = W @ 1
+        I      = (W @ D)/counts
+        dI     = sqrt(W**2 @ V)/counts
+        x_mean = sum(W*x)/counts
+
+    Empty bins average to zero. Subclasses build W for the different reduction
+    modes from a cached PolarMap.
+
+    Arguments
+    ---------
+    weights: scipy.sparse.csr_matrix
+        (nbins,npixels) matrix of pixel fractions
+
+    x: np.ndarray
+        bin centers
+
+    x_sum: np.ndarray
+        sum of weight*x in each bin
+    '''
+    def __init__(self,weights,x,x_sum):
+        self.weights = weights
+        self.weights_sq = weights.multiply(weights).tocsr()
+        self.x = x
+        self.counts = np.asarray(weights.sum(axis=1)).ravel()
+        with np.errstate(divide='ignore',invalid='ignore'):
+            self.norm = np.where(self.counts>0,1.0/self.counts,0.0)
+        self.x_mean = x_sum*self.norm
+
+    def set_geometry(self,SDD,wavelength,x0,y0,mask=None,shape=(128,128),pixel_size=0.00508,oversample=1):
+        '''Set the configuration, shape, mask and oversampling of a subclass
+
+        Returns
+        -------
+        polar: PolarMap
+            cached polar map of the geometry to build the weights from
+        '''
+        polar = get_polar_map(SDD,wavelength,x0,y0,shape,pixel_size,oversample)
+        self.config = polar.config
+        self.shape = polar.shape
+        self.mask = mask
+        self.oversample = oversample
+        return polar
+
+    @classmethod
+    def from_RAW(cls,raw,**kwargs):
+        '''Build an averager from the geometry in a RAWFile header'''
+        config = geometry_from_RAW(raw)
+        kwargs.setdefault('pixel_size',config.pop('pixel_size'))
+        return cls(**config,**kwargs)
+
+    @classmethod
+    def from_nexus(cls,h5,**kwargs):
+        '''Build an averager from the geometry in a Nexus file'''
+        config = geometry_from_nexus(h5)
+        kwargs.setdefault('pixel_size',config.pop('pixel_size'))
+        return cls(**config,**kwargs)
+
+    def average(self,data,variance=None):
+        '''Average an image or a stack of images
+
+        Arguments
+        ---------
+        data: np.ndarray
+            (Ny,Nx) image or (N,Ny,Nx) stack of images
+
+        variance: np.ndarray or None
+            per-pixel variance with the same shape as data. Defaults to counting
+            statistics, i.e. the (non-negative) data itself.
+
+        Returns
+        -------
+        I,dI: np.ndarray
+            average intensity and its propagated uncertainty, shape (nbins,) or (N,nbins)
+
+        counts: np.ndarray
+            (fractional) number of pixels in each bin
+
+        x_mean: np.ndarray
+            average coordinate (q or phi) of the pixels in each bin
+        '''
+        data = np.asarray(data,dtype=float)
+        if variance is None:
+            variance = np.clip(data,0,None)
+        npix = self.weights.shape[1]
+        frames = data.reshape(-1,npix).T
+        variance = np.asarray(variance,dtype=float).reshape(-1,npix).T
+
+        I  = self.weights.dot(frames)*self.norm[:,np.newaxis]
+        dI = np.sqrt(self.weights_sq.dot(variance))*self.norm[:,np.newaxis]
+
+        out_shape = data.shape[:-2]+(len(self.x),)
+        return I.T.reshape(out_shape),dI.T.reshape(out_shape),self.counts,self.x_mean
+
+class CircularAverager(SparseAverager):
+    '''Full circular average I(q)
+
+    Arguments
+    ---------
+    SDD: float
+        sample to detector distance [cm]
+
+    wavelength: float
+        wavelength of neutron beam [angstroms]
+
+    x0,y0: float
+        beam center location [pixels]
+
+    npt: int
+        number of q-bins
+
+    mask: np.ndarray or None
+        boolean array, True for pixels to exclude
+
+    shape: tuple
+        detector shape (Ny,Nx) [pixels]
+
+    pixel_size: float
+        detector pixel size [m]
+
+    oversample: int
+        split each pixel into oversample x oversample sub-pixels
+
+    binning: str or array-like
+        'linear', 'log' or explicit q-bin edges [1/Å]
+    '''
+    def __init__(self,SDD,wavelength,x0,y0,npt=200,mask=None,shape=(128,128),pixel_size=0.00508,oversample=1,binning='linear'):
+        polar = self.set_geometry(SDD,wavelength,x0,y0,mask,shape,pixel_size,oversample)
+        self.build_q_bins(polar,npt,binning)
+
+    def build_q_bins(self,polar,npt,binning,valid=None):
+        self.binning = binning
+        self.edges = get_bin_edges(polar,npt,binning)
+        nbins = len(self.edges)-1
+        weights,q_sum = polar.weights(polar.q_index(self.edges),nbins,valid=valid,mask=self.mask,values=polar.q)
+        SparseAverager.__init__(self,weights,bin_centers(self.edges,binning),q_sum)
+
+    @property
+    def q(self):
+        return self.x
+
+    @property
+    def q_mean(self):
+        return self.x_mean
+
+class SectorAverager(CircularAverager):
+    '''Sector average I(q) of the pixels within phi ± dphi
+
+    Uses the same q-bins as CircularAverager so the two can be compared directly.
+
+    Arguments
+    ---------
+    phi,dphi: float
+        center and half-width of the sector [degrees, counterclockwise from +x]
+
+    mirror: bool
+        also include the opposite sector at phi+180
+
+    See CircularAverager for the remaining arguments
+    '''
+    def __init__(self,SDD,wavelength,x0,y0,phi=0.0,dphi=15.0,mirror=True,npt=200,mask=None,shape=(128,128),pixel_size=0.00508,oversample=1,binning='linear'):
+        polar = self.set_geometry(SDD,wavelength,x0,y0,mask,shape,pixel_size,oversample)
+        self.phi = phi
+        self.dphi = dphi
+        self.mirror = mirror
+
+        # angular distance from the sector center, in [-180,180)
+        delta = (polar.phi-phi+180.0)%360.0-180.0
+        if mirror:
+            delta = (delta+90.0)%180.0-90.0
+        valid = np.abs(delta)<=dphi
+
+        self.build_q_bins(polar,npt,binning,valid=valid)
+
+class SlitAverager(CircularAverager):
+    '''Rectangular slit average I(q) of the pixels in a strip through the beam center
+
+    Arguments
+    ---------
+    phi: float
+        direction of the strip [degrees, counterclockwise from +x]
+
+    width: float
+        full width of the strip [pixels]
+
+    See CircularAverager for the remaining arguments
+    '''
+    def __init__(self,SDD,wavelength,x0,y0,phi=0.0,width=5.0,npt=200,mask=None,shape=(128,128),pixel_size=0.00508,oversample=1,binning='linear'):
+        polar = self.set_geometry(SDD,wavelength,x0,y0,mask,shape,pixel_size,oversample)
+        self.phi = phi
+        self.width = width
+
+        angle = np.radians(phi)
+        distance = -polar.dx*np.sin(angle) + polar.dy*np.cos(angle)
+        valid = np.abs(distance)<=(width/2.0)
+
+        self.build_q_bins(polar,npt,binning,valid=valid)
+
+class AnnulusAverager(SparseAverager):
+    '''Azimuthal profile I(phi) of the pixels with qmin <= q <= qmax
+
+    Arguments
+    ---------
+    qmin,qmax: float
+        q-range of the annulus [1/Å]
+
+    nphi: int
+        number of angular bins spanning 0-360 degrees
+
+    See CircularAverager for the remaining arguments
+    '''
+    def __init__(self,SDD,wavelength,x0,y0,qmin,qmax,nphi=72,mask=None,shape=(128,128),pixel_size=0.00508,oversample=1):
+        polar = self.set_geometry(SDD,wavelength,x0,y0,mask,shape,pixel_size,oversample)
+        self.qmin = qmin
+        self.qmax = qmax
+
+        self.edges = np.linspace(0.0,360.0,nphi+1)
+        index = np.minimum((polar.phi*nphi/360.0).astype(int),nphi-1)
+        valid = (polar.q>=qmin) & (polar.q<=qmax)
+        weights,phi_sum = polar.weights(index,nphi,valid=valid,mask=mask,values=polar.phi)
+        super().__init__(weights,0.5*(self.edges[1:]+self.edges[:-1]),phi_sum)
+
+    @property
+    def phi(self):
+        return self.x
+
+class BatchIntegrator:
+    '''Azimuthal integration of whole stacks of detector frames
+
+    Frames are grouped by configuration and each group is reduced with a single
+    sparse matrix product. The pixel->bin matrices are cached per configuration.
+
+    Arguments
+    ---------
+    npt: int
+        number of q-bins
+
+    mask: np.ndarray or None
+        boolean array, True for pixels to exclude
+
+    pixel_size: float
+        detector pixel size [m]
+
+    maxsize: int
+        Maximum number of configurations to keep matrices for
+
+    oversample: int
+        split each pixel into oversample x oversample sub-pixels
+
+    binning: str or array-like
+        'linear', 'log' or explicit q-bin edges [1/Å]
+    '''
+    def __init__(self,npt=200,mask=None,pixel_size=0.00508,maxsize=32,oversample=1,binning='linear'):
+        self.npt = npt
+        self.binning = binning
+        self.mask = mask
+        self.pixel_size = pixel_size
+        self.oversample = oversample
+        self.matrices = LRUCache(maxsize)
+
+    def get_matrix(self,config,shape=(128,128)):
+        '''Return the (cached) q-bins and pixel->bin matrix for a configuration'''
+        q,matrix,matrix_sq = self.get_matrices(config,shape)
+        return q,matrix
+
+    def get_matrices(self,config,shape=(128,128)):
+        '''Return the (cached) q-bins and the pixel->bin matrices for the intensity
+        and for its variance'''
+        config = config_key(config)
+        key = (config,tuple(shape),self.npt,binning_key(self.binning),self.oversample,mask_hash(self.mask))
+        result = self.matrices.get(key,None)
+        if result is None:
+            averager = CircularAverager(
+                *config,
+                npt=self.npt,
+                mask=self.mask,
+                shape=shape,
+                pixel_size=self.pixel_size,
+                oversample=self.oversample,
+                binning=self.binning,
+            )
+            matrix = scipy.sparse.diags(averager.norm).dot(averager.weights).tocsr()
+            matrix_sq = scipy.sparse.diags(averager.norm**2).dot(averager.weights_sq).tocsr()
+            result = (averager.q,matrix,matrix_sq)
+            self.matrices[key] = result
+        return result
+
+    def integrate(self,stack,configs,errors=False,variance=None):
+        '''Integrate a stack of frames
+
+        Arguments
+        ---------
+        stack: np.ndarray
+            (N,Ny,Nx) array of detector frames
+
+        configs: sequence
+            N configurations, one per frame. Each is either a dict with keys
+            SDD, wavelength, x0, y0 or a tuple of those values in that order.
+
+        errors: bool
+            also return the uncertainties of I
+
+        variance: np.ndarray or None
+            (N,Ny,Nx) per-pixel variance of the frames. Defaults to counting
+            statistics, i.e. the (non-negative) frames themselves.
+
+        Returns
+        -------
+        q: np.ndarray
+            (N,nbins) array of bin centers [1/Å]
+
+        I: np.ndarray
+            (N,nbins) array of averaged intensities
+
+        dI: np.ndarray
+            (N,nbins) array of uncertainties, only returned if errors is True
+        '''
+        stack = np.asarray(stack,dtype=float)
+        N = stack.shape[0]
+        shape = stack.shape[1:]
+        if len(configs)!=N:
+            raise ValueError(f'Need one configuration per frame. Got {len(configs)} for {N} frames.')
+
+        groups = {}
+        for i,config in enumerate(configs):
+            groups.setdefault(config_key(config),[]).append(i)
+
+        frames = stack.reshape(N,-1)
+        if errors:
+            if variance is None:
+                variance = np.clip(frames,0,None)
+            else:
+                variance = np.asarray(variance,dtype=float).reshape(N,-1)
+        nbins = self.npt if isinstance(self.binning,str) else len(self.binning)-1
+        q = np.empty((N,nbins))
+        I = np.empty((N,nbins))
+        dI = np.empty((N,nbins)) if errors else None
+        for config,index in groups.items():
+            q_bins,matrix,matrix_sq = self.get_matrices(config,shape)
+            I[index] = matrix.dot(frames[index].T).T
+            q[index] = q_bins
+            if errors:
+                dI[index] = np.sqrt(matrix_sq.dot(variance[index].T).T)
+        if errors:
+            return q,I,dI
+        return q,I
+
+    def integrate_ABS(self,stack,configs,resolutions,variance=None,cache=RESOLUTION_CACHE):
+        '''Integrate a stack of frames into six-column ABS data
+
+        The q-resolution is calculated once per configuration and reused for all
+        frames measured in it.
+
+        Arguments
+        ---------
+        stack,configs,variance:
+            See integrate
+
+        resolutions: sequence
+            N dicts of resolution parameters, one per frame (see
+            Resolution.resolution_from_RAW). Frames without resolution
+            parameters (None) get dq=NaN, qbar=q and shadfac=1.
+
+        cache: Resolution.ResolutionCache
+            cache of already calculated resolutions
+
+        Returns
+        -------
+        ABS: np.ndarray
+            (N,nbins,6) array with columns q, I, dI, dq, qbar, shadfac. I and dI
+            are NaN in bins without any unmasked pixel (e.g. the narrow low-q
+            bins of log binning), which are not data points.
+        '''
+        if len(resolutions)!=len(configs):
+            raise ValueError(f'Need one set of resolution parameters per frame. Got {len(resolutions)} for {len(configs)} frames.')
+        q,I,dI = self.integrate(stack,configs,errors=True,variance=variance)
+        shape = np.shape(stack)[1:]
+        empty = {}
+        for i,config in enumerate(configs):
+            config = config_key(config)
+            if config not in empty:
+                q_bins,matrix,matrix_sq = self.get_matrices(config,shape)
+                empty[config] = np.asarray(matrix.sum(axis=1)).ravel()==0
+            I[i,empty[config]] = np.nan
+            dI[i,empty[config]] = np.nan
+        ABS = np.empty(q.shape+(6,))
+        ABS[...,0] = q
+        ABS[...,1] = I
+        ABS[...,2] = dI
+        for i,params in enumerate(resolutions):
+            if params is None:
+                ABS[i,:,3] = np.nan
+                ABS[i,:,4] = q[i]
+                ABS[i,:,5] = 1.0
+            else:
+                ABS[i,:,3:] = np.stack(cache.get(q[i],params),axis=-1)
+        return ABS
@@ -6,14 +6,20 @@ import datetime
 
 from typySANS.misc import *
 from typySANS.ABSFile import *
+from typySANS.RenderScheduler import RenderScheduler
+from typySANS.ErrorBarCollection import ErrorBarCollection
 
 from ipywidgets import Dropdown,IntSlider,FloatLogSlider,FloatSlider,HBox,VBox,Output,Label,Checkbox,Tab
 
 class TrimPlot(object):
-    def __init__(self,df):
+    def __init__(self,df,cache_size=16):
         
         self.df_all = df #base NSORTPath dataframe
         
+        # parsed df_xy series of each system, filled ahead of time for the 
+        # neighbors of the selected system
+        self.data_cache = Prefetcher(self.read_system,maxsize=cache_size)
+        
         # all data_frames will have config index 
         # (corresponding to df.columns)
         self.df_xy             = None #I,q data
@@ -22,37 +28,92 @@ class TrimPlot(object):
         self.df_trim           = None #Lo/Hi data trim values
         
         self.shift_factors_out = None
+        self.scheduler         = None #coalesces slider events into redraws
+        self.slider_configs    = {}   #id(slider) -> config
+        self.bg_values         = {}   #config -> subtracted background
         
         colors = ['red','green','blue','orange','magenta']
         self.df_colors= pd.Series(colors[:df.shape[1]],index=df.columns)
         
-    def get_data(self,event):
-        sys_select = self.select.value
+    def read_system(self,sys_select):
+        '''Read the ABS files of all configurations of a system
+        
+        This is called from the prefetch thread so it must not touch any widgets
+        '''
         df_xy = []
         index = []
-        for i,(config,fpath) in enumerate(self.df_all.loc[sys_select].iteritems()):
+        for i,(config,fpath) in enumerate(self.df_all.loc[sys_select].items()):
             if pd.isna(fpath):
                 continue
             index.append(config)
-            sdf = readABS(fpath)[0]
+            sdf = readABS_cached(fpath)[0]
             df_xy.append(sdf.set_index('q',drop=False)[['q','I','dI']])
-        self.n_configs = len(index)
         index = pd.MultiIndex.from_tuples(index)
-        self.df_xy = pd.Series(df_xy,index=index)
-        self.df_xy = self.df_xy.sort_index(axis=0)
+        df_xy = pd.Series(df_xy,index=index)
+        df_xy = df_xy.sort_index(axis=0)
+        return df_xy
+    
+    def prefetch_neighbors(self):
+        '''Load the systems before and after the current one in the background'''
+        options = list(self.select.options)
+        index = options.index(self.select.value)
+        neighbors = [options[(index+1)%len(options)],options[index-1]]
+        self.data_cache.prefetch(neighbors)
+        
+    def get_data(self,event):
+        sys_select = self.select.value
+        self.df_xy = self.data_cache.get(sys_select)
+        self.n_configs = self.df_xy.shape[0]
+        self.prefetch_neighbors()
         
         if not self.df_lines is None:
             self.update_plot(None)
             
     def update_plot(self,event):
+        '''Observer for all plot controls
+
+        Redraws are coalesced by the RenderScheduler so that a burst of slider events
+        results in a single render of only the affected configurations.
+        '''
+        if self.scheduler is None:
+            return
+        
+        if event is None:
+            config = None
+        else:
+            config = self.slider_configs.get(id(event['owner']),None)
+        
+        if config is None:
+            self.scheduler.request(self.df_lines.index)
+        else:
+            self.scheduler.request([config])
+        
+    def render(self,configs):
+        '''Update the lines of the requested configurations
+        
+        Returns True if the axes limits changed and a full redraw is needed
+        '''
+        configs = set(configs)
+        
+        # trimming one configuration can change the shift factors of its neighbors
+        df_shift_old = self.df_shift
         self.build_shift_table()
-        self.bg_out.clear_output()
+        if df_shift_old is not None:
+            changed = df_shift_old.reindex(self.df_shift.index)!=self.df_shift
+            configs.update(self.df_shift.index[changed.values])
+        
         for i,(config,sdf) in enumerate(self.df_lines.iterrows()):
+            if not (config in configs):
+                continue
+                
             trimLo,trimHi,bgLoc = self.df_slider.loc[config].values
             
             if not (config in self.df_xy.index):
                 sdf['trim'].set_visible(False)
                 sdf['all'].set_visible(False)
+                sdf['bgy'].set_visible(False)
+                sdf['err'].set_visible(False)
+                self.bg_values.pop(config,None)
                 continue
             else:
                 sdf['trim'].set_visible(True)
@@ -60,6 +121,8 @@ class TrimPlot(object):
             
             x = self.df_xy.loc[config]['q'].values
             y = self.df_xy.loc[config]['I'].values
+            dy = self.df_xy.loc[config]['dI'].values
+            shift = self.df_shift.loc[config]
             
             trimLo = self.df_trim.loc[config]['Lo']
             trimHi = self.df_trim.loc[config]['Hi']
@@ -67,40 +130,49 @@ class TrimPlot(object):
 
 
             mask = x[sl]>bgLoc.value
-            sdf['bgx'].set_xdata(bgLoc.value)
+            sdf['bgx'].set_xdata([bgLoc.value])
             if self.apply_bg.value and (sum(mask)>0):
                 bgVal = y[sl][mask].mean()
             else:
                 bgVal = 0.0
-
-            with self.bg_out:
-                print('{}: {}'.format(config,bgVal))
+            self.bg_values[config] = bgVal
 
             if bgVal>0:
                 sdf['bgy'].set_visible(True)
-                sdf['bgy'].set_ydata(bgVal)
+                sdf['bgy'].set_ydata([bgVal])
             else:
                 sdf['bgy'].set_visible(False)
             
             sdf['all'].set_xdata(x)
             sdf['all'].set_ydata(y)
             sdf['trim'].set_xdata(x[sl])
-            sdf['trim'].set_ydata(y[sl]*self.df_shift.loc[config]-bgVal)
+            sdf['trim'].set_ydata(y[sl]*shift-bgVal)
+            sdf['err'].update_data(x[sl],y[sl]*shift-bgVal,dy[sl]*shift)
                 
             sdf['trim'].set_color(self.df_colors.loc[config])
             sdf['all'].set_color(self.df_colors.loc[config])
+            sdf['err'].set_color(self.df_colors.loc[config])
             
             # need to enforce zorder because matplotlib seems to scramble
             # the order randomly on update
             sdf['trim'].set_zorder(-i)
             sdf['all'].set_zorder(-i)
+            sdf['err'].set_zorder(-i)
             
-            # hide the original data if user desires
+            # hide the original data and error bars if user desires
             sdf['all'].set_visible(self.show_original.value)
+            sdf['err'].set_visible(self.show_errors.value)
+            
+        self.bg_out.clear_output()
+        with self.bg_out:
+            for config,bgVal in self.bg_values.items():
+                print('{}: {}'.format(config,bgVal))
 
-            # make sure data fits in range
-            plt.gca().relim()
-            plt.gca().autoscale()
+        # make sure data fits in range, only doing a full redraw if it doesn't
+        lims = (self.ax.get_xlim(),self.ax.get_ylim())
+        self.ax.relim()
+        self.ax.autoscale_view()
+        return lims!=(self.ax.get_xlim(),self.ax.get_ylim())
                 
     def init_plot(self):
         df_lines = []
@@ -115,12 +187,15 @@ class TrimPlot(object):
             dy1 = self.df_xy.loc[config]['dI'].values
             kw = {'ls':'None','ms':3,'marker':'o'}
             
-            # unfortunately error bars are uber difficult to update in matplotlib
-            # so we don't display them (for now)
-            # line1,_,_ = plt.errorbar(x1,y1,yerr=dy1,color=color,mfc='white',**kw)
-            # line2,_,_ = plt.errorbar(x1[sl],y1[sl],yerr=dy1[sl],color=color,**kw)
             line1, = plt.plot(x1,y1,color=color,mfc='white',**kw)
             line2, = plt.plot(x1[sl],y1[sl],color=color,label=config,**kw)
+            
+            # errorbar containers are uber difficult to update in matplotlib so
+            # the error bars of the trimmed data are drawn as a separate collection
+            err = ErrorBarCollection(capacity=len(x1),color=color,lw=0.5)
+            err.update_data(x1[sl],y1[sl],dy1[sl])
+            err.set_visible(self.show_errors.value)
+            plt.gca().add_collection(err,autolim=False)
 
             # show bg_subtraction
             bgLoc.value = x1[-10] # set the initial location of the bg subtractor
@@ -128,6 +203,7 @@ class TrimPlot(object):
             line4 = plt.axvline(bgLoc.value,color=color,ls=':',lw=0.5)
             line3.set_visible(False) # hide the bg subtraction value (y) until user changes to something reasonable
 
+            self.bg_values[config] = y1[-10:].mean()
             with self.bg_out:
                 print('{}: {}'.format(config,y1[-10:].mean()))
 
@@ -136,8 +212,9 @@ class TrimPlot(object):
             # the order randomly on update
             line1.set_zorder(-i)
             line2.set_zorder(-i)
+            err.set_zorder(-i)
             
-            df_lines.append([line1,line2,line3,line4])
+            df_lines.append([line1,line2,line3,line4,err])
         plt.gca().set_xscale('log')
         plt.gca().set_yscale('log')
         plt.gca().set_ylabel('dΣ/dΩ [$cm^{-1}$]')
@@ -145,7 +222,11 @@ class TrimPlot(object):
         leg = plt.legend()
         # leg = plt.legend(bbox_to_anchor=(1.05,0.5),loc=6)
         # leg.set_draggable(True)
-        self.df_lines = pd.DataFrame(df_lines,columns=['all','trim','bgy','bgx'],index=self.df_xy.index)
+        self.df_lines = pd.DataFrame(df_lines,columns=['all','trim','bgy','bgx','err'],index=self.df_xy.index)
+        
+        self.ax = plt.gca()
+        self.scheduler = RenderScheduler(self.ax.figure,self.render)
+        self.scheduler.add_artists(self.df_lines.values.ravel())
         
     def build_shift_table(self):
         shiftConfig = eval(self.shift_config.value)
@@ -189,6 +270,9 @@ class TrimPlot(object):
             sl3 = FloatLogSlider(min=-3,max=0,value=0.5,description='{}'.format(config))
             sl3.style.handle_color = self.df_colors.loc[config]
             vbox3.append(sl3)
+            
+            for slider in (sl1,sl2,sl3):
+                self.slider_configs[id(slider)] = config
         widget.append(HBox([VBox(vbox1), VBox(vbox2)]))
         
         ## store slider objects in dataframe
@@ -201,7 +285,8 @@ class TrimPlot(object):
         self.shift_config = Dropdown(options=ops,description='Shift-To:')
         self.shift_factors_out = Output()
         self.show_original = Checkbox(value=True,description='Show Original Data')
-        vbox4 = [VBox([self.shift_config,self.show_original]),self.shift_factors_out]
+        self.show_errors = Checkbox(value=False,description='Show Error Bars')
+        vbox4 = [VBox([self.shift_config,self.show_original,self.show_errors]),self.shift_factors_out]
 
         # widget.append(HBox([VBox(vbox3),VBox(vbox4)]))
         self.bg_out = Output()
@@ -221,15 +306,16 @@ class TrimPlot(object):
         widget = self.build_widget()
         
         self.get_data(None)# init data reading
-        self.select.observe(self.get_data) #observer for system update
+        self.select.observe(self.get_data,names='value') #observer for system update
         self.build_shift_table()
         
         # init plot and plot-update observers 
         self.init_plot()
-        self.df_slider.applymap(lambda x: x.observe(self.update_plot))
-        self.shift_config.observe(self.update_plot)
-        self.show_original.observe(self.update_plot)
-        self.apply_bg.observe(self.update_plot)
+        self.df_slider.applymap(lambda x: x.observe(self.update_plot,names='value'))
+        self.shift_config.observe(self.update_plot,names='value')
+        self.show_original.observe(self.update_plot,names='value')
+        self.show_errors.observe(self.update_plot,names='value')
+        self.apply_bg.observe(self.update_plot,names='value')
         
         return widget
     
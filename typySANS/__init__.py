@@ -1,5 +1,5 @@
 from typySANS.misc import *
-from typySANS.ABSFile import readABS,writeABS
+from typySANS.ABSFile import readABS,readABS_cached,writeABS
 from typySANS.TrimPlot import TrimPlot
 from typySANS.MultiPlotABS import MultiPlotABS
 
@@ -1,5 +1,9 @@
 import numpy as np
 import pandas as pd
+import collections
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 def buildShiftTable(df_xy,df_trim,shiftConfig):
     n_configs = df_xy.shape[0]
@@ -83,3 +87,131 @@ def for_all_methods(decorator):
                 setattr(cls, attr, decorator(getattr(cls, attr)))
         return cls
     return decorate
+
+STACK_SEPARATOR = '::'
+
+def split_stack_path(fname):
+    '''Split a consolidated stack member path "store.h5::member" into (store,member)
+    
+    member is None for regular file paths (see Consolidate)
+    '''
+    fname = str(fname)
+    if STACK_SEPARATOR in fname:
+        store,member = fname.rsplit(STACK_SEPARATOR,1)
+        return store,member
+    return fname,None
+
+def mask_hash(mask):
+    '''Short, hashable digest of a boolean pixel mask (None if no mask)'''
+    if mask is None:
+        return None
+    mask = np.asarray(mask,dtype=bool)
+    digest = hashlib.sha1(np.packbits(mask)).hexdigest()
+    return (mask.shape,digest)
+
+class LRUCache(object):
+    '''Bounded, thread-safe least-recently-used cache
+    
+    Arguments
+    ---------
+    maxsize: int
+        Maximum number of entries. The least recently accessed entry is evicted
+        when this is exceeded.
+    '''
+    def __init__(self,maxsize=32):
+        self.maxsize = maxsize
+        self.data = collections.OrderedDict()
+        self.lock = threading.Lock()
+        
+    def __len__(self):
+        return len(self.data)
+    
+    def __contains__(self,key):
+        with self.lock:
+            return key in self.data
+        
+    def __getitem__(self,key):
+        with self.lock:
+            value = self.data[key]
+            self.data.move_to_end(key)
+        return value
+    
+    def __setitem__(self,key,value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data)>self.maxsize:
+                self.data.popitem(last=False)
+                
+    def get(self,key,default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+        
+    def pop(self,key,default=None):
+        with self.lock:
+            return self.data.pop(key,default)
+        
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            
+class Prefetcher(object):
+    '''LRU cache whose entries can be loaded ahead of time by a background thread
+    
+    Arguments
+    ---------
+    loader: callable
+        Called as loader(key) to produce the value for a key. Must be safe to call
+        from a worker thread.
+        
+    maxsize: int
+        Maximum number of cached values
+        
+    max_workers: int
+        Number of background loader threads
+    '''
+    def __init__(self,loader,maxsize=32,max_workers=1):
+        self.loader = loader
+        self.cache = LRUCache(maxsize)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = {}
+        self.lock = threading.Lock()
+        
+    def load(self,key):
+        try:
+            value = self.loader(key)
+            self.cache[key] = value
+            return value
+        finally:
+            with self.lock:
+                self.pending.pop(key,None)
+                
+    def prefetch(self,keys):
+        '''Queue keys for loading in the background if not already cached'''
+        for key in keys:
+            with self.lock:
+                if (key in self.cache) or (key in self.pending):
+                    continue
+                self.pending[key] = self.executor.submit(self.load,key)
+                
+    def get(self,key):
+        '''Return a cached value, waiting on a pending prefetch or loading it if needed'''
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        
+        with self.lock:
+            future = self.pending.get(key,None)
+            
+        if future is not None:
+            return future.result()
+        return self.load(key)
+    
+    def clear(self):
+        self.cache.clear()
+        
+    def shutdown(self):
+        self.executor.shutdown(wait=False)